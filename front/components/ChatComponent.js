@@ -109,17 +109,31 @@ class ChatComponent {
             }
         }, 10000);
         
+        let streamingMessage = null;
+
         try {
             this.setLoadingState(true);
-            const responseData = await this.apiService.askQuestion(message);
+            const responseData = await this.apiService.askQuestionStream(message, (delta, text) => {
+                if (!streamingMessage) {
+                    clearTimeout(updateTimeout);
+                    this.hideLoadingMessage(loadingMessage);
+                    streamingMessage = MessageComponent.create('assistant', '');
+                    this.messagesContainer.appendChild(streamingMessage);
+                }
+                MessageComponent.updateContent(streamingMessage, MessageComponent.formatText(text));
+                scrollToBottom(this.messagesContainer);
+            });
             clearTimeout(updateTimeout);
             this.hideLoadingMessage(loadingMessage);
+            // Итоговое сообщение заменяет потоковое, чтобы получить индикаторы сценария
+            this.hideLoadingMessage(streamingMessage);
             this.addAssistantMessage(responseData.response, responseData);
             
         } catch (error) {
             console.error('Error sending message:', error);
             clearTimeout(updateTimeout);
             this.hideLoadingMessage(loadingMessage);
+            this.hideLoadingMessage(streamingMessage);
             this.addErrorMessage(error.message || 'An error occurred while processing the request');
             
         } finally {
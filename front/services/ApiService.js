@@ -109,6 +109,109 @@ class ApiService {
         }
     }
 
+    async askQuestionStream(question, onToken) {
+        const url = `${this.baseUrl}/v1/question/stream`;
+        const requestData = {
+            question: question,
+            user_id: this.userId
+        };
+
+        console.log(`Отправка потокового POST запроса к: ${url}`);
+        const startTime = Date.now();
+
+        const response = await fetch(url, {
+            method: 'POST',
+            headers: {
+                ...this.defaultHeaders,
+                'Accept': 'text/event-stream',
+                'Cache-Control': 'no-cache'
+            },
+            body: JSON.stringify(requestData)
+        });
+
+        // Сервер без поддержки стриминга - используем обычный запрос
+        if (response.status === 404 || response.status === 405 || !response.body) {
+            console.warn('Streaming endpoint unavailable, falling back to /v1/question');
+            return this.askQuestion(question);
+        }
+
+        if (!response.ok) {
+            const errorText = await response.text();
+            throw new Error(`Ошибка сервера: HTTP error! status: ${response.status}, body: ${errorText.substring(0, 200)}. Попробуйте позже.`);
+        }
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder('utf-8');
+        let buffer = '';
+        let text = '';
+        let data = null;
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+
+            buffer += decoder.decode(value, { stream: true });
+            let separatorIndex;
+            while ((separatorIndex = buffer.indexOf('\n\n')) !== -1) {
+                const rawEvent = buffer.slice(0, separatorIndex);
+                buffer = buffer.slice(separatorIndex + 2);
+
+                const event = this.parseSseEvent(rawEvent);
+                if (!event) continue;
+
+                if (event.event === 'token') {
+                    text += event.data.delta;
+                    onToken(event.data.delta, text);
+                } else if (event.event === 'done') {
+                    data = event.data;
+                } else if (event.event === 'error') {
+                    throw new Error(`Ошибка сервера: ${event.data.detail}. Попробуйте позже.`);
+                }
+            }
+        }
+
+        console.log(`Потоковый запрос выполнен за ${Date.now() - startTime}ms`);
+
+        if (!data) {
+            throw new Error('Произошла ошибка: поток ответа прервался. Попробуйте обновить страницу.');
+        }
+
+        if (data.user_id && data.user_id !== this.userId) {
+            this.userId = data.user_id;
+            localStorage.setItem('user_id', this.userId);
+        }
+
+        return {
+            response: data.response || text || 'Нет ответа от сервера',
+            scenario_active: data.scenario_active || false,
+            scenario_name: data.scenario_name || null,
+            scenario_completed: data.scenario_completed || false,
+            source: data.source || 'rag'
+        };
+    }
+
+    parseSseEvent(rawEvent) {
+        let event = 'message';
+        const dataLines = [];
+
+        for (const line of rawEvent.split('\n')) {
+            if (line.startsWith('event:')) {
+                event = line.slice(6).trim();
+            } else if (line.startsWith('data:')) {
+                dataLines.push(line.slice(5).trimStart());
+            }
+        }
+
+        if (dataLines.length === 0) return null;
+
+        try {
+            return { event: event, data: JSON.parse(dataLines.join('\n')) };
+        } catch (error) {
+            console.error('Failed to parse SSE event:', rawEvent, error);
+            return null;
+        }
+    }
+
     async checkHealth() {
         try {
             const controller = new AbortController();
@@ -0,0 +1,65 @@
+import argparse
+import json
+from collections import defaultdict
+
+from benchmark.run import percentile
+
+
+def load_calls(path: str) -> list:
+    with open(path, encoding="utf-8") as f:
+        return [record for record in (json.loads(line) for line in f if line.strip()) if "m" not in record]
+
+
+def report(calls: list) -> dict:
+    """
+    Сводка кассеты по ключам промптов: задержки, токены, ошибки и доля повторных запросов -
+    столько обращений мог бы обслужить кеш ответов LLM при точном совпадении запроса.
+    """
+    groups = defaultdict(list)
+    for call in calls:
+        groups[call["prompt_key"]].append(call)
+
+    rows = {}
+    for prompt_key, group in sorted(groups.items()):
+        keys = set()
+        repeats = 0
+        for call in group:
+            if call["key"] in keys:
+                repeats += 1
+            keys.add(call["key"])
+        durations = [call["ms"] for call in group]
+        usage = [call["usage"] for call in group if call.get("usage")]
+        rows[prompt_key] = {
+            "calls": len(group),
+            "errors": sum(1 for call in group if "error" in call),
+            "p50_ms": percentile(durations, 50),
+            "p95_ms": percentile(durations, 95),
+            "p99_ms": percentile(durations, 99),
+            "input_tokens": sum(u[0] for u in usage),
+            "output_tokens": sum(u[1] for u in usage),
+            "cached_input_tokens": sum(u[2] for u in usage),
+            "repeat_share": round(repeats / len(group), 3),
+        }
+    span = (max(call["ts"] for call in calls) - min(call["ts"] for call in calls)) if calls else 0
+    return {"calls": len(calls), "span_seconds": round(span, 1), "by_prompt_key": rows}
+
+
+def print_report(summary: dict):
+    print(f"обращений: {summary['calls']} за {summary['span_seconds']} с")
+    print(f"{'prompt_key':<36}{'вызовов':>9}{'ошибок':>8}{'p50 мс':>10}{'p95 мс':>10}{'p99 мс':>10}{'in ток.':>10}{'out ток.':>10}{'cached':>10}{'повторы':>9}")
+    for prompt_key, row in summary["by_prompt_key"].items():
+        print(f"{prompt_key:<36}{row['calls']:>9}{row['errors']:>8}{row['p50_ms']!s:>10}{row['p95_ms']!s:>10}{row['p99_ms']!s:>10}"
+              f"{row['input_tokens']:>10}{row['output_tokens']:>10}{row['cached_input_tokens']:>10}{row['repeat_share']:>9.1%}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Сводка по кассете обращений к LLM (llm.cassette.mode = record)")
+    parser.add_argument("path", help="Файл кассеты")
+    parser.add_argument("--json", action="store_true", help="Вывести сводку в JSON")
+    args = parser.parse_args()
+
+    summary = report(load_calls(args.path))
+    if args.json:
+        print(json.dumps(summary, ensure_ascii=False, indent=2))
+    else:
+        print_report(summary)
@@ -0,0 +1,208 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import time
+from collections import Counter
+from dataclasses import dataclass
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# Слова для ответа генерации: один элемент ~ один токен
+_WORDS = ("the", "plan", "value", "choice", "step", "focus", "rest", "week", "goal", "habit", "balance", "energy")
+
+
+@dataclass
+class MockSettings:
+    latency: str = "lognormal:800,0.5"
+    ttft_fraction: float = 0.3
+    stream_chunks: int = 20
+    completion_tokens: int = 150
+    error_rate: float = 0.0
+    rate_limit_rate: float = 0.0
+    seed: int = 42
+
+
+def parse_latency(spec: str):
+    """
+    Распределение задержки ответа (мс): fixed:800, uniform:300,1500, lognormal:800,0.5 (медиана и sigma).
+    Возвращает функцию, которая выбирает задержку в секундах.
+    """
+    kind, _, params = spec.partition(":")
+    values = [float(v) for v in params.split(",") if v]
+    if kind == "fixed":
+        return lambda rng: values[0] / 1000
+    if kind == "uniform":
+        return lambda rng: rng.uniform(values[0], values[1]) / 1000
+    if kind == "lognormal":
+        median, sigma = values[0], values[1] if len(values) > 1 else 0.5
+        return lambda rng: median * rng.lognormvariate(0, sigma) / 1000
+    raise ValueError(f"Неизвестное распределение задержки: {spec}")
+
+
+def classify_prompt(messages: list) -> tuple:
+    """
+    Вид обращения по промпту из prompts.yml и детерминированный ответ для служебных промптов:
+    решения триггеров, оценки ответов и согласия нужны, чтобы сценарии проходили до конца.
+    """
+    prompt = messages[-1]["content"] if messages else ""
+    if "User's message:" in prompt and 'Answer only "YES"' in prompt:
+        instructions, _, user_message = prompt.rpartition("User's message:")
+        user_message = user_message.lower()
+        if "carnivore" in instructions:
+            return "trigger", "YES" if "carnivore" in user_message else "NO"
+        return "trigger", "YES" if "overwhelm" in user_message else "NO"
+    if 'Answer only "YES" if the answer is a valid' in prompt:
+        return "evaluate", "YES"
+    if 'Answer only "AGREED"' in prompt:
+        return "consent", "AGREED"
+    if prompt.startswith("You maintain a running summary"):
+        return "summary", None
+    return "generation", None
+
+
+class MockLLM:
+    """OpenAI-совместимый /v1/chat/completions с настраиваемыми задержкой, ошибками и числом токенов"""
+
+    def __init__(self, settings: MockSettings):
+        self.settings = settings
+        self.rng = random.Random(settings.seed)
+        self.latency = parse_latency(settings.latency)
+        self.seen_prefixes = set()
+        self.calls = Counter()
+        self.errors = Counter()
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_tokens = 0
+
+    def _usage(self, messages: list, completion_tokens: int) -> dict:
+        prompt_tokens = sum(len(str(m.get("content", ""))) for m in messages) // 4 + 4 * len(messages)
+        # Кеш префикса провайдера: системное сообщение, которое уже встречалось
+        cached = 0
+        if messages and messages[0].get("role") == "system":
+            prefix = hashlib.sha256(messages[0]["content"].encode()).hexdigest()
+            if prefix in self.seen_prefixes:
+                cached = len(messages[0]["content"]) // 4
+            self.seen_prefixes.add(prefix)
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        self.cached_tokens += cached
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": cached},
+        }
+
+    def _text(self, answer, max_tokens) -> str:
+        if answer is not None:
+            return answer
+        count = max(1, int(self.rng.gauss(self.settings.completion_tokens, self.settings.completion_tokens * 0.2)))
+        if max_tokens:
+            count = min(count, int(max_tokens))
+        return " ".join(self.rng.choice(_WORDS) for _ in range(count)) + "."
+
+    async def chat_completions(self, request: Request):
+        body = await request.json()
+        messages = body.get("messages", [])
+        kind, answer = classify_prompt(messages)
+        self.calls[kind] += 1
+
+        roll = self.rng.random()
+        if roll < self.settings.rate_limit_rate:
+            self.errors["429"] += 1
+            await asyncio.sleep(self.latency(self.rng) * 0.1)
+            return JSONResponse({"error": {"message": "Rate limit exceeded", "type": "rate_limit"}}, status_code=429, headers={"Retry-After": "1"})
+        if roll < self.settings.rate_limit_rate + self.settings.error_rate:
+            self.errors["500"] += 1
+            await asyncio.sleep(self.latency(self.rng))
+            return JSONResponse({"error": {"message": "Mock upstream error", "type": "server_error"}}, status_code=500)
+
+        delay = self.latency(self.rng)
+        text = self._text(answer, body.get("max_tokens"))
+        usage = self._usage(messages, max(1, len(text.split())))
+        model = body.get("model", "mock")
+
+        if not body.get("stream"):
+            await asyncio.sleep(delay)
+            return JSONResponse({
+                "id": "mock", "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                "usage": usage,
+            })
+        return StreamingResponse(self._stream(text, usage, model, delay), media_type="text/event-stream")
+
+    async def _stream(self, text: str, usage: dict, model: str, delay: float):
+        words = text.split(" ")
+        chunks = max(1, min(self.settings.stream_chunks, len(words)))
+        step = -(-len(words) // chunks)
+        await asyncio.sleep(delay * self.settings.ttft_fraction)
+        interval = delay * (1 - self.settings.ttft_fraction) / chunks
+        for start in range(0, len(words), step):
+            piece = " ".join(words[start:start + step]) + (" " if start + step < len(words) else "")
+            chunk = {"id": "mock", "object": "chat.completion.chunk", "created": 0, "model": model,
+                     "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]}
+            yield f"data: {json.dumps(chunk)}\n\n"
+            await asyncio.sleep(interval)
+        final = {"id": "mock", "object": "chat.completion.chunk", "created": 0, "model": model, "choices": [], "usage": usage}
+        yield f"data: {json.dumps(final)}\n\ndata: [DONE]\n\n"
+
+    def get_stats(self) -> dict:
+        return {
+            "calls": dict(self.calls),
+            "errors": dict(self.errors),
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cached_tokens": self.cached_tokens,
+        }
+
+    def reset(self):
+        self.calls.clear()
+        self.errors.clear()
+        self.prompt_tokens = self.completion_tokens = self.cached_tokens = 0
+
+
+def create_app(settings: MockSettings) -> FastAPI:
+    mock = MockLLM(settings)
+    app = FastAPI()
+    app.add_api_route("/v1/chat/completions", mock.chat_completions, methods=["POST"])
+    app.add_api_route("/stats", mock.get_stats, methods=["GET"])
+    app.add_api_route("/stats/reset", mock.reset, methods=["POST"])
+    return app
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    defaults = MockSettings()
+    parser.add_argument("--latency", default=defaults.latency, help="Задержка ответа, мс: fixed:800 | uniform:300,1500 | lognormal:800,0.5")
+    parser.add_argument("--ttft-fraction", type=float, default=defaults.ttft_fraction, help="Доля задержки до первого фрагмента потокового ответа")
+    parser.add_argument("--stream-chunks", type=int, default=defaults.stream_chunks, help="Число фрагментов потокового ответа")
+    parser.add_argument("--completion-tokens", type=int, default=defaults.completion_tokens, help="Среднее число токенов в ответе генерации")
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate, help="Доля ответов 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=defaults.rate_limit_rate, help="Доля ответов 429")
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+
+
+def settings_from_args(args) -> MockSettings:
+    return MockSettings(
+        latency=args.latency,
+        ttft_fraction=args.ttft_fraction,
+        stream_chunks=args.stream_chunks,
+        completion_tokens=args.completion_tokens,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        seed=args.seed,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Локальный OpenAI-совместимый сервер LLM для нагрузочного тестирования")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=7100)
+    add_arguments(parser)
+    args = parser.parse_args()
+    parse_latency(args.latency)
+
+    uvicorn.run(create_app(settings_from_args(args)), host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,383 @@
+import argparse
+import asyncio
+import datetime
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+import httpx
+
+from benchmark import mock_llm
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Вопросы RAG без ключевых слов сценариев: префильтр триггеров пропускает их без обращения к LLM
+RAG_QUESTIONS = [
+    "What is ethics?",
+    "How do I make a fair decision when two friends disagree?",
+    "What does honesty mean in a workplace?",
+    "How can I be more consistent with my long-term goals?",
+    "Is it wrong to keep a promise that hurts someone?",
+    "How should I think about responsibility to my family?",
+    "What is the difference between values and principles?",
+    "How do I apologize properly?",
+]
+# Сообщения, запускающие сценарии (mock LLM отвечает YES на "carnivore" и "overwhelm")
+SURVEY_TRIGGERS = {
+    "vegans": ["I'm done with vegan, want to try carnivore.", "Thinking of switching from vegan to carnivore, is that a good idea?"],
+    "employee": ["Feeling a bit overwhelmed, do I need a break?", "I got a long week ahead and feel overwhelmed by my workload."],
+}
+SURVEY_MAX_TURNS = 60
+
+
+@dataclass
+class TurnResult:
+    kind: str
+    latency: float
+    ok: bool
+    ttft: Optional[float] = None
+
+
+@dataclass
+class RunStats:
+    turns: List[TurnResult] = field(default_factory=list)
+    flows: Dict[str, int] = field(default_factory=dict)
+    incomplete_surveys: int = 0
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """Процентиль по ближайшему рангу; None для пустой выборки"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+def latency_summary(values: List[float]) -> dict:
+    return {name: round(percentile(values, q) * 1000, 1) if values else None for name, q in (("p50", 50), ("p95", 95), ("p99", 99), ("max", 100))}
+
+
+def read_rss_kb(pid: int) -> Optional[int]:
+    """Resident set size процесса из /proc (Linux); на других системах None"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+async def active_sessions(client: httpx.AsyncClient) -> int:
+    response = await client.get("/api/metrics")
+    return sum(int(float(line.rsplit(" ", 1)[1])) for line in response.text.splitlines() if line.startswith("rag_bot_active_sessions"))
+
+
+async def ask(client: httpx.AsyncClient, stats: RunStats, kind: str, question: str, user_id: str) -> Optional[dict]:
+    started = time.perf_counter()
+    try:
+        response = await client.post("/api/v1/question", json={"question": question, "user_id": user_id})
+    except httpx.HTTPError:
+        stats.turns.append(TurnResult(kind, time.perf_counter() - started, False))
+        return None
+    stats.turns.append(TurnResult(kind, time.perf_counter() - started, response.status_code == 200))
+    return response.json() if response.status_code == 200 else None
+
+
+async def ask_stream(client: httpx.AsyncClient, stats: RunStats, kind: str, question: str, user_id: str):
+    started = time.perf_counter()
+    ttft = None
+    ok = False
+    try:
+        async with client.stream("POST", "/api/v1/question/stream", json={"question": question, "user_id": user_id}) as response:
+            async for line in response.aiter_lines():
+                if line == "event: token" and ttft is None:
+                    ttft = time.perf_counter() - started
+                elif line == "event: done":
+                    ok = True
+                elif line == "event: error":
+                    ok = False
+    except httpx.HTTPError:
+        ok = False
+    stats.turns.append(TurnResult(kind, time.perf_counter() - started, ok, ttft))
+
+
+async def rag_flow(client: httpx.AsyncClient, stats: RunStats, rng: random.Random, user_id: str, args):
+    for _ in range(args.rag_turns):
+        question = rng.choice(RAG_QUESTIONS)
+        if rng.random() < args.stream_share:
+            await ask_stream(client, stats, "rag_stream", question, user_id)
+        else:
+            await ask(client, stats, "rag", question, user_id)
+
+
+async def survey_flow(client: httpx.AsyncClient, stats: RunStats, rng: random.Random, user_id: str, scenario: str):
+    """Сценарий целиком: триггер, ответы по шкале (и 'Done' на биометрических этапах) до scenario_completed"""
+    message = rng.choice(SURVEY_TRIGGERS[scenario])
+    kind = "survey_start"
+    for _ in range(SURVEY_MAX_TURNS):
+        data = await ask(client, stats, kind, message, user_id)
+        if data is None or not data.get("scenario_active"):
+            stats.incomplete_surveys += 1
+            return
+        if data.get("scenario_completed"):
+            return
+        # 1-3 подходит и для шкалы 1-7, и для выбора варианта в конце сценария
+        message = "Done" if "'Done'" in data["response"] else str(rng.randint(1, 3))
+        kind = "survey_turn"
+    stats.incomplete_surveys += 1
+
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        if name not in ("rag", "vegans", "employee"):
+            raise ValueError(f"Неизвестный тип пользователя в --mix: {name}")
+        mix[name] = float(weight)
+    return mix
+
+
+def plan_users(args, count: int, prefix: str) -> List[tuple]:
+    """Детерминированный по seed список (тип, user_id, seed пользователя): одинаковая нагрузка в разных прогонах"""
+    rng = random.Random(f"{args.seed}:{prefix}")
+    mix = parse_mix(args.mix)
+    names, weights = list(mix), list(mix.values())
+    return [(rng.choices(names, weights)[0], f"{prefix}_{i}", rng.random()) for i in range(count)]
+
+
+async def run_users(client: httpx.AsyncClient, users: List[tuple], args) -> RunStats:
+    stats = RunStats()
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def run_user(flow: str, user_id: str, seed: float):
+        async with semaphore:
+            stats.flows[flow] = stats.flows.get(flow, 0) + 1
+            rng = random.Random(seed)
+            if flow == "rag":
+                await rag_flow(client, stats, rng, user_id, args)
+            else:
+                await survey_flow(client, stats, rng, user_id, flow)
+
+    await asyncio.gather(*(run_user(*user) for user in users))
+    return stats
+
+
+async def hold_sessions(client: httpx.AsyncClient, count: int, concurrency: int):
+    """Открывает count сценариев без завершения - сессии остаются активными для замера памяти"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def start(i: int):
+        async with semaphore:
+            await client.post("/api/v1/question", json={"question": SURVEY_TRIGGERS["vegans"][0], "user_id": f"idle_{i}"})
+
+    await asyncio.gather(*(start(i) for i in range(count)))
+
+
+def start_process(command: List[str], env: dict, log_path: str) -> subprocess.Popen:
+    log_file = open(log_path, "w")
+    return subprocess.Popen(command, cwd=SRC_DIR, env=env, stdout=log_file, stderr=subprocess.STDOUT)
+
+
+async def wait_ready(url: str, process: subprocess.Popen, log_path: str, timeout: float = 120.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(timeout=2.0) as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                with open(log_path) as f:
+                    raise RuntimeError(f"Процесс {url} завершился при запуске:\n{f.read()[-3000:]}")
+            try:
+                await client.get(url)
+                return
+            except httpx.HTTPError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} не ответил за {timeout:.0f} с")
+
+
+def git_revision() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=SRC_DIR, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--", "."], cwd=SRC_DIR, capture_output=True, text=True).stdout.strip())
+        return {"commit": commit, "dirty": dirty}
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": None, "dirty": None}
+
+
+def summarize(stats: RunStats, duration: float, upstream: dict) -> dict:
+    by_kind = {}
+    for kind in sorted({t.kind for t in stats.turns}):
+        turns = [t for t in stats.turns if t.kind == kind]
+        by_kind[kind] = {"turns": len(turns), "errors": sum(1 for t in turns if not t.ok), "latency_ms": latency_summary([t.latency for t in turns])}
+
+    calls = sum(upstream["calls"].values())
+    turns = len(stats.turns)
+    return {
+        "turns": turns,
+        "errors": sum(1 for t in stats.turns if not t.ok),
+        "flows": stats.flows,
+        "incomplete_surveys": stats.incomplete_surveys,
+        "duration_s": round(duration, 2),
+        "requests_per_s": round(turns / duration, 2) if duration else None,
+        "latency_ms": latency_summary([t.latency for t in stats.turns]),
+        "stream_ttft_ms": latency_summary([t.ttft for t in stats.turns if t.ttft is not None]),
+        "upstream_calls_per_turn": round(calls / turns, 3) if turns else None,
+        "upstream": upstream,
+        "by_kind": by_kind,
+    }
+
+
+async def benchmark(args) -> dict:
+    workdir = tempfile.mkdtemp(prefix="rag_bot_bench_")
+    mock_log = os.path.join(workdir, "mock_llm.log")
+    app_log = os.path.join(workdir, "app.log")
+    mock_url = f"http://127.0.0.1:{args.mock_port}"
+    app_url = f"http://127.0.0.1:{args.app_port}"
+
+    mock_command = [
+        sys.executable, "-m", "benchmark.mock_llm", "--port", str(args.mock_port),
+        "--latency", args.latency, "--ttft-fraction", str(args.ttft_fraction), "--stream-chunks", str(args.stream_chunks),
+        "--completion-tokens", str(args.completion_tokens), "--error-rate", str(args.error_rate),
+        "--rate-limit-rate", str(args.rate_limit_rate), "--seed", str(args.seed),
+    ]
+    app_env = {**os.environ, "PROFILE": "bench", "LLM_URL": f"{mock_url}/v1", "PYTHONUNBUFFERED": "1"}
+    app_command = [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(args.app_port), "--log-level", "warning"]
+
+    mock = start_process(mock_command, dict(os.environ), mock_log)
+    app = None
+    try:
+        await wait_ready(f"{mock_url}/stats", mock, mock_log)
+        app = start_process(app_command, app_env, app_log)
+        await wait_ready(f"{app_url}/api/health", app, app_log)
+
+        limits = httpx.Limits(max_connections=args.concurrency + 10, max_keepalive_connections=args.concurrency + 10)
+        async with httpx.AsyncClient(base_url=app_url, timeout=httpx.Timeout(300.0), limits=limits) as client, \
+                httpx.AsyncClient(base_url=mock_url) as mock_client:
+            if args.warmup:
+                await run_users(client, plan_users(args, args.warmup, "warmup"), args)
+            await mock_client.post("/stats/reset")
+
+            print(f"Нагрузка: {args.users} пользователей, одновременно {args.concurrency}, mix {args.mix}", file=sys.stderr)
+            started = time.perf_counter()
+            stats = await run_users(client, plan_users(args, args.users, "user"), args)
+            duration = time.perf_counter() - started
+            upstream = (await mock_client.get("/stats")).json()
+            result = summarize(stats, duration, upstream)
+
+            memory = {"rss_kb_start": read_rss_kb(app.pid), "sessions_start": await active_sessions(client)}
+            if args.idle_sessions:
+                await hold_sessions(client, args.idle_sessions, args.concurrency)
+                memory["rss_kb_end"] = read_rss_kb(app.pid)
+                memory["sessions_end"] = await active_sessions(client)
+                opened = memory["sessions_end"] - memory["sessions_start"]
+                if opened > 0 and memory["rss_kb_start"] is not None:
+                    memory["rss_kb_per_session"] = round((memory["rss_kb_end"] - memory["rss_kb_start"]) / opened, 2)
+            result["memory"] = memory
+    finally:
+        for process in (app, mock):
+            if process is not None and process.poll() is None:
+                process.terminate()
+                try:
+                    process.wait(timeout=30)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+
+    params = {key: value for key, value in vars(args).items() if key not in ("output", "compare")}
+    return {
+        **git_revision(),
+        "started_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "params": params,
+        "logs": {"app": app_log, "mock_llm": mock_log},
+        "results": result,
+    }
+
+
+# Показатели для сравнения прогонов: (путь в results, чем меньше - тем лучше)
+COMPARED_METRICS = [
+    ("requests_per_s", False),
+    ("latency_ms.p50", True),
+    ("latency_ms.p95", True),
+    ("latency_ms.p99", True),
+    ("stream_ttft_ms.p50", True),
+    ("upstream_calls_per_turn", True),
+    ("errors", True),
+    ("memory.rss_kb_per_session", True),
+]
+
+
+def _lookup(results: dict, path: str):
+    value = results
+    for key in path.split("."):
+        value = value.get(key) if isinstance(value, dict) else None
+    return value
+
+
+def print_report(report: dict, baseline: Optional[dict] = None):
+    results = report["results"]
+    print(f"commit {report['commit']}{' (есть незакоммиченные изменения)' if report['dirty'] else ''}")
+    print(f"ходов: {results['turns']}, ошибок: {results['errors']}, незавершенных сценариев: {results['incomplete_surveys']}, "
+          f"{results['requests_per_s']} req/s, вызовов LLM на ход: {results['upstream_calls_per_turn']}")
+    print(f"{'тип':<14}{'ходов':>8}{'ошибок':>8}{'p50 мс':>10}{'p95 мс':>10}{'p99 мс':>10}")
+    rows = list(results["by_kind"].items()) + [("всего", results)]
+    for kind, row in rows:
+        latency = row["latency_ms"]
+        print(f"{kind:<14}{row['turns']:>8}{row['errors']:>8}{latency['p50']!s:>10}{latency['p95']!s:>10}{latency['p99']!s:>10}")
+    print(f"вызовы LLM по видам: {results['upstream']['calls']}, ошибки LLM: {results['upstream']['errors']}")
+    print(f"память: {results['memory']}")
+
+    if baseline is None:
+        return
+    print(f"\nсравнение с {baseline.get('commit')}:")
+    for path, lower_is_better in COMPARED_METRICS:
+        before, after = _lookup(baseline["results"], path), _lookup(results, path)
+        if before is None or after is None:
+            continue
+        change = f"{(after - before) / before * 100:+.1f}%" if before else "n/a"
+        better = (after < before) == lower_is_better if after != before else None
+        mark = "" if better is None else (" лучше" if better else " хуже")
+        print(f"  {path:<28}{before!s:>12} -> {after!s:<12}{change}{mark}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Нагрузочный тест приложения против локального mock LLM (запуск из server/src: python -m benchmark.run)"
+    )
+    parser.add_argument("--users", type=int, default=200, help="Число виртуальных пользователей")
+    parser.add_argument("--concurrency", type=int, default=20, help="Сколько пользователей действуют одновременно")
+    parser.add_argument("--mix", default="rag=0.6,vegans=0.2,employee=0.2", help="Доли типов пользователей: rag, vegans, employee")
+    parser.add_argument("--rag-turns", type=int, default=3, help="Вопросов RAG на пользователя (одна сессия, с историей диалога)")
+    parser.add_argument("--stream-share", type=float, default=0.3, help="Доля вопросов RAG через /v1/question/stream")
+    parser.add_argument("--warmup", type=int, default=5, help="Пользователей для прогрева (не входят в результаты)")
+    parser.add_argument("--idle-sessions", type=int, default=500, help="Незавершенных сценариев для замера RSS на сессию (0 - без замера)")
+    parser.add_argument("--app-port", type=int, default=7200)
+    parser.add_argument("--mock-port", type=int, default=7100)
+    parser.add_argument("--output", help="Файл JSON для результатов прогона")
+    parser.add_argument("--compare", help="Результаты предыдущего прогона (JSON) для сравнения")
+    mock_llm.add_arguments(parser)
+    args = parser.parse_args()
+    parse_mix(args.mix)
+    mock_llm.parse_latency(args.latency)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    report = asyncio.run(benchmark(args))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    print_report(report, baseline)
+
+
+if __name__ == "__main__":
+    main()
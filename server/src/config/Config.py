@@ -13,11 +13,23 @@ class LoggingConfigGraylog:
     port: int
     udp: bool
 
+@dataclass
+class LoggingConfigQueue:
+    enabled: bool
+    max_size: int
+
+@dataclass
+class LoggingConfigPayload:
+    max_chars: int
+    sample_rate: float
+
 
 @dataclass
 class LoggingConfig:
     console: LoggingConfigConsole
     graylog: LoggingConfigGraylog
+    queue: LoggingConfigQueue
+    payload: LoggingConfigPayload
     app_name: str
     root_level: str
     levels: dict[str, str]
@@ -30,17 +42,138 @@ class QdrantConfig:
     model_name: str
     vector_size: int
     top_samples: int
+    embedder: str
+    backend: str
+    retrieval_enabled: bool
+    hybrid_search: bool
+    rrf_k: int
+
+@dataclass
+class LLMRetryConfig:
+    max_attempts: int
+    base_delay: float
+    max_delay: float
+    breaker_failure_threshold: int
+    breaker_reset_seconds: float
+    hedging_enabled: bool
+    hedge_min_delay: float
+
+@dataclass
+class LLMAdmissionConfig:
+    max_queue_wait_seconds: float
+    default_hold_seconds: float
+
+@dataclass
+class LLMCassetteConfig:
+    mode: str
+    path: str
+    emulate_latency: bool
 
 @dataclass
 class LLMConfig:
     url: str
     token: str
     model: str
+    timeout: float
+    max_connections: int
+    max_keepalive_connections: int
+    keepalive_expiry: float
+    http2: bool
+    max_concurrency: int
+    retry: LLMRetryConfig
+    admission: LLMAdmissionConfig
+    cassette: LLMCassetteConfig
+
+@dataclass
+class RerankerConfig:
+    enabled: bool
+    scorer: str
+    model_name: str
+    keep_top: int
+    batch_size: int
+    budget_ms: int
+
+@dataclass
+class IngestionConfig:
+    data_dir: str
+    chunk_size: int
+    chunk_overlap: int
+    batch_size: int
+
+@dataclass
+class ScenarioConfig:
+    trigger_prefilter: bool
+
+@dataclass
+class SessionsConfig:
+    backend: str
+    redis_url: str
+    key_prefix: str
+    lock_ttl_seconds: int
+    idle_ttl_seconds: int
+    max_sessions: int
+    max_histories: int
+    sweep_interval_seconds: int
+
+@dataclass
+class MemoryConfig:
+    enabled: bool
+    tokenizer: str
+    max_history_tokens: int
+    summary_max_tokens: int
+
+@dataclass
+class BatchConfig:
+    max_items: int
+    concurrency: int
+    item_timeout_seconds: float
+
+@dataclass
+class LLMCacheConfig:
+    enabled: bool
+    persistent: bool
+    max_entries: int
+    max_bytes: int
+    ttl_seconds: int
+
+@dataclass
+class SemanticCacheConfig:
+    enabled: bool
+    similarity_threshold: float
+    max_entries: int
+    ttl_seconds: int
+
+@dataclass
+class CacheConfig:
+    dir: str
+    llm: LLMCacheConfig
+    semantic: SemanticCacheConfig
+
+@dataclass
+class TracingConfig:
+    enabled: bool
+    exporter: str
+    file_path: str
+    file_max_bytes: int
+    file_backups: int
+    otlp_endpoint: str
+    min_duration_ms: int
+    slow_request_ms: int
+    max_queue: int
+    flush_interval_seconds: float
 
 @dataclass
 class Config:
     llm: LLMConfig
     qdrant: QdrantConfig
+    reranker: RerankerConfig
+    ingestion: IngestionConfig
+    scenarios: ScenarioConfig
+    sessions: SessionsConfig
+    memory: MemoryConfig
+    batch: BatchConfig
+    cache: CacheConfig
+    tracing: TracingConfig
     logging: LoggingConfig
 
 class ConfigLoader:
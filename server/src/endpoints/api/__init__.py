@@ -1,5 +1,6 @@
 from fastapi import APIRouter
 from endpoints.api.health import router as health_router
+from endpoints.api.metrics import router as metrics_router
 from endpoints.api.question import router as question_router
 from endpoints.api.scenario import router as scenario_router
 
@@ -7,5 +8,6 @@ from endpoints.api.scenario import router as scenario_router
 main_router = APIRouter()
 
 main_router.include_router(health_router)
+main_router.include_router(metrics_router)
 main_router.include_router(question_router)
 main_router.include_router(scenario_router)
\ No newline at end of file
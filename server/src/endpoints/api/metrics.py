@@ -0,0 +1,112 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from services.ConversationMemory import get_conversation_memory
+from services.LLMCassette import get_llm_cassette
+from services.LLMClientPool import get_llm_client_pool
+from services.LLMResponseCache import get_llm_response_cache
+from services.LLMRetryPolicy import get_retry_stats
+from services.LLMService import get_single_flight_stats
+from services.MetricsRegistry import get_metrics_registry
+from services.SemanticAnswerCache import get_semantic_answer_cache
+from services.SessionStore import get_session_store
+from services.Tracing import get_span_exporter
+from utils.logger import get_logger, get_logging_stats
+
+router = APIRouter()
+log = get_logger("metrics_endpoint")
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _cache_samples(field: str):
+    samples = []
+    for name, cache in (("llm", get_llm_response_cache()), ("semantic", get_semantic_answer_cache())):
+        if cache:
+            samples.append(({"cache": name}, cache.get_stats()[field]))
+    return samples
+
+
+def _cassette_samples():
+    cassette = get_llm_cassette()
+    if not cassette:
+        return []
+    stats = cassette.get_stats()
+    events = (("recorded", "recorded"), ("replayed", "replayed"), ("miss", "misses"))
+    return [({"mode": stats["mode"], "event": event}, stats[field]) for event, field in events]
+
+
+def _retry_samples():
+    return [({"kind": kind}, count) for kind, count in get_retry_stats()["retries"].items()]
+
+
+def _breaker_samples():
+    return [({"endpoint": endpoint, "state": stats["state"]}, 1) for endpoint, stats in get_retry_stats()["breakers"].items()]
+
+
+def _admission_samples(field: str):
+    stats = get_llm_client_pool().admission.get_stats()
+    return [({"priority": priority}, count) for priority, count in stats[field].items()]
+
+
+def _session_samples(field: str):
+    stats = get_session_store().get_stats()
+    return [({"backend": stats["backend"]}, stats[field])]
+
+
+def _trace_export_samples():
+    exporter = get_span_exporter()
+    if not exporter:
+        return []
+    stats = exporter.get_stats()
+    return [({"result": result}, stats[result]) for result in ("exported", "skipped", "dropped", "failed")]
+
+
+def _log_samples():
+    stats = get_logging_stats()
+    return [({"result": "enqueued"}, stats["enqueued"]), ({"result": "dropped"}, stats["dropped"])]
+
+
+def _memory_samples(field: str):
+    memory = get_conversation_memory()
+    return [({}, memory.get_stats()[field])] if memory else []
+
+
+def _register_collectors():
+    registry = get_metrics_registry()
+    registry.gauge_callback("rag_bot_active_sessions", "Сессии сценариев в хранилище", lambda: _session_samples("entries"))
+    registry.gauge_callback("rag_bot_conversation_histories", "Истории диалога RAG в хранилище сессий", lambda: _session_samples("history_entries"))
+    registry.counter_callback("rag_bot_llm_retries_total", "Повторы запросов к LLM по типу ошибки", _retry_samples)
+    registry.gauge_callback("rag_bot_llm_circuit_breaker_state", "Текущее состояние выключателя endpoint LLM", _breaker_samples)
+    registry.counter_callback(
+        "rag_bot_llm_coalesced_total", "Запросы к LLM, присоединенные к уже выполняющемуся",
+        lambda: [({}, get_single_flight_stats()["coalesced"])]
+    )
+    registry.gauge_callback(
+        "rag_bot_llm_queue_length", "Запросы к LLM, ожидающие слота",
+        lambda: [({}, get_llm_client_pool().admission.get_stats()["queue_length"])]
+    )
+    registry.counter_callback("rag_bot_llm_admission_rejected_total", "Запросы к LLM, отклоненные контролем допуска", lambda: _admission_samples("rejected"))
+    registry.counter_callback("rag_bot_cache_hits_total", "Попадания в кеши ответов", lambda: _cache_samples("hits"))
+    registry.counter_callback("rag_bot_cache_misses_total", "Промахи кешей ответов", lambda: _cache_samples("misses"))
+    registry.gauge_callback("rag_bot_cache_hit_ratio", "Доля попаданий в кеши ответов", lambda: _cache_samples("hit_rate"))
+    registry.gauge_callback("rag_bot_cache_entries", "Записи в кешах ответов", lambda: _cache_samples("entries"))
+    registry.counter_callback("rag_bot_conversation_summaries_total", "Сворачивания истории диалога в сводку", lambda: _memory_samples("summaries"))
+    registry.counter_callback(
+        "rag_bot_conversation_summary_failures_total", "Неудачные сворачивания истории диалога", lambda: _memory_samples("summary_failures")
+    )
+    registry.counter_callback(
+        "rag_bot_conversation_dropped_turns_total", "Ходы диалога, отброшенные без сводки из-за лимита хранения", lambda: _memory_samples("dropped_turns")
+    )
+    registry.counter_callback("rag_bot_llm_cassette_total", "Обращения к LLM, записанные в кассету или выданные из нее", _cassette_samples)
+    registry.counter_callback("rag_bot_traces_total", "Трассировки запросов по результату экспорта", _trace_export_samples)
+    registry.counter_callback("rag_bot_log_records_total", "Записи лога, переданные в очередь или отброшенные при ее переполнении", _log_samples)
+    registry.gauge_callback("rag_bot_log_queue_length", "Записи лога, ожидающие записи фоновым потоком", lambda: [({}, get_logging_stats()["queued"])])
+
+
+_register_collectors()
+
+
+@router.get("/metrics")
+async def metrics():
+    return PlainTextResponse(get_metrics_registry().render(), media_type=CONTENT_TYPE)
@@ -1,25 +1,30 @@
 from fastapi import APIRouter, HTTPException
-from fastapi.responses import JSONResponse
-from typing import Optional
+from fastapi.responses import JSONResponse, StreamingResponse
+from typing import AsyncIterator, List, Optional, Tuple
+import asyncio
+import contextlib
+import time
 import uuid
 import json
 
-from services.LLMService import LLMService
-from services.ScenarioService import ScenarioService
+from services.LLMService import FallbackAnswer, LLMService
+from services.ScenarioService import get_scenario_service
 from services.ConscienceIQService import ConscienceIQService
+from services.SemanticAnswerCache import get_semantic_answer_cache
+from services.RetrievalService import RetrievalService, get_retrieval_service
+from services.RerankerService import get_reranker_service
+from services.PromptLibrary import get_prompt_library
+from services.ConversationMemory import get_conversation_memory
+from services.LLMRetryPolicy import LLMUnavailableError
+from services.context_var import DeadlineExceededError, check_deadline, deadline_var
+from services.MetricsRegistry import set_request_label
+from services.Tracing import span
 from utils.logger import get_logger
+from config.Config import CONFIG
 
 router = APIRouter()
 log = get_logger("question_endpoint")
 
-_scenario_service = None
-
-def get_scenario_service():
-    global _scenario_service
-    if _scenario_service is None:
-        _scenario_service = ScenarioService()
-    return _scenario_service
-
 @router.post("/v1/question")
 async def question_post(request_data: dict):
     question = request_data.get("question")
@@ -34,14 +39,54 @@ async def question_post(request_data: dict):
 async def question(question: str, user_id: Optional[str] = None):
     return await question_logic(question, user_id)
 
-async def question_logic(question: str, user_id: Optional[str] = None):
-    scenario_service = get_scenario_service()
+@router.post("/v1/question/stream")
+async def question_stream_post(request_data: dict):
+    question = request_data.get("question")
+    user_id = request_data.get("user_id")
+
+    if not question:
+        raise HTTPException(status_code=400, detail="Question is required")
+
+    return _event_stream_response(question_stream_logic(question, user_id))
 
+@router.get("/v1/question/stream")
+async def question_stream(question: str, user_id: Optional[str] = None):
+    return _event_stream_response(question_stream_logic(question, user_id))
+
+@router.post("/v1/question/batch")
+async def question_batch_post(request_data: dict):
+    items = _parse_batch(request_data)
+    return StreamingResponse(
+        question_batch_logic(items),
+        media_type="application/x-ndjson",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"
+        }
+    )
+
+async def question_logic(question: str, user_id: Optional[str] = None):
     if not user_id:
         user_id = f"temp_{str(uuid.uuid4())[:8]}"
 
+    response_data = await _scenario_logic(question, user_id)
+    if response_data:
+        set_request_label("source", response_data["source"])
+        return response_data
+
+    set_request_label("source", "rag")
+    return await _rag_logic(question, user_id)
+
+async def _scenario_logic(question: str, user_id: str, on_token=None) -> Optional[dict]:
+    """Обрабатывает стоп-команды и сценарии. Возвращает None, если вопрос нужно отправить в RAG"""
+    scenario_service = get_scenario_service()
+    # Сообщения одного пользователя обрабатываются по очереди, чтобы не испортить состояние сессии
+    async with scenario_service.user_lock(user_id):
+        return await _scenario_turn(scenario_service, question, user_id, on_token)
+
+async def _scenario_turn(scenario_service, question: str, user_id: str, on_token=None) -> Optional[dict]:
     if scenario_service.detect_stop_command(question):
-        stop_message = scenario_service.stop_scenario_with_message(user_id)
+        stop_message = await scenario_service.stop_scenario_with_message(user_id)
         return {
             "response": stop_message,
             "scenario_active": False,
@@ -50,18 +95,19 @@ async def question_logic(question: str, user_id: Optional[str] = None):
         }
 
     # Проверяем если пользователь в активном сценарии
-    if scenario_service.get_user_scenario_state(user_id):
-        scenario_response = await scenario_service.process_user_response(user_id, question)
+    if await scenario_service.get_user_scenario_state(user_id):
+        scenario_response = await scenario_service.process_user_response(user_id, question, on_token=on_token)
         if scenario_response:
             log.info(f"Размер ответа сценария: {len(scenario_response)} символов")
             try:
-                test_json = json.dumps({"test": scenario_response}, ensure_ascii=False)
+                with span("serialization"):
+                    test_json = json.dumps({"test": scenario_response}, ensure_ascii=False)
                 log.info(f"JSON тест прошёл успешно, размер JSON: {len(test_json)}")
             except (TypeError, ValueError, UnicodeDecodeError) as e:
                 log.error(f"Ошибка сериализации ответа сценария: {e}")
                 scenario_response = "Sorry, the response contains characters that cannot be transmitted. Please try asking a simpler question."
 
-            updated_scenario = scenario_service.get_user_scenario_state(user_id)
+            updated_scenario = await scenario_service.get_user_scenario_state(user_id)
             is_completed = updated_scenario and updated_scenario.state.value == "completed"
 
             # Определяем название сценария
@@ -80,13 +126,13 @@ async def question_logic(question: str, user_id: Optional[str] = None):
 
             if is_completed:
                 response_data["scenario_completed"] = True
-                scenario_service.cleanup_completed_scenario(user_id)
+                await scenario_service.cleanup_completed_scenario(user_id)
 
             return response_data
 
     scenario_name = await scenario_service.detect_scenario_trigger(question)
     if scenario_name:
-        scenario_response = scenario_service.start_scenario(user_id, scenario_name)
+        scenario_response = await scenario_service.start_scenario(user_id, scenario_name)
         response_data = {
             "response": scenario_response,
             "scenario_active": True,
@@ -96,12 +142,39 @@ async def question_logic(question: str, user_id: Optional[str] = None):
         }
         return response_data
 
+    return None
+
+async def _rag_logic(question: str, user_id: str):
+    # Сообщения одного пользователя с историей обрабатываются по очереди: каждый ответ видит предыдущий ход
+    async with _history_lock(user_id):
+        return await _rag_turn(question, user_id)
+
+async def _rag_turn(question: str, user_id: str):
     try:
-        conscience_service = ConscienceIQService()
-        enhanced_question = conscience_service.get_enhanced_prompt(question, context_type="general")
+        memory, history = await _load_history(user_id)
+        # Ответ на уточняющий вопрос зависит от истории, поэтому семантический кеш используется только в начале диалога
+        semantic_cache = get_semantic_answer_cache() if not history else None
+        question_vector = None
+        if semantic_cache:
+            cached_answer, question_vector = await semantic_cache.lookup(question)
+            if cached_answer is not None:
+                if memory:
+                    await memory.append(user_id, question, cached_answer, locked=True)
+                return {
+                    "response": cached_answer,
+                    "scenario_active": False,
+                    "user_id": user_id,
+                    "source": "rag",
+                    "cached": True
+                }
+
+        conscience_service, system_prompt, task, sources = await _build_rag_prompt(question, question_vector)
         
         llm = LLMService()
-        result = await llm.fetch_completion(enhanced_question)
+        started = time.perf_counter()
+        result = await llm.fetch_completion(task, system=system_prompt, history=history, prompt_key=_rag_prompt_key(sources))
+        fallback = isinstance(result, FallbackAnswer)
+        log.info(f"Генерация RAG ответа для {user_id}: {(time.perf_counter() - started) * 1000:.0f} мс")
 
         conscience_check = conscience_service.conscience_check(result, f"RAG ответ для пользователя {user_id}")
         if not conscience_check:
@@ -110,10 +183,17 @@ async def question_logic(question: str, user_id: Optional[str] = None):
         log.info(f"RAG ответ с Conscience IQ получен для пользователя {user_id}, длина: {len(result) if result else 0}")
 
         try:
-            json.dumps(result, ensure_ascii=False)
+            with span("serialization"):
+                json.dumps(result, ensure_ascii=False)
         except (TypeError, ValueError) as e:
             log.warning(f"Проблема с сериализацией ответа: {e}, обрезаем контент")
             result = result[:5000] + "..." if len(result) > 5000 else result
+
+        # Заглушка вместо ответа LLM не кешируется и не попадает в историю
+        if semantic_cache and not fallback:
+            semantic_cache.store(question, result, question_vector)
+        if memory and not fallback:
+            await memory.append(user_id, question, result, locked=True)
         
         response_data = {
             "response": result,
@@ -121,8 +201,270 @@ async def question_logic(question: str, user_id: Optional[str] = None):
             "user_id": user_id,
             "source": "rag"
         }
+        if sources:
+            response_data["sources"] = sources
         
         return response_data
+    except (LLMUnavailableError, DeadlineExceededError):
+        raise
     except Exception as e:
         log.error(f"Ошибка при получении RAG ответа для {user_id}: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Error generating response: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Error generating response: {str(e)}")
+
+async def _build_rag_prompt(question: str, question_vector=None) -> tuple:
+    """
+    Строит промпт RAG ответа: системное сообщение с принципами Conscience IQ (одинаковое для всех запросов)
+    и задача - найденные (и при включенном реранкере отобранные) фрагменты документов с вопросом.
+    Возвращает (conscience_service, системное сообщение, задача, список id источников).
+    """
+    with span("prompt_building") as current:
+        conscience_service = ConscienceIQService()
+        task = question
+        sources = []
+
+        retrieval_service = get_retrieval_service()
+        if retrieval_service:
+            retrieval = await retrieval_service.retrieve(question, question_vector)
+            chunks = retrieval.chunks
+
+            reranker_service = get_reranker_service()
+            if reranker_service and chunks:
+                chunks = (await reranker_service.rerank(question, chunks)).chunks
+
+            if chunks:
+                task = get_prompt_library().render(
+                    'rag_answer_with_context', context=RetrievalService.format_context(chunks), question=question
+                )
+                sources = [chunk.source_id for chunk in chunks]
+
+        current.set(**{"rag.sources": len(sources)})
+        return conscience_service, conscience_service.get_system_prompt(context_type="general"), task, sources
+
+def _history_lock(user_id: str):
+    """Блокировка сессии пользователя на ход RAG; у анонимных temp_ пользователей и без памяти диалогов блокировки нет"""
+    memory = get_conversation_memory()
+    if not memory or user_id.startswith("temp_"):
+        return contextlib.nullcontext()
+    return memory.lock(user_id)
+
+async def _load_history(user_id: str) -> tuple:
+    """(память диалогов, сообщения истории для промпта); у анонимных temp_ пользователей истории нет"""
+    memory = get_conversation_memory()
+    if not memory or user_id.startswith("temp_"):
+        return None, []
+    with span("history_lookup") as current:
+        history = memory.build_history(await memory.load(user_id))
+        current.set(**{"history.messages": len(history)})
+    return memory, history
+
+def _rag_prompt_key(sources: list) -> str:
+    return "rag_answer_with_context" if sources else "rag_answer"
+
+async def question_stream_logic(question: str, user_id: Optional[str] = None) -> AsyncIterator[str]:
+    """
+    Server-Sent Events вариант question_logic.
+    События: token - очередной фрагмент ответа, done - итоговые данные ответа (как у /v1/question), error - ошибка.
+    Статические ответы сценариев отдаются сразу одним фрагментом.
+    """
+    if not user_id:
+        user_id = f"temp_{str(uuid.uuid4())[:8]}"
+
+    queue: asyncio.Queue = asyncio.Queue()
+    scenario_task = asyncio.create_task(_scenario_logic(question, user_id, on_token=queue.put))
+    streamed = False
+    try:
+        async for delta in _drain_queue(scenario_task, queue):
+            streamed = True
+            yield _sse_event("token", {"delta": delta})
+        response_data = scenario_task.result()
+    except Exception as e:
+        log.error(f"Ошибка при потоковой обработке сценария для {user_id}: {str(e)}")
+        yield _sse_event("error", {"detail": f"Error generating response: {str(e)}"})
+        return
+    finally:
+        if not scenario_task.done():
+            scenario_task.cancel()
+
+    if response_data:
+        set_request_label("source", response_data["source"])
+        if not streamed:
+            yield _sse_event("token", {"delta": response_data["response"]})
+        yield _sse_event("done", response_data)
+        return
+
+    set_request_label("source", "rag")
+    async with _history_lock(user_id):
+        async for event in _rag_stream_turn(question, user_id):
+            yield event
+
+async def _rag_stream_turn(question: str, user_id: str) -> AsyncIterator[str]:
+    try:
+        memory, history = await _load_history(user_id)
+        semantic_cache = get_semantic_answer_cache() if not history else None
+        question_vector = None
+        if semantic_cache:
+            cached_answer, question_vector = await semantic_cache.lookup(question)
+            if cached_answer is not None:
+                if memory:
+                    await memory.append(user_id, question, cached_answer, locked=True)
+                yield _sse_event("token", {"delta": cached_answer})
+                yield _sse_event("done", {
+                    "response": cached_answer,
+                    "scenario_active": False,
+                    "user_id": user_id,
+                    "source": "rag",
+                    "cached": True
+                })
+                return
+
+        conscience_service, system_prompt, task, sources = await _build_rag_prompt(question, question_vector)
+
+        llm = LLMService()
+        chunks = []
+        async for delta in llm.fetch_completion_stream(task, system=system_prompt, history=history, prompt_key=_rag_prompt_key(sources)):
+            chunks.append(delta)
+            yield _sse_event("token", {"delta": delta})
+        result = "".join(chunks)
+
+        conscience_check = conscience_service.conscience_check(result, f"RAG ответ для пользователя {user_id}")
+        if not conscience_check:
+            log.warning(f"RAG ответ не прошел проверку Conscience IQ для пользователя {user_id}")
+
+        log.info(f"Потоковый RAG ответ с Conscience IQ получен для пользователя {user_id}, длина: {len(result)}")
+
+        if semantic_cache:
+            semantic_cache.store(question, result, question_vector)
+        if memory:
+            await memory.append(user_id, question, result, locked=True)
+
+        response_data = {
+            "response": result,
+            "scenario_active": False,
+            "user_id": user_id,
+            "source": "rag",
+            "usage": {
+                "prompt_tokens": llm.total_input_token,
+                "completion_tokens": llm.total_output_token,
+                "cached_tokens": llm.total_cached_token
+            }
+        }
+        if sources:
+            response_data["sources"] = sources
+        yield _sse_event("done", response_data)
+    except Exception as e:
+        log.error(f"Ошибка при потоковом получении RAG ответа для {user_id}: {str(e)}")
+        yield _sse_event("error", {"detail": f"Error generating response: {str(e)}"})
+
+def _parse_batch(request_data: dict) -> List[Tuple[object, Optional[str]]]:
+    """
+    Список (вопрос, user_id) из тела {"questions": [...]}.
+    Элемент списка - строка вопроса или {"question": ..., "user_id": ...}. Вопрос без своего user_id обрабатывается
+    без состояния: только RAG, без истории диалога и без запуска сценариев.
+    """
+    questions = request_data.get("questions")
+    if not isinstance(questions, list) or not questions:
+        raise HTTPException(status_code=400, detail="Questions list is required")
+    max_items = int(CONFIG.batch.max_items)
+    if len(questions) > max_items:
+        raise HTTPException(status_code=400, detail=f"Batch is limited to {max_items} questions")
+
+    items = []
+    for item in questions:
+        if isinstance(item, dict):
+            items.append((item.get("question"), item.get("user_id")))
+        else:
+            items.append((item, None))
+    return items
+
+async def question_batch_logic(items: List[Tuple[object, Optional[str]]]) -> AsyncIterator[str]:
+    """
+    NDJSON вариант question_logic для пакета вопросов: не больше batch.concurrency вопросов обрабатываются одновременно,
+    строки отдаются в порядке готовности. Строка: {"index", "status": 200, "result"} или {"index", "status", "detail"} -
+    ошибка одного вопроса не прерывает пакет. Вопросы одного user_id обрабатываются по очереди в порядке пакета,
+    чтобы состояние сессии и история не зависели от порядка завершения. Каждый вопрос ограничен
+    batch.item_timeout_seconds, весь пакет - дедлайном HTTP запроса.
+    """
+    started = time.perf_counter()
+    queue: asyncio.Queue = asyncio.Queue()
+    chains: dict = {}
+    for index, (question, user_id) in enumerate(items):
+        chains.setdefault(user_id if user_id else ("stateless", index), []).append((index, question, user_id))
+    pending = iter(chains.values())
+
+    async def worker():
+        # Итератор общий: каждый воркер берет следующую цепочку вопросов
+        for chain in pending:
+            for index, question, user_id in chain:
+                await queue.put(await _batch_item(index, question, user_id))
+
+    workers = [asyncio.create_task(worker()) for _ in range(min(int(CONFIG.batch.concurrency), len(chains)))]
+    errors = 0
+    try:
+        for _ in range(len(items)):
+            line = await queue.get()
+            if line["status"] != 200:
+                errors += 1
+            yield json.dumps(line, ensure_ascii=False) + "\n"
+        log.info(f"Пакет из {len(items)} вопросов обработан за {(time.perf_counter() - started) * 1000:.0f} мс, ошибок: {errors}")
+    finally:
+        # Клиент отключился или истек дедлайн: необработанные вопросы не запускаем
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        # question_logic каждого вопроса перезаписывает source, для метрик запроса это пакет
+        set_request_label("source", "batch")
+
+async def _batch_item(index: int, question, user_id: Optional[str]) -> dict:
+    if not isinstance(question, str) or not question:
+        return {"index": index, "status": 400, "detail": "Question is required"}
+    # Собственный дедлайн вопроса, но не дальше дедлайна всего запроса
+    item_deadline = time.monotonic() + float(CONFIG.batch.item_timeout_seconds)
+    request_deadline = deadline_var.get()
+    token = deadline_var.set(item_deadline if request_deadline is None else min(item_deadline, request_deadline))
+    try:
+        with span("batch_item", **{"batch.index": index}):
+            check_deadline()
+            if user_id:
+                result = await question_logic(question, user_id)
+            else:
+                result = await _rag_logic(question, f"temp_{str(uuid.uuid4())[:8]}")
+        return {"index": index, "status": 200, "result": result}
+    except HTTPException as e:
+        return {"index": index, "status": e.status_code, "detail": e.detail}
+    except DeadlineExceededError:
+        return {"index": index, "status": 408, "detail": "Request timeout"}
+    except LLMUnavailableError as e:
+        return {
+            "index": index,
+            "status": 503,
+            "detail": "LLM service is temporarily unavailable, please retry later",
+            "retry_after": int(e.retry_after)
+        }
+    except Exception as e:
+        log.error(f"Ошибка при обработке вопроса {index} пакета: {str(e)}")
+        return {"index": index, "status": 500, "detail": f"Error generating response: {str(e)}"}
+    finally:
+        deadline_var.reset(token)
+
+async def _drain_queue(task: asyncio.Task, queue: asyncio.Queue) -> AsyncIterator[str]:
+    """Отдает элементы очереди, пока задача не завершится и очередь не опустеет"""
+    while not task.done() or not queue.empty():
+        getter = asyncio.ensure_future(queue.get())
+        done, _ = await asyncio.wait({getter, task}, return_when=asyncio.FIRST_COMPLETED)
+        if getter in done:
+            yield getter.result()
+        else:
+            getter.cancel()
+
+def _sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def _event_stream_response(events: AsyncIterator[str]) -> StreamingResponse:
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"
+        }
+    )
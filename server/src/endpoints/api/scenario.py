@@ -2,70 +2,72 @@ from fastapi import APIRouter, HTTPException
 from fastapi.responses import JSONResponse
 from typing import Optional
 
-from services.ScenarioService import ScenarioService
+from services.ScenarioService import get_scenario_service
+from services.MetricsRegistry import set_request_label
+from services.LLMRetryPolicy import LLMUnavailableError
+from services.context_var import DeadlineExceededError
 from utils.logger import get_logger
 
 router = APIRouter()
 log = get_logger("scenario_endpoint")
 
-_scenario_service = None
-
-def get_scenario_service():
-    global _scenario_service
-    if _scenario_service is None:
-        _scenario_service = ScenarioService()
-    return _scenario_service
-
 @router.post("/v1/scenario/message")
 async def handle_scenario_message(user_id: str, message: str):
     try:
         scenario_service = get_scenario_service()
+        async with scenario_service.user_lock(user_id):
+            return await _handle_scenario_turn(scenario_service, user_id, message)
+    except (LLMUnavailableError, DeadlineExceededError):
+        raise
+    except Exception as e:
+        log.error(f"Ошибка при обработке сценария: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Ошибка сервера: {str(e)}")
 
-        if scenario_service.detect_stop_command(message):
-            stop_message = scenario_service.stop_scenario_with_message(user_id)
-            return {
-                "response": stop_message,
-                "scenario_active": False
-            }
-        
-        active_scenario = scenario_service.get_user_scenario_state(user_id)
-        
-        if active_scenario:
-            response = await scenario_service.process_user_response(user_id, message)
-            if response:
-                return {
-                    "response": response,
-                    "scenario_active": True,
-                    "scenario_name": active_scenario.scenario_name,
-                    "question_number": active_scenario.current_question_index + 1,
-                    "total_questions": len(active_scenario.questions)
-                }
-
-        scenario_name = await scenario_service.detect_scenario_trigger(message)
-        if scenario_name:
-            response = scenario_service.start_scenario(user_id, scenario_name)
+async def _handle_scenario_turn(scenario_service, user_id: str, message: str):
+    if scenario_service.detect_stop_command(message):
+        stop_message = await scenario_service.stop_scenario_with_message(user_id)
+        set_request_label("source", "stop_command")
+        return {
+            "response": stop_message,
+            "scenario_active": False
+        }
+    
+    set_request_label("source", "scenario")
+    active_scenario = await scenario_service.get_user_scenario_state(user_id)
+    
+    if active_scenario:
+        response = await scenario_service.process_user_response(user_id, message)
+        if response:
+            active_scenario = await scenario_service.get_user_scenario_state(user_id) or active_scenario
             return {
                 "response": response,
                 "scenario_active": True,
-                "scenario_name": scenario_name,
-                "question_number": 1,
-                "total_questions": len(scenario_service.scenario_configs[scenario_name])
+                "scenario_name": active_scenario.scenario_name,
+                "question_number": active_scenario.current_question_index + 1,
+                "total_questions": len(active_scenario.questions)
             }
 
+    scenario_name = await scenario_service.detect_scenario_trigger(message)
+    if scenario_name:
+        response = await scenario_service.start_scenario(user_id, scenario_name)
         return {
-            "response": None,
-            "scenario_active": False
+            "response": response,
+            "scenario_active": True,
+            "scenario_name": scenario_name,
+            "question_number": 1,
+            "total_questions": len(scenario_service.scenario_configs[scenario_name])
         }
-        
-    except Exception as e:
-        log.error(f"Ошибка при обработке сценария: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Ошибка сервера: {str(e)}")
+
+    return {
+        "response": None,
+        "scenario_active": False
+    }
 
 @router.get("/v1/scenario/status/{user_id}")
 async def get_scenario_status(user_id: str):
     try:
         scenario_service = get_scenario_service()
-        scenario = scenario_service.get_user_scenario_state(user_id)
+        scenario = await scenario_service.get_user_scenario_state(user_id)
         if scenario:
             return {
                 "scenario_active": True,
@@ -85,11 +87,16 @@ async def get_scenario_status(user_id: str):
 async def cancel_scenario(user_id: str):
     try:
         scenario_service = get_scenario_service()
-        success = scenario_service.cancel_scenario(user_id)
+        async with scenario_service.user_lock(user_id):
+            success = await scenario_service.cancel_scenario(user_id)
         return {
             "success": success,
             "message": "Сценарий отменен" if success else "Активный сценарий не найден"
         }
     except Exception as e:
         log.error(f"Ошибка при отмене сценария: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Ошибка сервера: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Ошибка сервера: {str(e)}")
+
+@router.get("/v1/scenario/sessions/stats")
+async def get_sessions_stats():
+    return get_scenario_service().sessions.get_stats()
@@ -0,0 +1,23 @@
+import argparse
+import asyncio
+
+from services.IngestionService import create_ingestion_service
+from services.VectorStore import close_vector_store
+
+
+async def main(data_dir: str = None, full: bool = False):
+    service = create_ingestion_service(data_dir)
+    try:
+        stats = await service.run(full=full)
+    finally:
+        await close_vector_store()
+    print(stats.summary())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Загрузка документов из data/ в векторное хранилище")
+    parser.add_argument("--data-dir", help="Каталог с документами (по умолчанию ingestion.data_dir из config.yml)")
+    parser.add_argument("--full", action="store_true", help="Пересчитать все файлы, игнорируя сохраненные хеши")
+    args = parser.parse_args()
+
+    asyncio.run(main(args.data_dir, args.full))
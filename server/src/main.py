@@ -4,22 +4,85 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 import json
 import asyncio
+from contextlib import asynccontextmanager
 
 from endpoints.api import main_router
+from services.LLMClientPool import get_llm_client_pool, close_llm_client_pool
+from services.ConscienceIQService import load_conscience_principles
+from services.VectorStore import close_vector_store
+from services.EmbeddingService import get_embedding_service
+from services.RerankerService import get_reranker_service
+from services.SessionStore import get_session_store, close_session_store
+from services.Tracing import get_span_exporter
+from services.LLMCassette import get_llm_cassette
+from services.ConversationMemory import close_conversation_memory
+from services.LLMRetryPolicy import LLMUnavailableError
+from services.context_var import DeadlineExceededError
+from utils.request_deadline import RequestDeadlineMiddleware
+from utils.request_metrics import RequestMetricsMiddleware
+from utils.request_tracing import RequestTracingMiddleware
+from config.Config import CONFIG
 
-app = FastAPI()
+REQUEST_TIMEOUT_SECONDS = 180.0
 
-app.default_response_class = JSONResponse
 
-@app.middleware("http")
-async def timeout_middleware(request: Request, call_next):
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.llm_pool = get_llm_client_pool()
+    # Разбор PDF с инструкциями выполняется в потоке, чтобы не блокировать event loop
+    await asyncio.to_thread(load_conscience_principles)
+    # Модели эмбеддингов и реранкера загружаются при старте в потоке, а не на первом запросе в event loop
+    if CONFIG.qdrant.retrieval_enabled or CONFIG.cache.semantic.enabled:
+        await asyncio.to_thread(get_embedding_service)
+    if CONFIG.reranker.enabled:
+        await asyncio.to_thread(get_reranker_service)
+    session_sweeper = asyncio.create_task(get_session_store().run_sweeper(float(CONFIG.sessions.sweep_interval_seconds)))
+    span_exporter = get_span_exporter()
+    span_export_task = asyncio.create_task(span_exporter.run()) if span_exporter else None
+    cassette = get_llm_cassette()
+    cassette_task = asyncio.create_task(cassette.run()) if cassette and cassette.mode == "record" else None
     try:
-        return await asyncio.wait_for(call_next(request), timeout=180.0)
-    except asyncio.TimeoutError:
-        return JSONResponse(
-            status_code=408,
-            content={"detail": "Request timeout after 3 minutes"}
-        )
+        yield
+    finally:
+        session_sweeper.cancel()
+        if span_export_task:
+            span_export_task.cancel()
+            # Экспортер отправляет оставшиеся трассировки при отмене
+            await asyncio.gather(span_export_task, return_exceptions=True)
+        if cassette_task:
+            cassette_task.cancel()
+            # Кассета дописывает оставшиеся обращения при отмене
+            await asyncio.gather(cassette_task, return_exceptions=True)
+        await close_conversation_memory()
+        await close_llm_client_pool()
+        await close_vector_store()
+        await close_session_store()
+
+
+app = FastAPI(lifespan=lifespan)
+
+app.default_response_class = JSONResponse
+
+@app.exception_handler(DeadlineExceededError)
+async def deadline_exceeded_handler(request: Request, exc: DeadlineExceededError):
+    return JSONResponse(
+        status_code=408,
+        content={"detail": "Request timeout after 3 minutes"}
+    )
+
+@app.exception_handler(LLMUnavailableError)
+async def llm_unavailable_handler(request: Request, exc: LLMUnavailableError):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "LLM service is temporarily unavailable, please retry later"},
+        headers={"Retry-After": str(int(exc.retry_after))}
+    )
+
+app.add_middleware(RequestDeadlineMiddleware, timeout=REQUEST_TIMEOUT_SECONDS)
+# Снаружи deadline middleware: в метрики попадают и ответы 408 по таймауту
+app.add_middleware(RequestMetricsMiddleware)
+# Самый внешний из своих: request_id и trace должны быть заданы до остальных middleware
+app.add_middleware(RequestTracingMiddleware)
 
 app.add_middleware(
     CORSMiddleware,
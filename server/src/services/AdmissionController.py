@@ -0,0 +1,121 @@
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List
+
+from services.context_var import time_left
+from services.LLMRetryPolicy import LLMUnavailableError
+from utils.logger import get_logger
+
+log = get_logger("AdmissionController")
+
+# Классы приоритета запросов к LLM: меньше - раньше
+PRIORITY_INTERACTIVE = 0  # классификаторы триггеров, оценка ответов, согласие - короткие ходы сценариев
+PRIORITY_GENERATION = 1   # финальные планы сценариев и ответы RAG - длинные генерации
+
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_GENERATION: "generation"}
+
+
+class AdmissionRejectedError(LLMUnavailableError):
+    """Оценка ожидания в очереди превышает порог: запрос отклоняется сразу, а не по таймауту"""
+
+    def __init__(self, priority: int, estimated_wait: float):
+        super().__init__(
+            f"Очередь к LLM переполнена ({PRIORITY_NAMES.get(priority, priority)}), ожидание ~{estimated_wait:.0f} с",
+            estimated_wait
+        )
+        self.priority = priority
+
+
+class AdmissionController:
+    """
+    Ограничение числа одновременных запросов к LLM с приоритетной очередью.
+    Освободившийся слот передается ожидающему с наименьшим приоритетом (FIFO внутри класса).
+    Ожидание оценивается по средней длительности удержания слота для каждого класса:
+    сумма длительностей запросов в очереди впереди / limit. Если оценка больше max_queue_wait, запрос отклоняется.
+    """
+
+    def __init__(self, limit: int, max_queue_wait: float, default_hold_seconds: float):
+        self.limit = limit
+        self.max_queue_wait = max_queue_wait
+        self.active = 0
+        self.waiters: List[list] = []
+        self.sequence = itertools.count()
+        self.hold_seconds: Dict[int, float] = {priority: default_hold_seconds for priority in PRIORITY_NAMES}
+
+        self.admitted: Dict[int, int] = {priority: 0 for priority in PRIORITY_NAMES}
+        self.rejected: Dict[int, int] = {priority: 0 for priority in PRIORITY_NAMES}
+        self.queued = 0
+
+    def estimated_wait(self, priority: int) -> float:
+        if self.active < self.limit and not self.waiters:
+            return 0.0
+        ahead = sum(self.hold_seconds.get(p, 0.0) for p, _, future in self.waiters if p <= priority)
+        # Плюс время до освобождения ближайшего слота
+        return (ahead + self.hold_seconds.get(priority, 0.0)) / self.limit
+
+    def _wake_next(self):
+        while self.waiters and self.active < self.limit:
+            _, _, future = heapq.heappop(self.waiters)
+            if not future.done():
+                self.active += 1
+                future.set_result(None)
+
+    async def _acquire(self, priority: int):
+        if self.active < self.limit and not self.waiters:
+            self.active += 1
+            return
+
+        estimated = self.estimated_wait(priority)
+        remaining = time_left()
+        # Запрос, который не дождется слота до своего дедлайна, тоже отклоняем сразу
+        if estimated > self.max_queue_wait or (remaining is not None and estimated > remaining):
+            self.rejected[priority] = self.rejected.get(priority, 0) + 1
+            log.warning(f"Запрос к LLM отклонен: оценка ожидания {estimated:.1f} с > {self.max_queue_wait:.0f} с, в очереди {len(self.waiters)}")
+            raise AdmissionRejectedError(priority, estimated)
+
+        future = asyncio.get_running_loop().create_future()
+        entry = [priority, next(self.sequence), future]
+        heapq.heappush(self.waiters, entry)
+        self.queued += 1
+        self._wake_next()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Слот уже был передан этому ожидающему - возвращаем его следующему
+                self.active -= 1
+                self._wake_next()
+            elif entry in self.waiters:
+                self.waiters.remove(entry)
+                heapq.heapify(self.waiters)
+            raise
+
+    def _release(self):
+        self.active -= 1
+        self._wake_next()
+
+    @asynccontextmanager
+    async def slot(self, priority: int) -> AsyncIterator[None]:
+        await self._acquire(priority)
+        self.admitted[priority] = self.admitted.get(priority, 0) + 1
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            held = time.monotonic() - started
+            self.hold_seconds[priority] = 0.9 * self.hold_seconds.get(priority, held) + 0.1 * held
+            self._release()
+
+    def get_stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "queue_length": len(self.waiters),
+            "queued_total": self.queued,
+            "admitted": {PRIORITY_NAMES.get(p, str(p)): n for p, n in self.admitted.items()},
+            "rejected": {PRIORITY_NAMES.get(p, str(p)): n for p, n in self.rejected.items()},
+            "hold_seconds": {PRIORITY_NAMES.get(p, str(p)): round(s, 3) for p, s in self.hold_seconds.items()},
+        }
@@ -1,38 +1,133 @@
+import hashlib
+import json
 import os
+import threading
 import PyPDF2
 from typing import Optional
+from config.Config import CONFIG
+from services.PromptLibrary import get_prompt_library
 from utils.logger import get_logger
 
 log = get_logger("ConscienceIQService")
 
+CONTEXT_TYPES = ("general", "health", "scenario", "plan")
+
+_PDF_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "data", "AI Model - Instructional.pdf"))
+_PARSE_CACHE_FILE = "conscience_iq_principles.json"
+
+_principles_lock = threading.Lock()
+_principles_key: Optional[tuple] = None
+_principles_text: Optional[str] = None
+
+
+def _file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 16), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _parse_cache_path() -> str:
+    return os.path.abspath(os.path.join(CONFIG.cache.dir, _PARSE_CACHE_FILE))
+
+
+def _read_parse_cache(stat: os.stat_result) -> Optional[str]:
+    """Возвращает текст из артефакта на диске, если он соответствует текущему PDF"""
+    try:
+        with open(_parse_cache_path(), 'r', encoding='utf-8') as f:
+            artifact = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if artifact.get("mtime_ns") == stat.st_mtime_ns and artifact.get("size") == stat.st_size:
+        return artifact.get("text")
+
+    # mtime мог смениться при копировании файла - сверяем содержимое по хешу
+    if artifact.get("sha256") == _file_sha256(_PDF_PATH):
+        _write_parse_cache(stat, artifact["sha256"], artifact.get("text", ""))
+        return artifact.get("text")
+    return None
+
+
+def _write_parse_cache(stat: os.stat_result, sha256: str, text: str):
+    path = _parse_cache_path()
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "sha256": sha256, "text": text}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        log.warning(f"Не удалось сохранить кеш разбора PDF: {e}")
+
+
+def _parse_pdf(path: str) -> str:
+    with open(path, 'rb') as file:
+        pdf_reader = PyPDF2.PdfReader(file)
+        pages = [page.extract_text() for page in pdf_reader.pages]
+    return "\n".join(pages).strip()
+
+
+def principles_fingerprint() -> Optional[tuple]:
+    """(mtime, size) PDF с инструкциями - меняется при замене файла"""
+    try:
+        stat = os.stat(_PDF_PATH)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def load_conscience_principles() -> Optional[str]:
+    """
+    Возвращает текст инструкций Conscience IQ из PDF.
+    Результат кешируется в памяти по (mtime, size) файла и на диске в CONFIG.cache.dir,
+    повторный разбор PDF происходит только при изменении файла.
+    Возвращает None, если PDF отсутствует или не читается.
+    """
+    global _principles_key, _principles_text
+
+    try:
+        stat = os.stat(_PDF_PATH)
+    except OSError:
+        log.warning(f"PDF файл с инструкциями не найден: {_PDF_PATH}")
+        return None
+
+    key = (stat.st_mtime_ns, stat.st_size)
+    if key == _principles_key:
+        return _principles_text
+
+    with _principles_lock:
+        if key == _principles_key:
+            return _principles_text
+
+        try:
+            text = _read_parse_cache(stat)
+            if text is not None:
+                log.info(f"Инструкции Conscience IQ загружены из кеша, длина: {len(text)} символов")
+            else:
+                text = _parse_pdf(_PDF_PATH)
+                _write_parse_cache(stat, _file_sha256(_PDF_PATH), text)
+                log.info(f"Загружены инструкции Conscience IQ из PDF, длина: {len(text)} символов")
+        except Exception as e:
+            log.error(f"Ошибка при загрузке PDF инструкций: {e}")
+            return None
+
+        _principles_key = key
+        _principles_text = text
+        return text
+
+
 class ConscienceIQService:
     def __init__(self):
         self.conscience_principles = self._load_conscience_iq_instructions()
     
     def _load_conscience_iq_instructions(self) -> str:
-        """Загружает инструкции из PDF файла"""
-        try:
-            current_dir = os.path.dirname(__file__)
-            pdf_path = os.path.join(current_dir, "..", "..", "data", "AI Model - Instructional.pdf")
-            pdf_path = os.path.abspath(pdf_path)
-            
-            if not os.path.exists(pdf_path):
-                log.warning(f"PDF файл с инструкциями не найден: {pdf_path}")
-                return self._get_default_principles()
-            
-            with open(pdf_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                text_content = ""
-                
-                for page in pdf_reader.pages:
-                    text_content += page.extract_text() + "\n"
-                
-                log.info(f"Загружены инструкции Conscience IQ из PDF, длина: {len(text_content)} символов")
-                return text_content.strip()
-                
-        except Exception as e:
-            log.error(f"Ошибка при загрузке PDF инструкций: {e}")
+        """Загружает инструкции из PDF файла (через кеш процесса)"""
+        text = load_conscience_principles()
+        if text is None:
             return self._get_default_principles()
+        return text
 
     def _get_default_principles(self) -> str:
         return """
@@ -45,60 +140,15 @@ class ConscienceIQService:
         6. Ethical responsibility in all decisions
         """
 
-    def get_enhanced_prompt(self, original_prompt: str, context_type: str = "general") -> str:
-
-        conscience_context = self._get_context_specific_guidance(context_type)
-
-        enhanced_prompt = f"""You are an AI assistant that follows the ethical artificial intelligence principles of Conscience IQ.
-
-    KEY PRINCIPLES:
-    {conscience_context}
-
-    CORE RULE: If a decision affects people, prioritize dignity over efficiency.
-
-    TASK:
-    {original_prompt}
-
-    When responding, you must:
-    - Consider cultural diversity and avoid Western-centric assumptions
-    - Support human dignity, well-being, and growth
-    - Be transparent in your recommendations
-    - Check your responses for bias
-    - Provide advice that empowers people rather than limits them"""
-
-        return enhanced_prompt
+    def get_system_prompt(self, context_type: str = "general") -> str:
+        """
+        Системное сообщение с принципами Conscience IQ для context_type. Текст не зависит от запроса
+        (задача передается отдельным сообщением пользователя), поэтому префикс переиспользуется кешем промптов провайдера.
+        """
+        return get_system_prompt(context_type)
 
     def _get_context_specific_guidance(self, context_type: str) -> str:
-
-        base_principles = """
-    - Human dignity over efficiency
-    - Fairness and bias prevention
-    - Representation of marginalized voices and cultures
-    - Support for growth, well-being, and autonomy
-    - Transparency and accountability in decisions
-    """
-
-        if context_type == "health":
-            return base_principles + """
-    - Prevent racial and cultural biases in medical recommendations
-    - Consider placebo effects and the influence of beliefs on health
-    - Prioritize patient dignity
-    """
-        elif context_type == "scenario":
-            return base_principles + """
-    - Ask questions that empower rather than suppress
-    - Consider various cultural contexts and life situations
-    - Support human growth and self-determination
-    """
-        elif context_type == "plan":
-            return base_principles + """
-    - Create plans that account for individual circumstances
-    - Avoid standardized "one-size-fits-all" approaches
-    - Consider socio-economic factors and constraints
-    - Provide recommendations that empower people
-    """
-        else:
-            return base_principles
+        return _CONTEXT_GUIDANCE.get(context_type, _CONTEXT_GUIDANCE["general"])
 
     def conscience_check(self, response: str, context: str = "") -> bool:
         """
@@ -151,4 +201,53 @@ class ConscienceIQService:
         4. Support for human well-being
         5. Cultural diversity
         6. Ethical review of all decisions
-        """
\ No newline at end of file
+        """
+
+
+def _build_context_specific_guidance(context_type: str) -> str:
+
+    base_principles = """
+    - Human dignity over efficiency
+    - Fairness and bias prevention
+    - Representation of marginalized voices and cultures
+    - Support for growth, well-being, and autonomy
+    - Transparency and accountability in decisions
+    """
+
+    if context_type == "health":
+        return base_principles + """
+    - Prevent racial and cultural biases in medical recommendations
+    - Consider placebo effects and the influence of beliefs on health
+    - Prioritize patient dignity
+    """
+    elif context_type == "scenario":
+        return base_principles + """
+    - Ask questions that empower rather than suppress
+    - Consider various cultural contexts and life situations
+    - Support human growth and self-determination
+    """
+    elif context_type == "plan":
+        return base_principles + """
+    - Create plans that account for individual circumstances
+    - Avoid standardized "one-size-fits-all" approaches
+    - Consider socio-economic factors and constraints
+    - Provide recommendations that empower people
+    """
+    else:
+        return base_principles
+
+
+_CONTEXT_GUIDANCE = {context_type: _build_context_specific_guidance(context_type) for context_type in CONTEXT_TYPES}
+
+
+_SYSTEM_PROMPTS = {}
+
+
+def get_system_prompt(context_type: str = "general") -> str:
+    if context_type not in _CONTEXT_GUIDANCE:
+        context_type = "general"
+    prompt = _SYSTEM_PROMPTS.get(context_type)
+    if prompt is None:
+        guidance = "\n".join(line.strip() for line in _CONTEXT_GUIDANCE[context_type].splitlines() if line.strip())
+        prompt = _SYSTEM_PROMPTS[context_type] = get_prompt_library().render('conscience_system_prompt', guidance=guidance).strip()
+    return prompt
@@ -0,0 +1,235 @@
+import asyncio
+import json
+from dataclasses import dataclass, field
+from typing import List, Optional, Set
+
+from config.Config import CONFIG, MemoryConfig
+from services.AdmissionController import PRIORITY_GENERATION
+from services.context_var import deadline_var
+from services.LLMService import LLMService
+from services.PromptLibrary import get_prompt_library
+from services.SessionStore import SessionStore, get_session_store
+from services.Tracing import trace_var
+from utils.logger import get_logger
+
+log = get_logger("ConversationMemory")
+
+# Служебные токены на одно сообщение чата (роль и разделители)
+_MESSAGE_OVERHEAD_TOKENS = 4
+
+
+class TokenCounter:
+    """Подсчет токенов через tiktoken; без пакета - грубая оценка ~4 символа на токен"""
+
+    def __init__(self, encoding_name: str):
+        try:
+            import tiktoken
+
+            self.encoding = tiktoken.get_encoding(encoding_name)
+        except Exception as e:
+            log.warning(f"Токенизатор {encoding_name} недоступен ({e}), токены оцениваются по длине текста")
+            self.encoding = None
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self.encoding is None:
+            return max(1, len(text) // 4)
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        if self.count(text) <= max_tokens:
+            return text
+        if self.encoding is None:
+            return text[:max_tokens * 4]
+        return self.encoding.decode(self.encoding.encode(text, disallowed_special=())[:max_tokens])
+
+
+@dataclass
+class Turn:
+    question: str
+    answer: str
+    tokens: int
+
+
+@dataclass
+class Conversation:
+    summary: str = ""
+    summary_tokens: int = 0
+    turns: List[Turn] = field(default_factory=list)
+
+    @property
+    def turn_tokens(self) -> int:
+        return sum(turn.tokens for turn in self.turns)
+
+
+def dump_conversation(conversation: Conversation) -> str:
+    """Компактная сериализация: [summary, summary_tokens, [[question, answer, tokens], ...]]"""
+    turns = [[turn.question, turn.answer, turn.tokens] for turn in conversation.turns]
+    return json.dumps([conversation.summary, conversation.summary_tokens, turns], ensure_ascii=False, separators=(",", ":"))
+
+
+def load_conversation(raw: str) -> Conversation:
+    summary, summary_tokens, turns = json.loads(raw)
+    return Conversation(summary, summary_tokens, [Turn(question, answer, tokens) for question, answer, tokens in turns])
+
+
+class ConversationMemory:
+    """
+    История диалога RAG для каждого пользователя с жестким бюджетом токенов.
+    Хранится в хранилище сессий (ключ history:<user_id>), поэтому вытесняется вместе с сессией по простою и LRU.
+    В промпт попадает сводка старых ходов и скользящее окно последних ходов в пределах max_history_tokens.
+    Когда ходы перестают помещаться в окно, старые ходы сворачиваются в сводку фоновым запросом к LLM,
+    не задерживая ответ пользователю.
+    """
+
+    def __init__(self, store: SessionStore, config: MemoryConfig, llm_service: LLMService):
+        self.store = store
+        self.llm_service = llm_service
+        self.counter = TokenCounter(config.tokenizer)
+        self.max_history_tokens = int(config.max_history_tokens)
+        self.summary_max_tokens = int(config.summary_max_tokens)
+        # Ходы, которые хранятся дословно; все, что старше, сворачивается в сводку
+        self.keep_recent_tokens = self.max_history_tokens - self.summary_max_tokens
+        self.summarizing: Set[str] = set()
+        self.tasks: Set[asyncio.Task] = set()
+
+        self.summaries = 0
+        self.summary_failures = 0
+        self.dropped_turns = 0
+
+    async def load(self, user_id: str) -> Conversation:
+        raw = await self.store.get_history(user_id)
+        return load_conversation(raw) if raw is not None else Conversation()
+
+    def build_history(self, conversation: Conversation) -> List[dict]:
+        """Сообщения истории для промпта: сводка и последние ходы, суммарно не больше max_history_tokens"""
+        messages: List[dict] = []
+        budget = self.max_history_tokens
+        if conversation.summary:
+            messages.append({"role": "system", "content": f"Summary of the earlier conversation with the user:\n{conversation.summary}"})
+            budget -= conversation.summary_tokens + _MESSAGE_OVERHEAD_TOKENS
+
+        window: List[dict] = []
+        for turn in reversed(conversation.turns):
+            if turn.tokens > budget:
+                break
+            budget -= turn.tokens
+            window[:0] = [{"role": "user", "content": turn.question}, {"role": "assistant", "content": turn.answer}]
+        return messages + window
+
+    def lock(self, user_id: str):
+        """Блокировка сессии пользователя: ход RAG (чтение истории, ответ, запись) выполняется под ней целиком"""
+        return self.store.lock(user_id)
+
+    async def append(self, user_id: str, question: str, answer: str, locked: bool = False):
+        """
+        Добавляет ход под блокировкой сессии пользователя и при необходимости запускает сворачивание.
+        locked - вызывающий уже держит блокировку (lock), повторно она не берется.
+        """
+        tokens = self.counter.count(question) + self.counter.count(answer) + 2 * _MESSAGE_OVERHEAD_TOKENS
+        if locked:
+            conversation = await self._append_turn(user_id, Turn(question, answer, tokens))
+        else:
+            async with self.store.lock(user_id):
+                conversation = await self._append_turn(user_id, Turn(question, answer, tokens))
+
+        if conversation.turn_tokens > self.keep_recent_tokens and user_id not in self.summarizing:
+            self.summarizing.add(user_id)
+            task = asyncio.create_task(self._summarize(user_id))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def _append_turn(self, user_id: str, turn: Turn) -> Conversation:
+        conversation = await self.load(user_id)
+        conversation.turns.append(turn)
+        # Если сводка отстает (LLM недоступен), хранимая история все равно ограничена
+        while len(conversation.turns) > 1 and conversation.turn_tokens > 2 * self.max_history_tokens:
+            conversation.turns.pop(0)
+            self.dropped_turns += 1
+        await self.store.put_history(user_id, dump_conversation(conversation))
+        return conversation
+
+    def _split(self, conversation: Conversation) -> int:
+        """Число старых ходов, которые не помещаются в keep_recent_tokens и должны уйти в сводку"""
+        kept = 0
+        for index in range(len(conversation.turns) - 1, -1, -1):
+            kept += conversation.turns[index].tokens
+            if kept > self.keep_recent_tokens:
+                return index + 1
+        return 0
+
+    async def _summarize(self, user_id: str):
+        # Задача живет дольше запроса: не привязываем ее к дедлайну и трассировке запроса
+        deadline_var.set(None)
+        trace_var.set(None)
+        try:
+            conversation = await self.load(user_id)
+            count = self._split(conversation)
+            if count == 0:
+                return
+            old_turns = conversation.turns[:count]
+            transcript = "\n\n".join(f"User: {turn.question}\nAssistant: {turn.answer}" for turn in old_turns)
+            prompt = get_prompt_library().render(
+                'summarize_conversation', summary=conversation.summary, turns=transcript, max_tokens=self.summary_max_tokens
+            )
+            summary = await self.llm_service.fetch_completion(
+                prompt, args={"max_tokens": self.summary_max_tokens}, priority=PRIORITY_GENERATION, prompt_key='summarize_conversation'
+            )
+            summary = self.counter.truncate(summary.strip(), self.summary_max_tokens)
+
+            async with self.store.lock(user_id):
+                current = await self.load(user_id)
+                # История могла измениться, пока строилась сводка (очищена или обрезана) - тогда сводку не применяем
+                if current.turns[:count] != old_turns or current.summary != conversation.summary:
+                    return
+                current.summary = summary
+                current.summary_tokens = self.counter.count(summary)
+                current.turns = current.turns[count:]
+                await self.store.put_history(user_id, dump_conversation(current))
+            self.summaries += 1
+            log.info(f"История {user_id}: {count} ходов свернуто в сводку ({current.summary_tokens} токенов), осталось ходов: {len(current.turns)}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.summary_failures += 1
+            log.warning(f"Не удалось свернуть историю {user_id}: {e}")
+        finally:
+            self.summarizing.discard(user_id)
+
+    async def clear(self, user_id: str) -> bool:
+        return await self.store.delete_history(user_id)
+
+    async def close(self):
+        for task in list(self.tasks):
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    def get_stats(self) -> dict:
+        return {
+            "summaries": self.summaries,
+            "summary_failures": self.summary_failures,
+            "summarizing": len(self.summarizing),
+            "dropped_turns": self.dropped_turns,
+        }
+
+
+_memory: Optional[ConversationMemory] = None
+
+
+def get_conversation_memory() -> Optional[ConversationMemory]:
+    """Общая для процесса память диалогов или None, если она выключена в конфиге"""
+    global _memory
+    config = CONFIG.memory
+    if not config.enabled:
+        return None
+    if _memory is None:
+        _memory = ConversationMemory(get_session_store(), config, LLMService())
+    return _memory
+
+
+async def close_conversation_memory():
+    global _memory
+    if _memory is not None:
+        await _memory.close()
+        _memory = None
@@ -0,0 +1,98 @@
+import asyncio
+import hashlib
+import re
+from typing import List, Optional
+
+from config.Config import CONFIG
+from utils.logger import get_logger
+
+log = get_logger("EmbeddingService")
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+class HashingEmbedder:
+    """
+    Детерминированный локальный эмбеддер на хешировании слов и символьных триграмм.
+    Не требует модели и сети - используется для офлайн-тестов и как запасной вариант.
+    """
+
+    def __init__(self, vector_size: int):
+        import numpy as np
+
+        self.np = np
+        self.vector_size = vector_size
+
+    def _features(self, text: str) -> List[str]:
+        words = _WORD_RE.findall(text.lower())
+        features = [f"w:{word}" for word in words]
+        for word in words:
+            padded = f"#{word}#"
+            features.extend(f"c:{padded[i:i + 3]}" for i in range(len(padded) - 2))
+        return features
+
+    def embed(self, texts: List[str]):
+        np = self.np
+        vectors = np.zeros((len(texts), self.vector_size), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+                index = int.from_bytes(digest[:4], "little") % self.vector_size
+                sign = 1.0 if digest[4] & 1 else -1.0
+                vectors[row, index] += sign
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+
+class SentenceTransformerEmbedder:
+    def __init__(self, model_name: str, vector_size: int):
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(model_name)
+        self.vector_size = vector_size
+
+    def embed(self, texts: List[str]):
+        return self.model.encode(texts, normalize_embeddings=True, convert_to_numpy=True).astype("float32")
+
+
+class EmbeddingService:
+    """Асинхронная обертка над эмбеддером: вычисления выполняются в потоке, чтобы не блокировать event loop"""
+
+    def __init__(self, embedder):
+        self.embedder = embedder
+        self.vector_size = embedder.vector_size
+
+    def embed_sync(self, texts: List[str]):
+        return self.embedder.embed(texts)
+
+    async def embed(self, texts: List[str]):
+        return await asyncio.to_thread(self.embedder.embed, texts)
+
+    async def embed_one(self, text: str):
+        vectors = await self.embed([text])
+        return vectors[0]
+
+
+_embedding_service: Optional[EmbeddingService] = None
+
+
+def _create_embedder():
+    kind = CONFIG.qdrant.embedder
+    vector_size = int(CONFIG.qdrant.vector_size)
+    if kind == "sentence_transformers":
+        try:
+            return SentenceTransformerEmbedder(CONFIG.qdrant.model_name, vector_size)
+        except ImportError:
+            log.warning("Пакет sentence_transformers не установлен, используем HashingEmbedder")
+    elif kind != "hashing":
+        log.warning(f"Неизвестный эмбеддер {kind}, используем HashingEmbedder")
+    return HashingEmbedder(vector_size)
+
+
+def get_embedding_service() -> EmbeddingService:
+    global _embedding_service
+    if _embedding_service is None:
+        _embedding_service = EmbeddingService(_create_embedder())
+        log.info(f"Эмбеддер: {type(_embedding_service.embedder).__name__}, размерность {_embedding_service.vector_size}")
+    return _embedding_service
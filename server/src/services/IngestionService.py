@@ -0,0 +1,285 @@
+import hashlib
+import json
+import os
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from config.Config import CONFIG
+from services.EmbeddingService import EmbeddingService, get_embedding_service
+from services.LexicalIndex import get_lexical_index
+from services.VectorStore import get_vector_store, index_path
+from utils.logger import get_logger
+
+log = get_logger("IngestionService")
+
+SUPPORTED_EXTENSIONS = (".pdf", ".txt", ".md")
+_TEXT_BLOCK_SIZE = 64 * 1024
+
+
+@dataclass
+class Chunk:
+    id: str
+    hash: str
+    payload: Dict[str, Any]
+
+
+@dataclass
+class IngestionStats:
+    files_seen: int = 0
+    files_skipped: int = 0
+    files_deleted: int = 0
+    pages: int = 0
+    chunks_embedded: int = 0
+    chunks_skipped: int = 0
+    chunks_deleted: int = 0
+    seconds: float = 0.0
+
+    def summary(self) -> str:
+        seconds = self.seconds or 1e-9
+        return (
+            f"файлов: {self.files_seen} (пропущено без изменений: {self.files_skipped}, удалено: {self.files_deleted}), "
+            f"страниц: {self.pages} ({self.pages / seconds:.1f} стр/с), "
+            f"фрагментов: {self.chunks_embedded} ({self.chunks_embedded / seconds:.1f} фр/с), "
+            f"без изменений: {self.chunks_skipped}, удалено: {self.chunks_deleted}, время: {self.seconds:.1f} с"
+        )
+
+
+def _sha256_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 16), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _iter_pdf_pages(path: str) -> Iterator[Tuple[int, str]]:
+    import PyPDF2
+
+    with open(path, 'rb') as file:
+        reader = PyPDF2.PdfReader(file)
+        for page_number, page in enumerate(reader.pages, start=1):
+            yield page_number, page.extract_text() or ""
+
+
+def _iter_text_pages(path: str) -> Iterator[Tuple[int, str]]:
+    # Текстовые файлы читаются блоками, "страница" - номер блока.
+    # Недочитанное слово в конце блока переносится в следующий блок, чтобы не разрезать его пополам
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        page_number = 0
+        carry = ""
+        while True:
+            block = f.read(_TEXT_BLOCK_SIZE)
+            if not block:
+                if carry:
+                    yield page_number + 1, carry
+                return
+            text = carry + block
+            boundary = max(text.rfind(" "), text.rfind("\n"), text.rfind("\t"), text.rfind("\r"))
+            if boundary >= 0:
+                text, carry = text[:boundary + 1], text[boundary + 1:]
+            else:
+                carry = ""
+            page_number += 1
+            yield page_number, text
+
+
+def iter_pages(path: str) -> Iterator[Tuple[int, str]]:
+    if path.lower().endswith(".pdf"):
+        return _iter_pdf_pages(path)
+    return _iter_text_pages(path)
+
+
+def iter_chunks(pages: Iterator[Tuple[int, str]], chunk_size: int, chunk_overlap: int) -> Iterator[Tuple[int, str]]:
+    """
+    Режет поток страниц на фрагменты около chunk_size символов по границам слов,
+    соседние фрагменты перекрываются на chunk_overlap символов. Возвращает (номер страницы начала фрагмента, текст).
+    """
+    words: deque = deque()
+    length = 0
+    new_words = 0
+    for page_number, text in pages:
+        for word in text.split():
+            words.append((page_number, word))
+            length += len(word) + 1
+            new_words += 1
+            if length >= chunk_size:
+                yield words[0][0], " ".join(w for _, w in words)
+                new_words = 0
+                # Оставляем хвост для перекрытия со следующим фрагментом
+                while words and length > chunk_overlap:
+                    _, dropped = words.popleft()
+                    length -= len(dropped) + 1
+    if new_words:
+        yield words[0][0], " ".join(w for _, w in words)
+
+
+class IngestionService:
+    """
+    Инкрементальная загрузка документов из data/ в векторное хранилище.
+    Файлы обрабатываются постранично, фрагменты эмбеддятся и записываются батчами, поэтому память ограничена
+    размером батча независимо от объема корпуса. Если задан lexical_index, тот же текст индексируется для BM25.
+    Хеши файлов и фрагментов сохраняются в manifest.json: неизмененные файлы и фрагменты пропускаются,
+    фрагменты удаленных файлов удаляются из хранилища.
+    """
+
+    def __init__(self, data_dir: str, vector_store, embedding_service: EmbeddingService,
+                 chunk_size: int, chunk_overlap: int, batch_size: int, manifest_path: str, lexical_index=None):
+        self.data_dir = os.path.abspath(data_dir)
+        self.vector_store = vector_store
+        self.lexical_index = lexical_index
+        self.embedding_service = embedding_service
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.batch_size = batch_size
+        self.manifest_path = manifest_path
+        self.manifest: Dict[str, Dict[str, Any]] = self._load_manifest()
+        self.batch: List[Chunk] = []
+        self.stats = IngestionStats()
+
+    def _load_manifest(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_manifest(self):
+        os.makedirs(os.path.dirname(self.manifest_path), exist_ok=True)
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f, ensure_ascii=False)
+        os.replace(tmp_path, self.manifest_path)
+
+    def _iter_files(self) -> Iterator[str]:
+        for root, _, files in os.walk(self.data_dir):
+            for filename in sorted(files):
+                if filename.lower().endswith(SUPPORTED_EXTENSIONS):
+                    yield os.path.join(root, filename)
+
+    async def _flush_batch(self):
+        if not self.batch:
+            return
+        vectors = await self.embedding_service.embed([chunk.payload["text"] for chunk in self.batch])
+        await self.vector_store.upsert([chunk.id for chunk in self.batch], vectors, [chunk.payload for chunk in self.batch])
+        if self.lexical_index:
+            self.lexical_index.upsert([chunk.id for chunk in self.batch], [chunk.payload["text"] for chunk in self.batch])
+        self.stats.chunks_embedded += len(self.batch)
+        self.batch = []
+
+    async def _delete_chunks(self, ids: List[str]):
+        await self.vector_store.delete(ids)
+        if self.lexical_index:
+            self.lexical_index.delete(ids)
+
+    async def _ingest_file(self, path: str, source: str, stat: os.stat_result, file_hash: str, force: bool = False):
+        previous_chunks: Dict[str, str] = self.manifest.get(source, {}).get("chunks", {})
+        current_chunks: Dict[str, str] = {}
+
+        pages_seen = 0
+
+        def counted_pages():
+            nonlocal pages_seen
+            for page in iter_pages(path):
+                pages_seen += 1
+                yield page
+
+        for index, (page_number, text) in enumerate(iter_chunks(counted_pages(), self.chunk_size, self.chunk_overlap)):
+            chunk_id = str(uuid.uuid5(uuid.NAMESPACE_URL, f"{source}#{index}"))
+            chunk_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+            current_chunks[chunk_id] = chunk_hash
+
+            if not force and previous_chunks.get(chunk_id) == chunk_hash:
+                self.stats.chunks_skipped += 1
+                continue
+
+            self.batch.append(Chunk(chunk_id, chunk_hash, {
+                "source": source,
+                "source_id": f"{source}#p{page_number}",
+                "page": page_number,
+                "chunk": index,
+                "text": text,
+            }))
+            if len(self.batch) >= self.batch_size:
+                await self._flush_batch()
+
+        await self._flush_batch()
+
+        stale = [chunk_id for chunk_id in previous_chunks if chunk_id not in current_chunks]
+        if stale:
+            await self._delete_chunks(stale)
+            self.stats.chunks_deleted += len(stale)
+
+        self.stats.pages += pages_seen
+        self.manifest[source] = {
+            "mtime_ns": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "sha256": file_hash,
+            "chunks": current_chunks,
+        }
+
+    async def run(self, full: bool = False) -> IngestionStats:
+        """Загружает новые и измененные файлы; full=True пересчитывает все файлы заново"""
+        started = time.perf_counter()
+        seen_sources = set()
+
+        if not os.path.isdir(self.data_dir):
+            log.warning(f"Каталог с документами {self.data_dir} не найден")
+
+        for path in self._iter_files():
+            source = os.path.relpath(path, self.data_dir)
+            seen_sources.add(source)
+            self.stats.files_seen += 1
+
+            stat = os.stat(path)
+            previous = self.manifest.get(source)
+            if not full and previous and previous["mtime_ns"] == stat.st_mtime_ns and previous["size"] == stat.st_size:
+                self.stats.files_skipped += 1
+                continue
+
+            file_hash = _sha256_file(path)
+            if not full and previous and previous["sha256"] == file_hash:
+                previous["mtime_ns"] = stat.st_mtime_ns
+                self.stats.files_skipped += 1
+                continue
+
+            try:
+                # full: фрагменты пересчитываются, но прежние id остаются в manifest, чтобы удалить хвост укоротившегося файла
+                await self._ingest_file(path, source, stat, file_hash, force=full)
+                log.info(f"Загружен файл {source}")
+            except Exception as e:
+                log.error(f"Ошибка при загрузке файла {source}: {e}")
+                self.batch = []
+
+        for source in [s for s in self.manifest if s not in seen_sources]:
+            stale = list(self.manifest.pop(source).get("chunks", {}))
+            if stale:
+                await self._delete_chunks(stale)
+            self.stats.files_deleted += 1
+            self.stats.chunks_deleted += len(stale)
+            log.info(f"Файл {source} удален из каталога, удалено фрагментов: {len(stale)}")
+
+        await self.vector_store.flush()
+        if self.lexical_index:
+            self.lexical_index.save()
+        self._save_manifest()
+
+        self.stats.seconds = time.perf_counter() - started
+        log.info(f"Загрузка документов завершена: {self.stats.summary()}")
+        return self.stats
+
+
+def create_ingestion_service(data_dir: Optional[str] = None) -> IngestionService:
+    config = CONFIG.ingestion
+    return IngestionService(
+        data_dir=data_dir or config.data_dir,
+        vector_store=get_vector_store(),
+        embedding_service=get_embedding_service(),
+        chunk_size=int(config.chunk_size),
+        chunk_overlap=int(config.chunk_overlap),
+        batch_size=int(config.batch_size),
+        manifest_path=os.path.join(index_path(CONFIG.qdrant.collection_name), "manifest.json"),
+        lexical_index=get_lexical_index(),
+    )
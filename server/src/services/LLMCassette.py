@@ -0,0 +1,291 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from typing import AsyncIterator, Dict, List, Optional
+
+import httpx
+import openai
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+from config.Config import CONFIG, LLMCassetteConfig
+from services.LLMRetryPolicy import classify_error
+from utils.logger import get_logger
+
+log = get_logger("LLMCassette")
+
+MODES = ("off", "record", "replay")
+
+# Параметры запроса, не влияющие на ответ: не входят в ключ и не записываются
+_TRANSIENT_PARAMS = ("timeout", "stream_options")
+
+
+class CassetteMissError(Exception):
+    """В кассете нет записи для запроса, а в режиме replay обращаться к upstream нельзя"""
+
+
+def request_key(request: dict) -> str:
+    params = {k: v for k, v in request.items() if k not in _TRANSIENT_PARAMS}
+    payload = json.dumps(params, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _content_hash(content) -> str:
+    return hashlib.sha256(str(content).encode("utf-8")).hexdigest()[:16]
+
+
+def _usage_list(usage) -> Optional[list]:
+    if not usage:
+        return None
+    details = getattr(usage, "prompt_tokens_details", None)
+    return [int(usage.prompt_tokens), int(usage.completion_tokens), int(getattr(details, "cached_tokens", None) or 0)]
+
+
+def _usage_dict(usage: Optional[list]) -> Optional[dict]:
+    if not usage:
+        return None
+    prompt_tokens, completion_tokens, cached_tokens = usage
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "prompt_tokens_details": {"cached_tokens": cached_tokens},
+    }
+
+
+def _error_record(error: Exception) -> dict:
+    record = {"kind": classify_error(error), "message": str(error)[:500]}
+    if isinstance(error, openai.APIStatusError):
+        record["status"] = error.status_code
+        retry_after = error.response.headers.get("retry-after")
+        if retry_after:
+            record["retry_after"] = retry_after
+    return record
+
+
+def _replay_error(record: dict) -> Exception:
+    """Исключение того же вида, что и записанная ошибка upstream: повторы и выключатель ведут себя так же"""
+    request = httpx.Request("POST", f"{CONFIG.llm.url}/chat/completions")
+    if "status" in record:
+        headers = {"retry-after": record["retry_after"]} if "retry_after" in record else {}
+        response = httpx.Response(record["status"], headers=headers, request=request)
+        return openai.APIStatusError(record["message"], response=response, body=None)
+    if record["kind"] == "timeout":
+        return openai.APITimeoutError(request=request)
+    if record["kind"] == "connection":
+        return openai.APIConnectionError(request=request)
+    return Exception(record["message"])
+
+
+class LLMCassette:
+    """
+    Запись и воспроизведение обращений к upstream LLM.
+    record: каждое обращение дописывается в path строкой JSON - ключ запроса, параметры, ответ или ошибка, длительность,
+    usage, для потока - фрагменты со смещением (мс) от начала обращения. Тексты сообщений пишутся один раз строкой
+    {"m": hash, "content": ...}, обращения ссылаются на них: системный промпт и история не повторяются в каждой строке.
+    replay: ответы выдаются из кассеты по ключу запроса без сети. Одинаковые запросы получают записи по порядку
+    (последняя повторяется), поэтому ошибки и повторы воспроизводятся как были; emulate_latency выдерживает исходные задержки.
+    """
+
+    def __init__(self, config: LLMCassetteConfig):
+        if config.mode not in MODES:
+            raise ValueError(f"Неизвестный режим кассеты LLM: {config.mode}, допустимые: {', '.join(MODES)}")
+        self.mode = config.mode
+        self.path = config.path
+        self.emulate_latency = bool(config.emulate_latency)
+
+        self.pending: List[str] = []
+        self.written_messages = set()
+        self.records: Dict[str, List[dict]] = {}
+        self.positions: Dict[str, int] = {}
+
+        self.recorded = 0
+        self.replayed = 0
+        self.misses = 0
+
+        if self.mode == "replay":
+            self._load()
+
+    def _load(self):
+        calls = 0
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if "m" in record:
+                    continue
+                self.records.setdefault(record["key"], []).append(record)
+                calls += 1
+        log.info(f"Кассета {self.path}: загружено {calls} обращений к LLM, различных запросов: {len(self.records)}")
+
+    async def create(self, client, prompt_key: str, request: dict):
+        """Замена client.chat.completions.create(**request): записывает обращение или выдает его из кассеты"""
+        key = request_key(request)
+        if self.mode == "replay":
+            record = self._next(key)
+            if request.get("stream"):
+                return self._replay_stream(record)
+            return await self._replay_completion(record)
+
+        started_at = time.time()
+        started = time.perf_counter()
+        try:
+            response = await client.chat.completions.create(**request)
+        except Exception as e:
+            self._write(key, prompt_key, request, started_at, time.perf_counter() - started,
+                        chunks=[] if request.get("stream") else None, error=_error_record(e))
+            raise
+        if request.get("stream"):
+            return self._record_stream(response, key, prompt_key, request, started_at, started)
+
+        message = response.choices[0].message if response.choices else None
+        self._write(key, prompt_key, request, started_at, time.perf_counter() - started,
+                    content=message.content if message else None, usage=response.usage)
+        return response
+
+    async def _record_stream(self, stream, key: str, prompt_key: str, request: dict, started_at: float, started: float) -> AsyncIterator:
+        chunks = []
+        usage = None
+        try:
+            async for chunk in stream:
+                if chunk.usage:
+                    usage = chunk.usage
+                if chunk.choices and chunk.choices[0].delta and chunk.choices[0].delta.content:
+                    chunks.append([round((time.perf_counter() - started) * 1000, 1), chunk.choices[0].delta.content])
+                yield chunk
+        except Exception as e:
+            self._write(key, prompt_key, request, started_at, time.perf_counter() - started, chunks=chunks, usage=usage, error=_error_record(e))
+            raise
+        # Поток, брошенный вызывающим (отключение клиента), не записывается: ответа целиком не было
+        self._write(key, prompt_key, request, started_at, time.perf_counter() - started, chunks=chunks, usage=usage)
+
+    def _write(self, key: str, prompt_key: str, request: dict, started_at: float, duration: float,
+               content: Optional[str] = None, chunks: Optional[list] = None, usage=None, error: Optional[dict] = None):
+        messages = []
+        for message in request.get("messages", []):
+            content_hash = _content_hash(message.get("content"))
+            if content_hash not in self.written_messages:
+                self.written_messages.add(content_hash)
+                self.pending.append(json.dumps({"m": content_hash, "content": message.get("content")}, ensure_ascii=False, separators=(",", ":")))
+            messages.append([message.get("role"), content_hash])
+
+        record = {
+            "ts": round(started_at, 3),
+            "key": key,
+            "prompt_key": prompt_key,
+            "messages": messages,
+            "params": {k: v for k, v in request.items() if k != "messages" and k not in _TRANSIENT_PARAMS},
+            "ms": round(duration * 1000, 1),
+        }
+        if content is not None:
+            record["content"] = content
+        if chunks is not None:
+            record["chunks"] = chunks
+        if usage:
+            record["usage"] = _usage_list(usage)
+        if error:
+            record["error"] = error
+        self.pending.append(json.dumps(record, ensure_ascii=False, separators=(",", ":"), default=str))
+        self.recorded += 1
+
+    def _next(self, key: str) -> dict:
+        records = self.records.get(key)
+        if not records:
+            self.misses += 1
+            raise CassetteMissError(f"В кассете {self.path} нет ответа на запрос {key[:12]}")
+        position = self.positions.get(key, 0)
+        self.positions[key] = position + 1
+        self.replayed += 1
+        return records[min(position, len(records) - 1)]
+
+    async def _replay_completion(self, record: dict) -> ChatCompletion:
+        if self.emulate_latency:
+            await asyncio.sleep(record["ms"] / 1000)
+        if "error" in record:
+            raise _replay_error(record["error"])
+        return ChatCompletion.model_validate({
+            "id": "cassette",
+            "object": "chat.completion",
+            "created": int(record["ts"]),
+            "model": record["params"].get("model", ""),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": record.get("content")}, "finish_reason": "stop"}],
+            "usage": _usage_dict(record.get("usage")),
+        })
+
+    def _chunk(self, record: dict, choices: list, usage: Optional[dict] = None) -> ChatCompletionChunk:
+        return ChatCompletionChunk.model_validate({
+            "id": "cassette",
+            "object": "chat.completion.chunk",
+            "created": int(record["ts"]),
+            "model": record["params"].get("model", ""),
+            "choices": choices,
+            "usage": usage,
+        })
+
+    async def _sleep_until(self, started: float, offset_ms: float):
+        delay = offset_ms / 1000 - (time.perf_counter() - started)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _replay_stream(self, record: dict) -> AsyncIterator[ChatCompletionChunk]:
+        started = time.perf_counter()
+        for offset_ms, text in record.get("chunks", []):
+            if self.emulate_latency:
+                await self._sleep_until(started, offset_ms)
+            yield self._chunk(record, [{"index": 0, "delta": {"content": text}, "finish_reason": None}])
+        if self.emulate_latency:
+            await self._sleep_until(started, record["ms"])
+        if "error" in record:
+            raise _replay_error(record["error"])
+        if record.get("usage"):
+            yield self._chunk(record, [], _usage_dict(record["usage"]))
+
+    async def flush(self):
+        if not self.pending:
+            return
+        lines, self.pending = self.pending, []
+        try:
+            await asyncio.to_thread(self._append, lines)
+        except Exception as e:
+            log.warning(f"Не удалось дописать {len(lines)} строк в кассету {self.path}: {e}")
+
+    def _append(self, lines: List[str]):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+
+    async def run(self, flush_interval: float = 1.0):
+        """Фоновая запись накопленных строк в режиме record: файл дописывается вне пути запроса"""
+        try:
+            while True:
+                await asyncio.sleep(flush_interval)
+                await self.flush()
+        finally:
+            await self.flush()
+
+    def get_stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "recorded": self.recorded,
+            "pending": len(self.pending),
+            "replayed": self.replayed,
+            "misses": self.misses,
+            "requests": len(self.records),
+        }
+
+
+_cassette: Optional[LLMCassette] = None
+
+
+def get_llm_cassette() -> Optional[LLMCassette]:
+    """Общая для процесса кассета или None, если llm.cassette.mode = off"""
+    global _cassette
+    if CONFIG.llm.cassette.mode == "off":
+        return None
+    if _cassette is None:
+        _cassette = LLMCassette(CONFIG.llm.cassette)
+    return _cassette
@@ -0,0 +1,97 @@
+from contextlib import asynccontextmanager
+from typing import Optional
+
+import httpx
+from openai import AsyncOpenAI
+
+from config.Config import CONFIG, LLMConfig
+from services.AdmissionController import PRIORITY_GENERATION, AdmissionController
+from utils.logger import get_logger
+
+log = get_logger("LLMClientPool")
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class LLMClientPool:
+    """
+    Общий для процесса AsyncOpenAI клиент с keep-alive пулом соединений.
+    Параллельные запросы ограничены max_concurrency через AdmissionController с приоритетами и отказом при длинной очереди.
+    """
+
+    def __init__(self, config: LLMConfig):
+        self.config = config
+
+        http2 = bool(config.http2) and _http2_available()
+        if config.http2 and not http2:
+            log.warning("HTTP/2 запрошен в конфиге, но пакет h2 не установлен, используем HTTP/1.1")
+
+        self.http_client = httpx.AsyncClient(
+            http2=http2,
+            timeout=httpx.Timeout(float(config.timeout)),
+            limits=httpx.Limits(
+                max_connections=int(config.max_connections),
+                max_keepalive_connections=int(config.max_keepalive_connections),
+                keepalive_expiry=float(config.keepalive_expiry),
+            ),
+        )
+        self.client = AsyncOpenAI(
+            api_key=config.token,
+            base_url=config.url,
+            timeout=float(config.timeout),
+            # Повторы выполняет LLMService (backoff, Retry-After, выключатель), встроенные повторы SDK отключены
+            max_retries=0,
+            http_client=self.http_client,
+        )
+        self.admission = AdmissionController(
+            int(config.max_concurrency),
+            float(config.admission.max_queue_wait_seconds),
+            float(config.admission.default_hold_seconds)
+        )
+        self.in_flight = 0
+
+        log.info(
+            f"Создан пул LLM клиента: max_connections={config.max_connections}, "
+            f"keepalive={config.max_keepalive_connections}, http2={http2}, max_concurrency={config.max_concurrency}"
+        )
+
+    @asynccontextmanager
+    async def slot(self, priority: int = PRIORITY_GENERATION):
+        async with self.admission.slot(priority):
+            self.in_flight += 1
+            try:
+                yield self.client
+            finally:
+                self.in_flight -= 1
+
+    @property
+    def is_closed(self) -> bool:
+        return self.http_client.is_closed
+
+    async def aclose(self):
+        if not self.http_client.is_closed:
+            await self.client.close()
+            log.info("Пул LLM клиента закрыт")
+
+
+_pool: Optional[LLMClientPool] = None
+
+
+def get_llm_client_pool() -> LLMClientPool:
+    global _pool
+    if _pool is None or _pool.is_closed:
+        _pool = LLMClientPool(CONFIG.llm)
+    return _pool
+
+
+async def close_llm_client_pool():
+    global _pool
+    if _pool is not None:
+        await _pool.aclose()
+        _pool = None
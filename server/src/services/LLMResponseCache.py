@@ -0,0 +1,171 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from config.Config import CONFIG, LLMCacheConfig
+from utils.logger import get_logger
+
+log = get_logger("LLMResponseCache")
+
+
+def make_cache_key(model: str, messages: Any, response_format: Any = None, args: Optional[dict] = None) -> str:
+    payload = json.dumps(
+        {"model": model, "messages": messages, "response_format": response_format, "args": args or {}},
+        sort_keys=True, ensure_ascii=False, default=str
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class SQLiteCacheBackend:
+    """Постоянное хранилище ответов, переживающее перезапуск сервера"""
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)")
+
+    def get(self, key: str) -> Optional[tuple]:
+        with self.lock:
+            row = self.conn.execute("SELECT value, expires_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+        return row
+
+    def set(self, key: str, value: str, expires_at: float):
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO llm_cache (key, value, expires_at) VALUES (?, ?, ?)", (key, value, expires_at))
+
+    def delete(self, key: str):
+        with self.lock:
+            self.conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+
+    def purge_expired(self, now: float) -> int:
+        with self.lock:
+            return self.conn.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (now,)).rowcount
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class LLMResponseCache:
+    """
+    LRU + TTL кеш ответов LLM с ограничением по числу записей и суммарному размеру в байтах.
+    При наличии backend промахи в памяти дочитываются из него, записи дублируются в него.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl_seconds: float, backend: Optional[SQLiteCacheBackend] = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.backend = backend
+        self.entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.total_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _remove(self, key: str):
+        value, _, size = self.entries.pop(key)
+        self.total_bytes -= size
+
+    def _store(self, key: str, value: str, expires_at: float):
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        if key in self.entries:
+            self._remove(key)
+        self.entries[key] = (value, expires_at, size)
+        self.total_bytes += size
+
+        while len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes:
+            oldest = next(iter(self.entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    async def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        entry = self.entries.get(key)
+        if entry is not None:
+            value, expires_at, _ = entry
+            if expires_at > now:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return value
+            self._remove(key)
+            self.expirations += 1
+
+        if self.backend:
+            # Запросы к SQLite выполняются в потоке: медленная или заблокированная база не останавливает event loop
+            try:
+                row = await asyncio.to_thread(self.backend.get, key)
+                if row and row[1] > now:
+                    self._store(key, row[0], row[1])
+                    self.hits += 1
+                    return row[0]
+                if row:
+                    await asyncio.to_thread(self.backend.delete, key)
+                    self.expirations += 1
+            except sqlite3.Error as e:
+                log.warning(f"Не удалось прочитать ответ из постоянного кеша: {e}")
+
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, value: str):
+        expires_at = time.time() + self.ttl_seconds
+        self._store(key, value, expires_at)
+        if self.backend:
+            try:
+                await asyncio.to_thread(self.backend.set, key, value, expires_at)
+            except sqlite3.Error as e:
+                log.warning(f"Не удалось сохранить ответ в постоянный кеш: {e}")
+
+    def clear(self):
+        self.entries.clear()
+        self.total_bytes = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "bytes": self.total_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+_cache: Optional[LLMResponseCache] = None
+
+
+def _create_cache(config: LLMCacheConfig) -> LLMResponseCache:
+    backend = None
+    if config.persistent:
+        backend = SQLiteCacheBackend(os.path.join(CONFIG.cache.dir, "llm_cache.sqlite3"))
+        backend.purge_expired(time.time())
+    log.info(
+        f"Кеш ответов LLM: max_entries={config.max_entries}, max_bytes={config.max_bytes}, "
+        f"ttl={config.ttl_seconds}с, persistent={bool(config.persistent)}"
+    )
+    return LLMResponseCache(int(config.max_entries), int(config.max_bytes), float(config.ttl_seconds), backend)
+
+
+def get_llm_response_cache() -> Optional[LLMResponseCache]:
+    """Общий для процесса кеш ответов или None, если кеш выключен в конфиге"""
+    global _cache
+    if not CONFIG.cache.llm.enabled:
+        return None
+    if _cache is None:
+        _cache = _create_cache(CONFIG.cache.llm)
+    return _cache
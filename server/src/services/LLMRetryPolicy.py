@@ -0,0 +1,264 @@
+import asyncio
+import random
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Dict, Optional
+
+import httpx
+import openai
+
+from config.Config import CONFIG, LLMRetryConfig
+from services.context_var import DeadlineExceededError
+from utils.logger import get_logger
+
+log = get_logger("LLMRetryPolicy")
+
+# Ошибки, после которых запрос повторяется; client_error (400, 401, 403, 404, 422) - нет
+RETRYABLE_ERRORS = ("rate_limit", "server_error", "timeout", "connection", "other")
+# Ошибки, которые говорят о проблемах upstream и учитываются автоматическим выключателем
+BREAKER_ERRORS = ("rate_limit", "server_error", "timeout", "connection")
+
+
+class LLMUnavailableError(Exception):
+    """LLM сейчас недоступен и запрос не отправлялся; отдается клиенту как 503 с Retry-After"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(LLMUnavailableError):
+    """Автоматический выключатель разомкнут: upstream недавно отказывал, запрос не отправляется"""
+
+    def __init__(self, endpoint: str, retry_after: float):
+        super().__init__(f"LLM endpoint {endpoint} временно недоступен, повтор через {retry_after:.0f} с", retry_after)
+        self.endpoint = endpoint
+
+
+def classify_error(error: Exception) -> str:
+    if isinstance(error, LLMUnavailableError):
+        return "unavailable"
+    if isinstance(error, DeadlineExceededError):
+        return "deadline"
+    if isinstance(error, (openai.APITimeoutError, httpx.TimeoutException, asyncio.TimeoutError)):
+        return "timeout"
+    if isinstance(error, (openai.APIConnectionError, httpx.TransportError)):
+        return "connection"
+    if isinstance(error, openai.APIStatusError):
+        if error.status_code == 429:
+            return "rate_limit"
+        if error.status_code >= 500:
+            return "server_error"
+        return "client_error"
+    return "other"
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """Значение заголовка Retry-After (секунды или HTTP-дата) из ответа upstream, если он есть"""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    value = response.headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    """Экспоненциальная задержка с полным джиттером; Retry-After от upstream имеет приоритет (но не больше max_delay)"""
+
+    def __init__(self, max_attempts: int, base_delay: float, max_delay: float):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retries: Dict[str, int] = {}
+
+    def should_retry(self, kind: str, attempt: int) -> bool:
+        return kind in RETRYABLE_ERRORS and attempt < self.max_attempts
+
+    def delay(self, attempt: int, kind: str, error: Exception) -> float:
+        self.retries[kind] = self.retries.get(kind, 0) + 1
+        retry_after = retry_after_seconds(error)
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        base = self.base_delay * (4 if kind == "rate_limit" else 1)
+        return random.uniform(0, min(self.max_delay, base * 2 ** (attempt - 1)))
+
+
+class CircuitBreaker:
+    """
+    Автоматический выключатель для одного endpoint: после failure_threshold отказов подряд размыкается на reset_seconds,
+    затем пропускает один пробный запрос (half-open) и замыкается обратно при его успехе.
+    """
+
+    def __init__(self, endpoint: str, failure_threshold: int, reset_seconds: float):
+        self.endpoint = endpoint
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self.opened = 0
+        self.rejected = 0
+
+    def before_call(self):
+        if self.state == "closed":
+            return
+        remaining = self.opened_at + self.reset_seconds - time.monotonic()
+        if self.state == "open" and remaining <= 0:
+            self.state = "half_open"
+            log.info(f"Выключатель {self.endpoint}: пробный запрос")
+        if self.state == "half_open" and not self.probe_in_flight:
+            self.probe_in_flight = True
+            return
+        self.rejected += 1
+        raise CircuitOpenError(self.endpoint, max(remaining, 1.0))
+
+    def record_success(self):
+        if self.state != "closed":
+            log.info(f"Выключатель {self.endpoint} замкнут: upstream снова отвечает")
+        self.state = "closed"
+        self.failures = 0
+        self.probe_in_flight = False
+
+    def record_cancelled(self):
+        # Отмененный пробный запрос ничего не говорит о состоянии upstream, следующий запрос станет пробным
+        self.probe_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.probe_in_flight = False
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                self.opened += 1
+                log.warning(f"Выключатель {self.endpoint} разомкнут на {self.reset_seconds:.0f} с после {self.failures} отказов")
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    def get_stats(self) -> dict:
+        return {"state": self.state, "failures": self.failures, "opened": self.opened, "rejected": self.rejected}
+
+
+class LatencyTracker:
+    """Скользящее окно длительностей успешных запросов для оценки p95"""
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.samples: deque = deque(maxlen=window)
+        self.min_samples = min_samples
+
+    def observe(self, seconds: float):
+        self.samples.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if len(self.samples) < self.min_samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class HedgedCall:
+    """
+    Hedged-запрос: если первая попытка не завершилась за p95 длительности (но не раньше min_delay),
+    отправляется вторая, используется первый успешный ответ, оставшаяся попытка отменяется.
+    """
+
+    def __init__(self, latency: LatencyTracker, min_delay: float):
+        self.latency = latency
+        self.min_delay = min_delay
+        self.fired = 0
+        self.won = 0
+
+    def hedge_delay(self) -> Optional[float]:
+        p95 = self.latency.percentile(0.95)
+        return None if p95 is None else max(p95, self.min_delay)
+
+    async def run(self, call: Callable[[], Awaitable[str]]) -> str:
+        delay = self.hedge_delay()
+        first = asyncio.ensure_future(call())
+        tasks = {first}
+        try:
+            if delay is not None:
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                if not done:
+                    self.fired += 1
+                    log.info(f"Нет ответа от llm за {delay:.1f} с, отправляем hedged-запрос")
+                    tasks.add(asyncio.ensure_future(call()))
+
+            error = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not first:
+                            self.won += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def get_stats(self) -> dict:
+        return {"fired": self.fired, "won": self.won}
+
+
+_policy: Optional[RetryPolicy] = None
+_breakers: Dict[str, CircuitBreaker] = {}
+_latency: Optional[LatencyTracker] = None
+_hedging: Optional[HedgedCall] = None
+
+
+def _config() -> LLMRetryConfig:
+    return CONFIG.llm.retry
+
+
+def get_retry_policy() -> RetryPolicy:
+    global _policy
+    if _policy is None:
+        config = _config()
+        _policy = RetryPolicy(int(config.max_attempts), float(config.base_delay), float(config.max_delay))
+    return _policy
+
+
+def get_circuit_breaker(endpoint: str) -> CircuitBreaker:
+    breaker = _breakers.get(endpoint)
+    if breaker is None:
+        config = _config()
+        breaker = _breakers[endpoint] = CircuitBreaker(endpoint, int(config.breaker_failure_threshold), float(config.breaker_reset_seconds))
+    return breaker
+
+
+def get_latency_tracker() -> LatencyTracker:
+    global _latency
+    if _latency is None:
+        _latency = LatencyTracker()
+    return _latency
+
+
+def get_hedging() -> Optional[HedgedCall]:
+    """Hedged-запросы или None, если они выключены в конфиге"""
+    global _hedging
+    config = _config()
+    if not config.hedging_enabled:
+        return None
+    if _hedging is None:
+        _hedging = HedgedCall(get_latency_tracker(), float(config.hedge_min_delay))
+    return _hedging
+
+
+def get_retry_stats() -> dict:
+    return {
+        "retries": dict(get_retry_policy().retries),
+        "breakers": {endpoint: breaker.get_stats() for endpoint, breaker in _breakers.items()},
+        "hedging": _hedging.get_stats() if _hedging else None,
+        "p95_seconds": get_latency_tracker().percentile(0.95),
+    }
@@ -1,59 +1,302 @@
+import asyncio
+import contextvars
 import json
-
-from openai import AsyncOpenAI
+import time
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
 
 from config.Config import CONFIG
-from utils.logger import get_logger
+from services.AdmissionController import PRIORITY_GENERATION
+from services.context_var import DeadlineExceededError, check_deadline, deadline_var, time_left
+from services.LLMCassette import get_llm_cassette
+from services.LLMClientPool import get_llm_client_pool
+from services.LLMResponseCache import get_llm_response_cache, make_cache_key
+from services.LLMRetryPolicy import BREAKER_ERRORS, CircuitBreaker, classify_error, get_circuit_breaker, get_hedging, get_latency_tracker, get_retry_policy
+from services.MetricsRegistry import LLM_LATENCY, LLM_REQUESTS, LLM_TOKENS
+from services.Tracing import span, start_span
+from utils.logger import format_payload, get_logger, sample_payload
 
 log = get_logger("LLMService")
 
 
+class FallbackAnswer(str):
+    """Ответ-заглушка вместо ответа LLM (недействительный токен upstream): не кешируется и не сохраняется в историю"""
+
+
+class _StreamSanitizer:
+    """Инкрементальный аналог LLMService._sanitize_content для потоковых ответов"""
+
+    def __init__(self):
+        self.started = False
+        self.pending_whitespace = ""
+
+    def feed(self, delta: str) -> str:
+        delta = delta.replace('\x00', '').replace('\ufeff', '')
+        try:
+            json.dumps(delta, ensure_ascii=False)
+        except (TypeError, ValueError) as e:
+            log.warning(f"Проблема с JSON сериализацией: {e}")
+            delta = ''.join(char for char in delta if ord(char) < 128 or (0x400 <= ord(char) <= 0x4FF))
+
+        if not self.started:
+            delta = delta.lstrip()
+            if not delta:
+                return ""
+            self.started = True
+
+        # Пробелы в конце придерживаем до следующего непустого фрагмента, чтобы итог совпадал со strip()
+        text = self.pending_whitespace + delta
+        stripped = text.rstrip()
+        self.pending_whitespace = text[len(stripped):]
+        return stripped
+
+
+class _InFlightTable:
+    """
+    Таблица выполняющихся запросов к LLM (single-flight): одновременные одинаковые детерминированные вызовы
+    ждут один общий запрос. Запрос к upstream отменяется, только когда его перестали ждать все вызвавшие.
+    Общий запрос выполняется без дедлайна первого вызвавшего: каждый ожидающий ограничивает ожидание своим дедлайном.
+    """
+
+    def __init__(self):
+        self.calls: Dict[str, list] = {}
+        self.leaders = 0
+        self.coalesced = 0
+        self.cancelled = 0
+
+    async def run(self, key: str, call: Callable[[], Awaitable[str]]) -> str:
+        entry = self.calls.get(key)
+        if entry is None:
+            # Копия контекста без дедлайна: уход первого вызвавшего по таймауту не обрывает запрос для остальных
+            context = contextvars.copy_context()
+            context.run(deadline_var.set, None)
+            entry = self.calls[key] = [asyncio.get_running_loop().create_task(call(), context=context), 0]
+            entry[0].add_done_callback(lambda _: self._forget(key, entry))
+            self.leaders += 1
+        else:
+            self.coalesced += 1
+            log.info(f"Запрос к llm присоединен к уже выполняющемуся, ожидающих: {entry[1] + 1}")
+
+        task = entry[0]
+        entry[1] += 1
+        try:
+            check_deadline()
+            try:
+                return await asyncio.wait_for(asyncio.shield(task), timeout=time_left())
+            except asyncio.TimeoutError:
+                if task.done():
+                    raise
+                raise DeadlineExceededError("Время обработки запроса истекло") from None
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0 and not task.done():
+                task.cancel()
+                self._forget(key, entry)
+                self.cancelled += 1
+
+    def _forget(self, key: str, entry: list):
+        if self.calls.get(key) is entry:
+            del self.calls[key]
+
+    def get_stats(self) -> dict:
+        return {
+            "in_flight": len(self.calls),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "cancelled": self.cancelled,
+        }
+
+
+_in_flight = _InFlightTable()
+
+
+def get_single_flight_stats() -> dict:
+    return _in_flight.get_stats()
+
+
+def _is_deterministic(args) -> bool:
+    return not args or args.get("temperature", 0) == 0
+
+
+def _call_timeout() -> float:
+    """Таймаут одного обращения к upstream: не больше llm.timeout и не дальше дедлайна запроса"""
+    remaining = time_left()
+    timeout = float(CONFIG.llm.timeout)
+    return timeout if remaining is None else max(0.001, min(timeout, remaining))
+
+
+def _record_attempt_error(breaker: CircuitBreaker, error: Exception) -> str:
+    """Учитывает неудачную попытку в выключателе и возвращает тип ошибки; при истекшем дедлайне бросает DeadlineExceededError"""
+    remaining = time_left()
+    if remaining is not None and remaining <= 0:
+        # Таймаут вызван дедлайном запроса, а не upstream
+        breaker.record_cancelled()
+        raise DeadlineExceededError("Время обработки запроса истекло") from error
+    kind = classify_error(error)
+    if kind in BREAKER_ERRORS:
+        breaker.record_failure()
+    elif kind in ("client_error", "other"):
+        # upstream ответил, значит он доступен
+        breaker.record_success()
+    else:
+        breaker.record_cancelled()
+    return kind
+
+
+def _retry_delay_fits(delay: float) -> bool:
+    remaining = time_left()
+    return remaining is None or delay < remaining
+
+
+def _messages(prompt: str, system: Optional[str], history: Optional[List[dict]] = None) -> List[dict]:
+    """
+    Системное сообщение (неизменная часть) первым, затем история диалога (растет только в конец), переменная часть - последней:
+    так провайдер переиспользует кеш префикса
+    """
+    messages = [{"role": "system", "content": system}] if system else []
+    messages.extend(history or [])
+    messages.append({"role": "user", "content": prompt})
+    return messages
+
+
+async def _create(client, prompt_key: str, **request):
+    """Обращение к upstream; при включенной кассете оно записывается или выдается из нее"""
+    cassette = get_llm_cassette()
+    if cassette is None:
+        return await client.chat.completions.create(**request)
+    return await cassette.create(client, prompt_key, request)
+
+
+def _cached_tokens(usage) -> int:
+    details = getattr(usage, "prompt_tokens_details", None)
+    return int(getattr(details, "cached_tokens", None) or 0)
+
+
+def _start_call(prompt_key: str, mode: str):
+    return time.perf_counter(), start_span("llm_call", **{"llm.prompt_key": prompt_key, "llm.mode": mode, "llm.model": CONFIG.llm.model})
+
+
+def _call_result(error: BaseException) -> str:
+    return "cancelled" if isinstance(error, (asyncio.CancelledError, GeneratorExit)) else classify_error(error)
+
+
+def _observe_call(prompt_key: str, mode: str, call, usage=None, error: BaseException = None):
+    """Метрики и span одного обращения к upstream: длительность, результат и токены по ключу промпта"""
+    started, call_span = call
+    result = "ok" if error is None else _call_result(error)
+    LLM_LATENCY.observe(time.perf_counter() - started, prompt_key=prompt_key, mode=mode)
+    LLM_REQUESTS.inc(prompt_key=prompt_key, result=result)
+    call_span.set(**{"llm.result": result})
+    if usage:
+        LLM_TOKENS.inc(int(usage.prompt_tokens), prompt_key=prompt_key, type="input")
+        LLM_TOKENS.inc(int(usage.completion_tokens), prompt_key=prompt_key, type="output")
+        # Часть input токенов, взятая провайдером из кеша префикса промпта
+        cached = _cached_tokens(usage)
+        LLM_TOKENS.inc(cached, prompt_key=prompt_key, type="cached_input")
+        call_span.set(**{
+            "llm.input_tokens": int(usage.prompt_tokens),
+            "llm.output_tokens": int(usage.completion_tokens),
+            "llm.cached_input_tokens": cached,
+        })
+    call_span.end(error)
+
+
 class LLMService:
     def __init__(self):
-        self.openai = AsyncOpenAI(
-            api_key=CONFIG.llm.token,
-            base_url=CONFIG.llm.url,
-            timeout=180.0
-        )
+        self.pool = get_llm_client_pool()
+        self.cache = get_llm_response_cache()
         self.request_counter = 0
         self.total_input_token = 0
         self.total_output_token = 0
+        self.total_cached_token = 0
 
-    async def fetch_completion(self, prompt: str, response_format = None, args=None) -> str:
-        self.request_counter += 1
-        request_id = self.request_counter
-        log.info(f"Запрос к llm ({request_id}): {prompt}")
-
-        counter = 0
+    async def _with_retries(self, call: Callable[[], Awaitable[str]]) -> str:
+        """
+        Выполняет запрос с повторами: экспоненциальная задержка с джиттером или Retry-After для 429/5xx/таймаутов,
+        быстрый отказ при разомкнутом выключателе endpoint и, если включено, hedged-запрос после p95 задержки.
+        """
+        policy = get_retry_policy()
+        breaker = get_circuit_breaker(CONFIG.llm.url)
+        hedging = get_hedging()
+        attempt = 0
         while True:
+            attempt += 1
+            check_deadline()
+            breaker.before_call()
+            started = time.perf_counter()
             try:
-                res = await self.__fetch_completion(prompt, response_format, args or {})
-                log.info(f"Ответ от llm ({request_id}): {res}")
-
-                return res
+                # Таймаут httpx ограничивает отдельные операции чтения, поэтому попытку целиком ограничиваем дедлайном
+                res = await asyncio.wait_for(hedging.run(call) if hedging else call(), timeout=time_left())
+            except asyncio.CancelledError:
+                breaker.record_cancelled()
+                raise
             except Exception as e:
-                counter += 1
-                if counter < 3:
-                    pass
-                    log.warning(f"Ошибка при запросе к llm: {str(e)}")
-                else:
+                kind = _record_attempt_error(breaker, e)
+                # При разомкнутом выключателе повтор все равно будет отклонен, поэтому не ждем
+                if not policy.should_retry(kind, attempt) or breaker.state == "open":
+                    raise e
+                delay = policy.delay(attempt, kind, e)
+                if not _retry_delay_fits(delay):
                     raise e
+                log.warning(f"Ошибка при запросе к llm ({kind}), попытка {attempt}/{policy.max_attempts}, повтор через {delay:.1f} с: {str(e)}")
+                await asyncio.sleep(delay)
+                continue
 
-    async def __fetch_completion(self, prompt: str, response_format: None, args) -> str:
+            breaker.record_success()
+            get_latency_tracker().observe(time.perf_counter() - started)
+            return res
+
+    async def fetch_completion(self, prompt: str, response_format = None, args=None, use_cache: bool = True,
+                               priority: int = PRIORITY_GENERATION, prompt_key: str = "unknown", system: Optional[str] = None,
+                               history: Optional[List[dict]] = None) -> str:
+        self.request_counter += 1
+        request_id = self.request_counter
+        full = sample_payload()
+        log.info(f"Запрос к llm ({request_id}, {prompt_key}): {format_payload(prompt, full)}")
+
+        messages = _messages(prompt, system, history)
+        request_key = make_cache_key(CONFIG.llm.model, messages, response_format, args)
+        cache_key = None
+        if use_cache and self.cache:
+            cache_key = request_key
+            cached = await self.cache.get(cache_key)
+            if cached is not None:
+                log.info(f"Ответ от llm ({request_id}) из кеша: {format_payload(cached, full)}")
+                LLM_REQUESTS.inc(prompt_key=prompt_key, result="cache_hit")
+                return cached
+
+        async def call() -> str:
+            return await self._with_retries(lambda: self.__fetch_completion(prompt, messages, response_format, args or {}, cache_key, priority, prompt_key))
+
+        res = await (_in_flight.run(request_key, call) if _is_deterministic(args) else call())
+        log.info(f"Ответ от llm ({request_id}): {format_payload(res, full)}")
+        return res
+
+    async def __fetch_completion(self, prompt: str, messages: List[dict], response_format: None, args, cache_key=None, priority: int = PRIORITY_GENERATION,
+                                 prompt_key: str = "unknown") -> str:
         try:
-            res = await self.openai.chat.completions.create(
-                messages=[{"role": "user", "content": prompt}],
-                model=CONFIG.llm.model,
-                temperature=0,
-                top_p=0.5,
-                response_format = response_format,
-                stream=False,
-                **args
-            )
+            async with self.pool.slot(priority) as client:
+                call = _start_call(prompt_key, "completion")
+                try:
+                    res = await _create(
+                        client, prompt_key,
+                        messages=messages,
+                        model=CONFIG.llm.model,
+                        temperature=0,
+                        top_p=0.5,
+                        response_format = response_format,
+                        stream=False,
+                        timeout=_call_timeout(),
+                        **args
+                    )
+                except BaseException as e:
+                    _observe_call(prompt_key, "completion", call, error=e)
+                    raise
+            _observe_call(prompt_key, "completion", call, res.usage)
 
             if res.usage:
                 self.total_input_token += int(res.usage.prompt_tokens)
                 self.total_output_token += int(res.usage.completion_tokens)
+                self.total_cached_token += _cached_tokens(res.usage)
             else:
                 log.warning("No usage info")
 
@@ -66,9 +309,12 @@ class LLMService:
                 log.error("LLM returned empty content")
                 raise Exception("LLM returned empty content")
 
-            content = self._sanitize_content(content)
+            with span("sanitization"):
+                content = self._sanitize_content(content)
             
             log.debug(f"Обработанный контент, длина: {len(content)}")
+            if cache_key:
+                await self.cache.set(cache_key, content)
             return content
 
         except Exception as e:
@@ -78,50 +324,156 @@ class LLMService:
                 if "express a direct desire to become vegetarian" in prompt.lower():
                     return "NO"
                 else:
-                    return "Sorry, the service is temporarily unavailable. Please try again later."
+                    return FallbackAnswer("Sorry, the service is temporarily unavailable. Please try again later.")
             if "Expecting value" in str(e) or "JSON" in str(e):
                 log.error("JSON parsing error in OpenAI response - возможно ответ обрезан")
             raise e
 
-    async def fetch_completion_history(self, history, args=None) -> str:
+    async def fetch_completion_history(self, history, args=None, use_cache: bool = True, priority: int = PRIORITY_GENERATION,
+                                       prompt_key: str = "unknown") -> str:
         self.request_counter += 1
         request_id = self.request_counter
-        log.info(f"Запрос к llm ({request_id}): {str(json.dumps(history, indent=2, ensure_ascii=False))}")
+        full = sample_payload()
+        if full:
+            log.info(f"Запрос к llm ({request_id}, {prompt_key}): {json.dumps(history, ensure_ascii=False)}")
+        else:
+            last = history[-1].get("content", "") if history else ""
+            log.info(f"Запрос к llm ({request_id}, {prompt_key}): {len(history)} сообщений, последнее: {format_payload(last)}")
 
-        counter = 0
-        while True:
-            try:
-                res = await self.__fetch_completion_history(history, args or {})
-                log.info(f"Ответ от llm ({request_id}): {res}")
+        request_key = make_cache_key(CONFIG.llm.model, history, None, args)
+        cache_key = None
+        if use_cache and self.cache:
+            cache_key = request_key
+            cached = await self.cache.get(cache_key)
+            if cached is not None:
+                log.info(f"Ответ от llm ({request_id}) из кеша: {format_payload(cached, full)}")
+                LLM_REQUESTS.inc(prompt_key=prompt_key, result="cache_hit")
+                return cached
 
-                return res
-            except Exception as e:
-                counter += 1
-                if counter < 3:
-                    pass
-                    log.warning(f"Ошибка при запросе к gpt: {str(e)}")
-                else:
-                    raise e
+        async def call() -> str:
+            return await self._with_retries(lambda: self.__fetch_completion_history(history, args or {}, cache_key, priority, prompt_key))
 
-    async def __fetch_completion_history(self, history, args) -> str:
-        res = await self.openai.chat.completions.create(
-            messages=history,
-            model=CONFIG.llm.model,
-            temperature=0,
-            top_p=0.5,
-            stream=False,
-            **args
-        )
+        res = await (_in_flight.run(request_key, call) if _is_deterministic(args) else call())
+        log.info(f"Ответ от llm ({request_id}): {format_payload(res, full)}")
+        return res
+
+    async def __fetch_completion_history(self, history, args, cache_key=None, priority: int = PRIORITY_GENERATION,
+                                         prompt_key: str = "unknown") -> str:
+        async with self.pool.slot(priority) as client:
+            call = _start_call(prompt_key, "completion")
+            try:
+                res = await _create(
+                    client, prompt_key,
+                    messages=history,
+                    model=CONFIG.llm.model,
+                    temperature=0,
+                    top_p=0.5,
+                    stream=False,
+                    timeout=_call_timeout(),
+                    **args
+                )
+            except BaseException as e:
+                _observe_call(prompt_key, "completion", call, error=e)
+                raise
+        _observe_call(prompt_key, "completion", call, res.usage)
 
         if res.usage:
             self.total_input_token += int(res.usage.prompt_tokens)
             self.total_output_token += int(res.usage.completion_tokens)
+            self.total_cached_token += _cached_tokens(res.usage)
         else:
             log.warning("No usage info")
             pass
 
-        return str(res.choices[0].message.content)
+        content = str(res.choices[0].message.content)
+        if cache_key and res.choices[0].message.content:
+            await self.cache.set(cache_key, content)
+        return content
     
+    async def fetch_completion_stream(self, prompt: str, args=None, priority: int = PRIORITY_GENERATION,
+                                      prompt_key: str = "unknown", system: Optional[str] = None,
+                                      history: Optional[List[dict]] = None) -> AsyncIterator[str]:
+        """
+        Потоковый вариант fetch_completion: отдает очищенные фрагменты ответа по мере генерации.
+        Повторные попытки выполняются только пока ни один фрагмент не был отдан клиенту.
+        """
+        self.request_counter += 1
+        request_id = self.request_counter
+        full = sample_payload()
+        log.info(f"Потоковый запрос к llm ({request_id}, {prompt_key}): {format_payload(prompt, full)}")
+
+        policy = get_retry_policy()
+        breaker = get_circuit_breaker(CONFIG.llm.url)
+        attempt = 0
+        while True:
+            attempt += 1
+            check_deadline()
+            breaker.before_call()
+            emitted = False
+            try:
+                chunks = []
+                async for delta in self.__fetch_completion_stream(_messages(prompt, system, history), args or {}, priority, prompt_key):
+                    emitted = True
+                    chunks.append(delta)
+                    yield delta
+
+                if not emitted:
+                    raise Exception("LLM returned empty content")
+                breaker.record_success()
+                log.info(f"Ответ от llm ({request_id}): {format_payload(''.join(chunks), full)}")
+                return
+            except (asyncio.CancelledError, GeneratorExit):
+                breaker.record_cancelled()
+                raise
+            except Exception as e:
+                kind = _record_attempt_error(breaker, e)
+                if emitted or not policy.should_retry(kind, attempt) or breaker.state == "open":
+                    raise e
+                delay = policy.delay(attempt, kind, e)
+                if not _retry_delay_fits(delay):
+                    raise e
+                log.warning(f"Ошибка при потоковом запросе к llm ({kind}), попытка {attempt}/{policy.max_attempts}, повтор через {delay:.1f} с: {str(e)}")
+                await asyncio.sleep(delay)
+
+    async def __fetch_completion_stream(self, messages: List[dict], args, priority: int = PRIORITY_GENERATION,
+                                        prompt_key: str = "unknown") -> AsyncIterator[str]:
+        sanitizer = _StreamSanitizer()
+        usage = None
+
+        async with self.pool.slot(priority) as client:
+            call = _start_call(prompt_key, "stream")
+            try:
+                stream = await _create(
+                    client, prompt_key,
+                    messages=messages,
+                    model=CONFIG.llm.model,
+                    temperature=0,
+                    top_p=0.5,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                    timeout=_call_timeout(),
+                    **args
+                )
+                async for chunk in stream:
+                    if chunk.usage:
+                        usage = chunk.usage
+                    if not chunk.choices or not chunk.choices[0].delta or not chunk.choices[0].delta.content:
+                        continue
+                    delta = sanitizer.feed(chunk.choices[0].delta.content)
+                    if delta:
+                        yield delta
+            except BaseException as e:
+                _observe_call(prompt_key, "stream", call, usage, error=e)
+                raise
+        _observe_call(prompt_key, "stream", call, usage)
+
+        if usage:
+            self.total_input_token += int(usage.prompt_tokens)
+            self.total_output_token += int(usage.completion_tokens)
+            self.total_cached_token += _cached_tokens(usage)
+        else:
+            log.warning("No usage info")
+
     def _sanitize_content(self, content: str) -> str:
         if not content:
             return content
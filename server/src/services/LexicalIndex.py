@@ -0,0 +1,178 @@
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from config.Config import CONFIG
+from services.VectorStore import index_path
+from utils.logger import get_logger
+
+log = get_logger("LexicalIndex")
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall(text.lower())
+
+
+class BM25Index:
+    """
+    Инвертированный индекс BM25 с постинг-листами в плоских массивах numpy:
+    offsets[t]:offsets[t + 1] - диапазон документов термина t в post_docs/post_tfs.
+    Изменения (upsert/delete) копятся в словаре частот и сворачиваются в массивы перед поиском или сохранением.
+    Хранится в каталоге индекса рядом с векторами: lexical.npz + lexical_meta.json.
+    """
+
+    def __init__(self, path: str, k1: float = 1.5, b: float = 0.75):
+        import numpy as np
+
+        self.np = np
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.lock = threading.RLock()
+
+        self.terms: Dict[str, int] = {}
+        self.doc_ids: List[str] = []
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.post_docs = np.zeros(0, dtype=np.int32)
+        self.post_tfs = np.zeros(0, dtype=np.float32)
+        self.doc_lengths = np.zeros(0, dtype=np.float32)
+
+        # Изменяемое представление {doc_id: Counter}, создается только при изменении индекса
+        self.doc_tfs: Optional[Dict[str, Counter]] = None
+        self.load()
+
+    def _materialize(self):
+        if self.doc_tfs is not None:
+            return
+        doc_tfs = {doc_id: Counter() for doc_id in self.doc_ids}
+        for term, term_index in self.terms.items():
+            start, end = self.offsets[term_index], self.offsets[term_index + 1]
+            for doc, tf in zip(self.post_docs[start:end], self.post_tfs[start:end], strict=True):
+                doc_tfs[self.doc_ids[doc]][term] = int(tf)
+        self.doc_tfs = doc_tfs
+
+    def _compact(self):
+        if self.doc_tfs is None:
+            return
+        np = self.np
+        doc_ids = list(self.doc_tfs)
+        postings: Dict[str, List[Tuple[int, int]]] = {}
+        doc_lengths = np.zeros(len(doc_ids), dtype=np.float32)
+        for doc, doc_id in enumerate(doc_ids):
+            tfs = self.doc_tfs[doc_id]
+            doc_lengths[doc] = sum(tfs.values())
+            for term, tf in tfs.items():
+                postings.setdefault(term, []).append((doc, tf))
+
+        terms = sorted(postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        total = sum(len(postings[term]) for term in terms)
+        post_docs = np.zeros(total, dtype=np.int32)
+        post_tfs = np.zeros(total, dtype=np.float32)
+        position = 0
+        for term_index, term in enumerate(terms):
+            entries = postings[term]
+            post_docs[position:position + len(entries)] = [doc for doc, _ in entries]
+            post_tfs[position:position + len(entries)] = [tf for _, tf in entries]
+            position += len(entries)
+            offsets[term_index + 1] = position
+
+        self.terms = {term: index for index, term in enumerate(terms)}
+        self.doc_ids = doc_ids
+        self.offsets = offsets
+        self.post_docs = post_docs
+        self.post_tfs = post_tfs
+        self.doc_lengths = doc_lengths
+        self.doc_tfs = None
+
+    def upsert(self, ids: List[str], texts: List[str]):
+        with self.lock:
+            self._materialize()
+            for doc_id, text in zip(ids, texts, strict=True):
+                self.doc_tfs[doc_id] = Counter(tokenize(text))
+
+    def delete(self, ids: List[str]):
+        with self.lock:
+            self._materialize()
+            for doc_id in ids:
+                self.doc_tfs.pop(doc_id, None)
+
+    def search(self, query: str, top_k: int) -> List[Tuple[str, float]]:
+        np = self.np
+        with self.lock:
+            self._compact()
+            n_docs = len(self.doc_ids)
+            if n_docs == 0:
+                return []
+
+            avg_length = float(self.doc_lengths.mean()) or 1.0
+            norm = self.k1 * (1 - self.b + self.b * self.doc_lengths / avg_length)
+            scores = np.zeros(n_docs, dtype=np.float32)
+            for term in set(tokenize(query)):
+                term_index = self.terms.get(term)
+                if term_index is None:
+                    continue
+                start, end = self.offsets[term_index], self.offsets[term_index + 1]
+                docs = self.post_docs[start:end]
+                tfs = self.post_tfs[start:end]
+                df = end - start
+                idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+                scores[docs] += idf * tfs * (self.k1 + 1) / (tfs + norm[docs])
+
+            matched = np.flatnonzero(scores)
+            if matched.size == 0:
+                return []
+            k = min(top_k, matched.size)
+            top = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+            top = top[np.argsort(-scores[top])]
+            return [(self.doc_ids[doc], float(scores[doc])) for doc in top]
+
+    def load(self):
+        arrays_path = os.path.join(self.path, "lexical.npz")
+        meta_path = os.path.join(self.path, "lexical_meta.json")
+        if not os.path.exists(arrays_path) or not os.path.exists(meta_path):
+            return
+        with self.lock:
+            with self.np.load(arrays_path) as arrays:
+                self.offsets = arrays["offsets"]
+                self.post_docs = arrays["post_docs"]
+                self.post_tfs = arrays["post_tfs"]
+                self.doc_lengths = arrays["doc_lengths"]
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            self.terms = {term: index for index, term in enumerate(meta["terms"])}
+            self.doc_ids = meta["doc_ids"]
+            self.doc_tfs = None
+        log.info(f"Загружен лексический индекс {self.path}: {len(self.doc_ids)} документов, {len(self.terms)} терминов")
+
+    def save(self):
+        with self.lock:
+            self._compact()
+            os.makedirs(self.path, exist_ok=True)
+            tmp_arrays = os.path.join(self.path, "lexical.tmp.npz")
+            tmp_meta = os.path.join(self.path, "lexical_meta.json.tmp")
+            self.np.savez(tmp_arrays, offsets=self.offsets, post_docs=self.post_docs, post_tfs=self.post_tfs, doc_lengths=self.doc_lengths)
+            terms = sorted(self.terms, key=self.terms.get)
+            with open(tmp_meta, 'w', encoding='utf-8') as f:
+                json.dump({"terms": terms, "doc_ids": self.doc_ids}, f, ensure_ascii=False)
+            os.replace(tmp_arrays, os.path.join(self.path, "lexical.npz"))
+            os.replace(tmp_meta, os.path.join(self.path, "lexical_meta.json"))
+
+
+_lexical_index: Optional[BM25Index] = None
+
+
+def get_lexical_index() -> Optional[BM25Index]:
+    """Общий для процесса BM25 индекс коллекции или None, если гибридный поиск выключен"""
+    global _lexical_index
+    if not CONFIG.qdrant.hybrid_search:
+        return None
+    if _lexical_index is None:
+        _lexical_index = BM25Index(index_path(CONFIG.qdrant.collection_name))
+    return _lexical_index
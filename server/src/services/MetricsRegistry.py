@@ -0,0 +1,187 @@
+import bisect
+import contextvars
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from utils.logger import get_logger
+
+log = get_logger("MetricsRegistry")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 180.0)
+
+# Метки текущего HTTP запроса, которые заполняют обработчики (например, source ответа);
+# словарь создается middleware и общий для всех задач запроса
+request_labels_var = contextvars.ContextVar('request_labels', default=None)
+
+Sample = Tuple[Dict[str, str], float]
+
+
+def set_request_label(name: str, value: str):
+    labels = request_labels_var.get()
+    if labels is not None:
+        labels[name] = value
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, description: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _labels(self, key: Tuple[str, ...]) -> Dict[str, str]:
+        return dict(zip(self.labelnames, key, strict=True))
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._render_samples())
+        return lines
+
+    def _render_samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, description: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, description, labelnames)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def _render_samples(self) -> List[str]:
+        with self.lock:
+            return [f"{self.name}{_format_labels(self._labels(key))} {_format_value(value)}" for key, value in self.values.items()]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, description: str, labelnames: Iterable[str] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, description, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [счетчики по корзинам, сумма, количество]
+        self.series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [[0] * len(self.buckets), 0.0, 0]
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def _render_samples(self) -> List[str]:
+        lines = []
+        with self.lock:
+            for key, (counts, total, count) in self.series.items():
+                labels = self._labels(key)
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts, strict=True):
+                    cumulative += bucket_count
+                    lines.append(f"{self.name}_bucket{_format_labels({**labels, 'le': _format_value(bound)})} {cumulative}")
+                lines.append(f"{self.name}_bucket{_format_labels({**labels, 'le': '+Inf'})} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}")
+                lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+
+class CallbackMetric(_Metric):
+    """Метрика, значения которой вычисляются при выгрузке (gauge или counter из get_stats() сервисов)"""
+
+    def __init__(self, name: str, description: str, kind: str, callback: Callable[[], List[Sample]]):
+        super().__init__(name, description)
+        self.kind = kind
+        self.callback = callback
+
+    def _render_samples(self) -> List[str]:
+        try:
+            samples = self.callback()
+        except Exception as e:
+            log.warning(f"Не удалось вычислить метрику {self.name}: {e}")
+            return []
+        return [f"{self.name}{_format_labels(labels)} {_format_value(value)}" for labels, value in samples]
+
+
+class MetricsRegistry:
+    """Реестр метрик процесса, выгружается в текстовом формате Prometheus (0.0.4)"""
+
+    def __init__(self):
+        self.metrics: Dict[str, _Metric] = {}
+
+    def _register(self, metric: _Metric) -> _Metric:
+        existing = self.metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, description: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self._register(Counter(name, description, labelnames))
+
+    def histogram(self, name: str, description: str, labelnames: Iterable[str] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, description, labelnames, buckets))
+
+    def gauge_callback(self, name: str, description: str, callback: Callable[[], List[Sample]]) -> CallbackMetric:
+        return self._register(CallbackMetric(name, description, "gauge", callback))
+
+    def counter_callback(self, name: str, description: str, callback: Callable[[], List[Sample]]) -> CallbackMetric:
+        return self._register(CallbackMetric(name, description, "counter", callback))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+_registry: Optional[MetricsRegistry] = None
+
+
+def get_metrics_registry() -> MetricsRegistry:
+    global _registry
+    if _registry is None:
+        _registry = MetricsRegistry()
+    return _registry
+
+
+REGISTRY = get_metrics_registry()
+
+REQUEST_LATENCY = REGISTRY.histogram(
+    "rag_bot_request_duration_seconds", "Длительность обработки HTTP запроса (включая потоковую отдачу)",
+    ("endpoint", "method", "status", "source")
+)
+LLM_LATENCY = REGISTRY.histogram(
+    "rag_bot_llm_request_duration_seconds", "Длительность одного обращения к upstream LLM", ("prompt_key", "mode")
+)
+LLM_TOKENS = REGISTRY.counter("rag_bot_llm_tokens_total", "Токены, потраченные на запросы к LLM", ("prompt_key", "type"))
+LLM_REQUESTS = REGISTRY.counter("rag_bot_llm_requests_total", "Обращения к LLM по результату", ("prompt_key", "result"))
@@ -0,0 +1,59 @@
+import os
+from typing import Any, Dict, Optional
+
+import yaml
+from jinja2 import Environment, StrictUndefined, Template, TemplateError
+
+from utils.logger import get_logger
+
+log = get_logger("PromptLibrary")
+
+_PROMPTS_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "prompts.yml"))
+
+
+class PromptLibrary:
+    """
+    Промпты из prompts.yml. Шаблоны с переменными компилируются jinja2 один раз при загрузке,
+    остальные значения (статические ответы, списки ключевых слов) возвращаются как есть.
+    """
+
+    def __init__(self, raw: Dict[str, Any]):
+        self.raw = raw
+        # keep_trailing_newline: результат совпадает с текстом блока yml байт в байт
+        self.environment = Environment(undefined=StrictUndefined, keep_trailing_newline=True, autoescape=False)
+        self.templates: Dict[str, Template] = {}
+        for name, value in raw.items():
+            if isinstance(value, str) and "{{" in value:
+                try:
+                    self.templates[name] = self.environment.from_string(value)
+                except TemplateError as e:
+                    log.error(f"Ошибка в шаблоне промпта {name}: {e}")
+
+    def get(self, name: str, default: Any = None) -> Any:
+        return self.raw.get(name, default)
+
+    def render(self, name: str, **variables) -> str:
+        template = self.templates.get(name)
+        if template is None:
+            return self.raw.get(name) or ''
+        return template.render(**variables)
+
+
+_library: Optional[PromptLibrary] = None
+
+
+def _load_prompts() -> Dict[str, Any]:
+    try:
+        with open(_PROMPTS_PATH, 'r', encoding='utf-8') as f:
+            return yaml.safe_load(f) or {}
+    except Exception as e:
+        log.error(f"Ошибка загрузки промптов: {e}")
+        return {}
+
+
+def get_prompt_library() -> PromptLibrary:
+    global _library
+    if _library is None:
+        _library = PromptLibrary(_load_prompts())
+        log.info(f"Загружено промптов: {len(_library.raw)}, шаблонов: {len(_library.templates)}")
+    return _library
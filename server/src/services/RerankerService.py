@@ -0,0 +1,143 @@
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+from config.Config import CONFIG
+from services.LexicalIndex import tokenize
+from services.RetrievalService import RetrievedChunk
+from utils.logger import get_logger
+
+log = get_logger("RerankerService")
+
+
+def estimate_tokens(text: str) -> int:
+    # Грубая оценка без токенизатора: ~4 символа на токен
+    return max(1, len(text) // 4)
+
+
+class CrossEncoderScorer:
+    def __init__(self, model_name: str):
+        from sentence_transformers import CrossEncoder
+
+        self.model = CrossEncoder(model_name)
+
+    def score(self, pairs: List[Tuple[str, str]]) -> List[float]:
+        return [float(score) for score in self.model.predict(pairs)]
+
+
+class OverlapScorer:
+    """Детерминированная замена cross-encoder для тестов: доля слов вопроса, встречающихся во фрагменте"""
+
+    def score(self, pairs: List[Tuple[str, str]]) -> List[float]:
+        scores = []
+        for query, passage in pairs:
+            query_terms = set(tokenize(query))
+            passage_terms = set(tokenize(passage))
+            scores.append(len(query_terms & passage_terms) / len(query_terms) if query_terms else 0.0)
+        return scores
+
+
+@dataclass
+class RerankResult:
+    chunks: List[RetrievedChunk] = field(default_factory=list)
+    skipped: bool = False
+    elapsed_ms: float = 0.0
+    tokens_saved: int = 0
+
+
+class RerankerService:
+    """
+    Пересчитывает релевантность найденных фрагментов и оставляет keep_top лучших, чтобы сократить промпт.
+    Пары (вопрос, фрагмент) оцениваются батчами; если оценка не укладывается в budget_ms
+    (по прогнозу из средней стоимости пары или по факту после очередного батча), остаются keep_top первых фрагментов в порядке поиска.
+    """
+
+    def __init__(self, scorer, keep_top: int, batch_size: int, budget_ms: float):
+        self.scorer = scorer
+        self.keep_top = keep_top
+        self.batch_size = batch_size
+        self.budget_ms = budget_ms
+        self.avg_pair_ms: Optional[float] = None
+
+        self.reranked = 0
+        self.skipped = 0
+        self.tokens_saved = 0
+
+    def _update_pair_cost(self, batch_ms: float, pairs: int):
+        pair_ms = batch_ms / pairs
+        self.avg_pair_ms = pair_ms if self.avg_pair_ms is None else 0.8 * self.avg_pair_ms + 0.2 * pair_ms
+
+    def _skip(self, chunks: List[RetrievedChunk], started: float, reason: str) -> RerankResult:
+        # Без оценки остаются keep_top первых фрагментов в порядке поиска: промпт не длиннее, чем после реранкинга
+        tokens_saved = sum(estimate_tokens(chunk.text) for chunk in chunks[self.keep_top:])
+        self.skipped += 1
+        self.tokens_saved += tokens_saved
+        log.info(f"Реранкинг пропущен: {reason}")
+        return RerankResult(
+            chunks=chunks[:self.keep_top], skipped=True, elapsed_ms=(time.perf_counter() - started) * 1000, tokens_saved=tokens_saved
+        )
+
+    async def rerank(self, question: str, chunks: List[RetrievedChunk]) -> RerankResult:
+        started = time.perf_counter()
+        if len(chunks) <= self.keep_top:
+            return RerankResult(chunks=chunks)
+
+        if self.avg_pair_ms is not None and self.avg_pair_ms * len(chunks) > self.budget_ms:
+            result = self._skip(chunks, started, f"прогноз {self.avg_pair_ms * len(chunks):.0f} мс > бюджета {self.budget_ms:.0f} мс")
+            # Прогноз постепенно снижается, чтобы после разовой деградации реранкер снова попробовал отработать
+            self.avg_pair_ms *= 0.9
+            return result
+
+        scores: List[float] = []
+        for offset in range(0, len(chunks), self.batch_size):
+            batch = chunks[offset:offset + self.batch_size]
+            batch_started = time.perf_counter()
+            scores.extend(await asyncio.to_thread(self.scorer.score, [(question, chunk.text) for chunk in batch]))
+            self._update_pair_cost((time.perf_counter() - batch_started) * 1000, len(batch))
+
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            if elapsed_ms > self.budget_ms and len(scores) < len(chunks):
+                return self._skip(chunks, started, f"{elapsed_ms:.0f} мс > бюджета {self.budget_ms:.0f} мс")
+
+        order = sorted(range(len(chunks)), key=lambda i: -scores[i])
+        kept = [chunks[i] for i in order[:self.keep_top]]
+        tokens_saved = sum(estimate_tokens(chunks[i].text) for i in order[self.keep_top:])
+
+        self.reranked += 1
+        self.tokens_saved += tokens_saved
+        result = RerankResult(chunks=kept, elapsed_ms=(time.perf_counter() - started) * 1000, tokens_saved=tokens_saved)
+        log.info(f"Реранкинг: {len(chunks)} -> {len(kept)} фрагментов за {result.elapsed_ms:.1f} мс, сэкономлено ~{tokens_saved} токенов промпта")
+        return result
+
+    def get_stats(self) -> dict:
+        return {
+            "reranked": self.reranked,
+            "skipped": self.skipped,
+            "tokens_saved": self.tokens_saved,
+            "avg_pair_ms": self.avg_pair_ms or 0.0,
+        }
+
+
+_reranker_service: Optional[RerankerService] = None
+
+
+def _create_scorer():
+    config = CONFIG.reranker
+    if config.scorer == "cross_encoder":
+        try:
+            return CrossEncoderScorer(config.model_name)
+        except ImportError:
+            log.warning("Пакет sentence_transformers не установлен, используем OverlapScorer")
+    return OverlapScorer()
+
+
+def get_reranker_service() -> Optional[RerankerService]:
+    """Общий для процесса реранкер или None, если он выключен в конфиге"""
+    global _reranker_service
+    config = CONFIG.reranker
+    if not config.enabled:
+        return None
+    if _reranker_service is None:
+        _reranker_service = RerankerService(_create_scorer(), int(config.keep_top), int(config.batch_size), float(config.budget_ms))
+    return _reranker_service
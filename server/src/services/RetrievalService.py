@@ -0,0 +1,134 @@
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from config.Config import CONFIG
+from services.EmbeddingService import EmbeddingService, get_embedding_service
+from services.LexicalIndex import BM25Index, get_lexical_index
+from services.VectorStore import VectorHit, get_vector_store
+from utils.logger import get_logger
+
+log = get_logger("RetrievalService")
+
+
+@dataclass
+class RetrievedChunk:
+    id: str
+    source_id: str
+    text: str
+    score: float
+
+
+@dataclass
+class RetrievalResult:
+    chunks: List[RetrievedChunk] = field(default_factory=list)
+    embed_ms: float = 0.0
+    search_ms: float = 0.0
+
+    @property
+    def total_ms(self) -> float:
+        return self.embed_ms + self.search_ms
+
+    @property
+    def source_ids(self) -> List[str]:
+        return [chunk.source_id for chunk in self.chunks]
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int) -> List[str]:
+    """Объединяет ранжированные списки id: score(d) = sum(1 / (k + rank))"""
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=lambda doc_id: -scores[doc_id])
+
+
+class RetrievalService:
+    """
+    Поиск фрагментов для RAG. Если задан lexical_index, векторный поиск и BM25 выполняются параллельно,
+    а результаты объединяются через reciprocal rank fusion.
+    """
+
+    def __init__(self, embedding_service: EmbeddingService, vector_store, top_k: int,
+                 lexical_index: Optional[BM25Index] = None, rrf_k: int = 60):
+        self.embedding_service = embedding_service
+        self.vector_store = vector_store
+        self.top_k = top_k
+        self.lexical_index = lexical_index
+        self.rrf_k = rrf_k
+
+    async def retrieve(self, question: str, question_vector=None, top_k: Optional[int] = None) -> RetrievalResult:
+        """Ищет top-k фрагментов для вопроса. Готовый эмбеддинг вопроса (например, из семантического кеша) переиспользуется"""
+        result = RetrievalResult()
+
+        started = time.perf_counter()
+        if question_vector is None:
+            question_vector = await self.embedding_service.embed_one(question)
+        result.embed_ms = (time.perf_counter() - started) * 1000
+
+        top_k = top_k or self.top_k
+        started = time.perf_counter()
+        if self.lexical_index:
+            hits = await self._hybrid_search(question, question_vector, top_k)
+        else:
+            hits = await self.vector_store.search(question_vector, top_k)
+        result.search_ms = (time.perf_counter() - started) * 1000
+
+        result.chunks = [
+            RetrievedChunk(
+                id=hit.id,
+                source_id=hit.payload.get("source_id", hit.id),
+                text=hit.payload.get("text", ""),
+                score=hit.score
+            )
+            for hit in hits
+        ]
+
+        log.info(f"Retrieval: {len(result.chunks)} фрагментов, эмбеддинг {result.embed_ms:.1f} мс, поиск {result.search_ms:.1f} мс")
+        return result
+
+    async def _hybrid_search(self, question: str, question_vector, top_k: int) -> List[VectorHit]:
+        vector_hits, lexical_hits = await asyncio.gather(
+            self.vector_store.search(question_vector, top_k),
+            asyncio.to_thread(self.lexical_index.search, question, top_k)
+        )
+        fused_ids = reciprocal_rank_fusion(
+            [[hit.id for hit in vector_hits], [doc_id for doc_id, _ in lexical_hits]], self.rrf_k
+        )[:top_k]
+
+        hits_by_id = {hit.id: hit for hit in vector_hits}
+        missing = [doc_id for doc_id in fused_ids if doc_id not in hits_by_id]
+        payloads = await self.vector_store.get_payloads(missing) if missing else {}
+        lexical_scores = dict(lexical_hits)
+
+        fused = []
+        for doc_id in fused_ids:
+            if doc_id in hits_by_id:
+                fused.append(hits_by_id[doc_id])
+            elif doc_id in payloads:
+                fused.append(VectorHit(doc_id, lexical_scores[doc_id], payloads[doc_id]))
+        return fused
+
+    @staticmethod
+    def format_context(chunks: List[RetrievedChunk]) -> str:
+        return "\n\n".join(f"[{chunk.source_id}] {chunk.text}" for chunk in chunks)
+
+
+_retrieval_service: Optional[RetrievalService] = None
+
+
+def get_retrieval_service() -> Optional[RetrievalService]:
+    """Общий для процесса сервис поиска или None, если retrieval выключен в конфиге"""
+    global _retrieval_service
+    if not CONFIG.qdrant.retrieval_enabled:
+        return None
+    if _retrieval_service is None:
+        _retrieval_service = RetrievalService(
+            get_embedding_service(),
+            get_vector_store(),
+            int(CONFIG.qdrant.top_samples),
+            lexical_index=get_lexical_index(),
+            rrf_k=int(CONFIG.qdrant.rrf_k)
+        )
+    return _retrieval_service
@@ -1,25 +1,39 @@
 import os
-import yaml
 
-from typing import Dict, List, Optional, Any
+from typing import Awaitable, Callable, Dict, List, Optional, Any
 
+from config.Config import CONFIG
 from utils.logger import get_logger
 from services.LLMService import LLMService
+from services.LLMRetryPolicy import LLMUnavailableError
+from services.context_var import DeadlineExceededError
+from services.AdmissionController import PRIORITY_INTERACTIVE
+from services.ScenarioTriggerClassifier import ScenarioTriggerClassifier, TriggerDecision
+from services.ScenarioTurnRules import ScenarioTurnRules
 from services.ConscienceIQService import ConscienceIQService
+from services.SessionStore import SessionStore, get_session_store
+from services.PromptLibrary import get_prompt_library
+from services.Tracing import span
 from endpoints.models.user_scenario import UserScenario
 from endpoints.models.scenario_state import ScenarioState
 from endpoints.models.question_state import QuestionState
 
 log = get_logger("ScenarioService")
 
+TokenCallback = Callable[[str], Awaitable[None]]
+
 class ScenarioService:
     def __init__(self):
         self.llm_service = LLMService()
         self.conscience_service = ConscienceIQService()
-        self.active_scenarios: Dict[str, UserScenario] = {}
-        self.consent_pending: Dict[str, str] = {}
+        self.sessions: SessionStore = get_session_store()
         self.scenario_configs = self._load_scenarios()
-        self.prompts = self._load_prompts()
+        self.prompts = get_prompt_library()
+        self.trigger_classifier = ScenarioTriggerClassifier(
+            self.prompts, list(self.scenario_configs), self.llm_service,
+            prefilter_enabled=bool(CONFIG.scenarios.trigger_prefilter)
+        )
+        self.turn_rules = ScenarioTurnRules()
     
     def _load_scenarios(self) -> Dict[str, List[str]]:
         scenarios = {}
@@ -43,38 +57,27 @@ class ScenarioService:
         
         return scenarios
     
-    def _load_prompts(self) -> Dict[str, str]:
-        try:
-            current_dir = os.path.dirname(__file__)
-            prompts_path = os.path.join(current_dir, "..", "prompts.yml")
-            prompts_path = os.path.abspath(prompts_path)
-            
-            with open(prompts_path, 'r', encoding='utf-8') as f:
-                return yaml.safe_load(f)
-        except Exception as e:
-            log.error(f"Ошибка загрузки промптов: {e}")
-            return {}
-    
     async def detect_scenario_trigger(self, user_message: str) -> Optional[str]:
-        vegans_prompt = self.prompts.get('trigger_prompt_vegans', '').format(user_message=user_message)
-        try:
-            result = await self.llm_service.fetch_completion(vegans_prompt)
-            if "yes" in result.lower():
-                return "vegans"
-        except Exception as e:
-            log.warning(f"Ошибка при определении триггера vegans: {e}")
-
-        employee_prompt = self.prompts.get('trigger_prompt_employee', '').format(user_message=user_message)
-        try:
-            result = await self.llm_service.fetch_completion(employee_prompt)
-            if "yes" in result.lower():
-                return "employee"
-        except Exception as e:
-            log.warning(f"Ошибка при определении триггера employee: {e}")
-
-        return None
+        decision = await self.classify_scenario_trigger(user_message)
+        return decision.scenario_name
+
+    async def classify_scenario_trigger(self, user_message: str) -> TriggerDecision:
+        with span("trigger_detection") as current:
+            decision = await self.trigger_classifier.classify(user_message)
+            current.set(**{"scenario.name": decision.scenario_name, "trigger.llm_calls": decision.llm_calls})
+            return decision
+    
+    def get_classification_stats(self) -> Dict[str, Any]:
+        return {
+            "trigger": self.trigger_classifier.get_stats(),
+            "turn_rules": self.turn_rules.get_stats(),
+        }
     
-    def start_scenario(self, user_id: str, scenario_name: str) -> str:
+    def user_lock(self, user_id: str):
+        """Блокировка сессии пользователя: ход сценария (чтение, обработка, запись) выполняется под ней целиком"""
+        return self.sessions.lock(user_id)
+
+    async def start_scenario(self, user_id: str, scenario_name: str) -> str:
         if scenario_name not in self.scenario_configs:
             return f"Scenario {scenario_name} not found"
 
@@ -86,7 +89,7 @@ class ScenarioService:
             state=ScenarioState.AWAITING_ANSWER,
             current_question_index=0
         )
-        self.active_scenarios[user_id] = user_scenario
+        await self.sessions.put_scenario(user_id, user_scenario)
 
         if scenario_name == "vegans":
             return self.prompts.get('ask_first_question_vegans', '')
@@ -96,15 +99,16 @@ class ScenarioService:
             return f"Unknown scenario: {scenario_name}"
     
     async def _process_consent_response(self, user_id: str, user_response: str) -> str:
-        scenario_name = self.consent_pending[user_id]
-
-        consent_prompt = self.prompts.get('check_user_consent', '').format(answer=user_response)
+        scenario_name = await self.sessions.get_consent(user_id)
 
         try:
-            consent_result = await self.llm_service.fetch_completion(consent_prompt)
+            consent_result = self.turn_rules.classify_consent(user_response)
+            if consent_result is None:
+                consent_prompt = self.prompts.render('check_user_consent', answer=user_response)
+                consent_result = await self.llm_service.fetch_completion(consent_prompt, priority=PRIORITY_INTERACTIVE, prompt_key='check_user_consent')
 
             if "AGREED" in consent_result:
-                del self.consent_pending[user_id]
+                await self.sessions.delete_consent(user_id)
 
                 questions = [QuestionState(q) for q in self.scenario_configs[scenario_name]]
 
@@ -115,7 +119,7 @@ class ScenarioService:
                         state=ScenarioState.BIOMETRIC_BASELINE_1,
                         current_question_index=0
                     )
-                    self.active_scenarios[user_id] = user_scenario
+                    await self.sessions.put_scenario(user_id, user_scenario)
                     return self.prompts.get('biometric_baseline_1_vegans', '')
                 elif scenario_name == "employee":
                     user_scenario = UserScenario(
@@ -124,7 +128,7 @@ class ScenarioService:
                         state=ScenarioState.BIOMETRIC_BASELINE_1,
                         current_question_index=0
                     )
-                    self.active_scenarios[user_id] = user_scenario
+                    await self.sessions.put_scenario(user_id, user_scenario)
                     return self.prompts.get('biometric_baseline_1_employee', '')
                 else:
                     user_scenario = UserScenario(
@@ -133,56 +137,71 @@ class ScenarioService:
                         state=ScenarioState.AWAITING_ANSWER,
                         current_question_index=0
                     )
-                    self.active_scenarios[user_id] = user_scenario
-                    continue_prompt = self.prompts.get('ask_question', '')
+                    await self.sessions.put_scenario(user_id, user_scenario)
                     first_question = user_scenario.questions[0].question
-                    return continue_prompt.format(question=first_question)
+                    return self.prompts.render('ask_question', question=first_question)
 
             elif "DECLINED" in consent_result:
-                del self.consent_pending[user_id]
+                await self.sessions.delete_consent(user_id)
                 return self.prompts.get('user_declined_assessment', '')
 
             else:
                 return self.prompts.get('clarify_consent_answer', '')
 
+        except (LLMUnavailableError, DeadlineExceededError):
+            raise
         except Exception as e:
             log.warning(f"Ошибка при обработке согласия: {e}")
             return self.prompts.get('clarify_consent_answer', '')
 
-    async def process_user_response(self, user_id: str, user_response: str) -> str:
-        if user_id not in self.active_scenarios:
+    async def process_user_response(self, user_id: str, user_response: str, on_token: Optional[TokenCallback] = None) -> str:
+        with span("session_lookup"):
+            scenario = await self.sessions.get_scenario(user_id)
+        if scenario is None:
             return None
 
-        scenario = self.active_scenarios[user_id]
-
+        persist = True
+        try:
+            with span("scenario_turn", **{"scenario.name": scenario.scenario_name}):
+                return await self._process_turn(user_id, scenario, user_response, on_token)
+        except (LLMUnavailableError, DeadlineExceededError):
+            # Ход не состоялся: сессия остается как до хода, повтор сообщения обрабатывается заново
+            persist = False
+            raise
+        finally:
+            if persist:
+                with span("session_store"):
+                    await self.sessions.put_scenario(user_id, scenario)
+
+    async def _process_turn(self, user_id: str, scenario: UserScenario, user_response: str, on_token: Optional[TokenCallback]) -> str:
         # Обработка биометрических этапов для vegans сценария
         if scenario.scenario_name == "vegans":
             if scenario.state == ScenarioState.BIOMETRIC_BASELINE_1:
-                if user_response.lower().strip() == "done":
+                if self.turn_rules.is_done(user_response):
                     scenario.state = ScenarioState.BIOMETRIC_BASELINE_2
                     return self.prompts.get('biometric_baseline_2_vegans', '')
                 else:
                     return "Please type 'Done' when you have finished the 30-second baseline recording."
 
             elif scenario.state == ScenarioState.BIOMETRIC_BASELINE_2:
-                if user_response.lower().strip() == "done":
+                if self.turn_rules.is_done(user_response):
                     scenario.state = ScenarioState.AWAITING_ANSWER
                     baseline_complete = self.prompts.get('baseline_complete_vegans', '')
                     first_question = scenario.questions[0].question
-                    continue_prompt = self.prompts.get('continue_with_assessment_vegans', '').format(question=first_question)
+                    continue_prompt = self.prompts.render('continue_with_assessment_vegans', question=first_question)
                     return f"{baseline_complete}\n\n{continue_prompt}"
                 else:
                     return "Please type 'Done' when you have finished the 30-second baseline recording."
 
             elif scenario.state == ScenarioState.AWAITING_AGENT_MODE_RESPONSE:
-                response_lower = user_response.lower().strip()
-                if any(keyword in response_lower for keyword in ["online", "support", "groups", "communities", "1"]):
+                agent_option = self.turn_rules.classify_agent_mode(user_response, scenario.scenario_name)
+                if agent_option == "online":
                     scenario.state = ScenarioState.COMPLETED
                     return self.prompts.get('agent_mode_response_vegans', '')
-                elif any(keyword in response_lower for keyword in ["local", "region", "2"]):
+                elif agent_option == "local":
                     scenario.state = ScenarioState.COMPLETED
                     return self.prompts.get('agent_mode_response_vegans', '')
-                elif any(keyword in response_lower for keyword in ["skip", "no", "private", "3"]):
+                elif agent_option == "skip":
                     scenario.state = ScenarioState.COMPLETED
                     return "Thank you for completing the assessment. Your results will remain private. Feel free to reach out if you need any assistance in the future!"
                 else:
@@ -191,31 +210,31 @@ class ScenarioService:
         # Обработка биометрических этапов для employee сценария
         elif scenario.scenario_name == "employee":
             if scenario.state == ScenarioState.BIOMETRIC_BASELINE_1:
-                if user_response.lower().strip() == "done":
+                if self.turn_rules.is_done(user_response):
                     scenario.state = ScenarioState.BIOMETRIC_BASELINE_2
                     return self.prompts.get('biometric_baseline_2_employee', '')
                 else:
                     return "Please say 'Done' when you have finished the 30-second baseline recording."
 
             elif scenario.state == ScenarioState.BIOMETRIC_BASELINE_2:
-                if user_response.lower().strip() == "done":
+                if self.turn_rules.is_done(user_response):
                     scenario.state = ScenarioState.AWAITING_ANSWER
                     baseline_complete = self.prompts.get('baseline_complete_employee', '')
                     first_question = scenario.questions[0].question
-                    continue_prompt = self.prompts.get('continue_with_assessment_employee', '').format(question=first_question)
+                    continue_prompt = self.prompts.render('continue_with_assessment_employee', question=first_question)
                     return f"{baseline_complete}\n\n{continue_prompt}"
                 else:
                     return "Please say 'Done' when you have finished the 30-second baseline recording."
 
             elif scenario.state == ScenarioState.AWAITING_AGENT_MODE_RESPONSE:
-                response_lower = user_response.lower().strip()
-                if any(keyword in response_lower for keyword in ["online", "support", "communities", "1"]):
+                agent_option = self.turn_rules.classify_agent_mode(user_response, scenario.scenario_name)
+                if agent_option == "online":
                     scenario.state = ScenarioState.COMPLETED
                     return self.prompts.get('agent_mode_response_employee', '')
-                elif any(keyword in response_lower for keyword in ["local", "professional", "groups", "2"]):
+                elif agent_option == "local":
                     scenario.state = ScenarioState.COMPLETED
                     return self.prompts.get('agent_mode_response_employee', '')
-                elif any(keyword in response_lower for keyword in ["skip", "no", "confidential", "3"]):
+                elif agent_option == "skip":
                     scenario.state = ScenarioState.COMPLETED
                     return "Thank you for completing the cognitive load assessment. Your results will remain confidential. Feel free to reach out if you need any workplace support in the future!"
                 else:
@@ -237,89 +256,72 @@ class ScenarioService:
             scenario.current_question_index += 1
 
             if scenario.current_question_index >= len(scenario.questions):
-                return await self._complete_scenario(user_id)
+                return await self._complete_scenario(user_id, scenario, on_token)
             else:
-                return self._get_next_question_prompt(user_id)
+                return self._get_next_question_prompt(scenario)
         else:
             if current_question.attempts >= 3:
                 current_question.is_satisfied = False
                 scenario.current_question_index += 1
                 
                 if scenario.current_question_index >= len(scenario.questions):
-                    return await self._complete_scenario(user_id)
+                    return await self._complete_scenario(user_id, scenario, on_token)
                 else:
-                    return self._get_next_question_prompt(user_id)
+                    return self._get_next_question_prompt(scenario)
             else:
                 return self._get_clarification_prompt(current_question.question, user_response, scenario.scenario_name)
     
     async def _evaluate_answer_quality(self, question: str, answer: str, scenario_name: str = None) -> bool:
-        if scenario_name == "employee":
-            base_prompt = self.prompts.get('evaluate_answer_quality_employee', '').format(
-                question=question,
-                answer=answer
-            )
-        else:
-            base_prompt = self.prompts.get('evaluate_answer_quality', '').format(
-                question=question,
-                answer=answer
-            )
+        local_result = self.turn_rules.classify_likert(answer)
+        if local_result is not None:
+            return local_result
 
-        enhanced_prompt = self.conscience_service.get_enhanced_prompt(
-            base_prompt, context_type="scenario"
-        )
+        prompt_key = 'evaluate_answer_quality_employee' if scenario_name == "employee" else 'evaluate_answer_quality'
+        base_prompt = self.prompts.render(prompt_key, question=question, answer=answer)
+        system_prompt = self.conscience_service.get_system_prompt(context_type="scenario")
 
         try:
-            result = await self.llm_service.fetch_completion(enhanced_prompt)
+            result = await self.llm_service.fetch_completion(
+                base_prompt, system=system_prompt, priority=PRIORITY_INTERACTIVE, prompt_key=prompt_key
+            )
             return "yes" in result.lower() or "suitable" in result.lower()
+        except (LLMUnavailableError, DeadlineExceededError):
+            # Без оценки ответ не засчитывается: клиент получает 503/408 и повторяет ход
+            raise
         except Exception as e:
             log.warning(f"Ошибка при оценке качества ответа: {e}")
             return len(answer.strip()) > 5
     
-    def _get_next_question_prompt(self, user_id: str) -> str:
-        scenario = self.active_scenarios[user_id]
+    def _get_next_question_prompt(self, scenario: UserScenario) -> str:
         current_question = scenario.questions[scenario.current_question_index]
         
         scenario.state = ScenarioState.AWAITING_ANSWER
 
-        prompt_template = self.prompts.get('ask_question', '')
-            
-        return prompt_template.format(question=current_question.question)
+        return self.prompts.render('ask_question', question=current_question.question)
     
     def _get_clarification_prompt(self, question: str, previous_answer: str, scenario_name: str = None) -> str:
-        if scenario_name == "employee":
-            prompt_template = self.prompts.get('clarify_answer_employee', '')
-        else:
-            prompt_template = self.prompts.get('clarify_answer', '')
-        return prompt_template.format(
-            question=question,
-            previous_answer=previous_answer
-        )
+        prompt_key = 'clarify_answer_employee' if scenario_name == "employee" else 'clarify_answer'
+        return self.prompts.render(prompt_key, question=question, previous_answer=previous_answer)
     
-    async def _complete_scenario(self, user_id: str) -> str:
-        scenario = self.active_scenarios[user_id]
-
+    async def _complete_scenario(self, user_id: str, scenario: UserScenario, on_token: Optional[TokenCallback] = None) -> str:
         answers_summary = ""
         for i, q in enumerate(scenario.questions):
             answers_summary += f"Question {i+1}: {q.question}\nAnswer: {q.answer or 'Not received'}\n\n"
 
-        if scenario.scenario_name == "employee":
-            base_prompt = self.prompts.get('generate_final_plan_employee', '').format(
-                scenario_name=scenario.scenario_name,
-                answers_summary=answers_summary
-            )
-        else:
-            base_prompt = self.prompts.get('generate_final_plan', '').format(
-                scenario_name=scenario.scenario_name,
-                answers_summary=answers_summary
-            )
-
-        enhanced_prompt = self.conscience_service.get_enhanced_prompt(
-            base_prompt, context_type="plan"
-        )
+        prompt_key = 'generate_final_plan_employee' if scenario.scenario_name == "employee" else 'generate_final_plan'
+        base_prompt = self.prompts.render(prompt_key, scenario_name=scenario.scenario_name, answers_summary=answers_summary)
+        system_prompt = self.conscience_service.get_system_prompt(context_type="plan")
 
         try:
             log.info(f"Генерируем финальный план для пользователя {user_id} с учетом Conscience IQ")
-            scenario.final_summary = await self.llm_service.fetch_completion(enhanced_prompt)
+            if on_token:
+                chunks = []
+                async for delta in self.llm_service.fetch_completion_stream(base_prompt, system=system_prompt, prompt_key=prompt_key):
+                    chunks.append(delta)
+                    await on_token(delta)
+                scenario.final_summary = "".join(chunks)
+            else:
+                scenario.final_summary = await self.llm_service.fetch_completion(base_prompt, system=system_prompt, prompt_key=prompt_key)
 
             if scenario.final_summary and scenario.final_summary.strip():
                 conscience_check = self.conscience_service.conscience_check(
@@ -349,6 +351,8 @@ class ScenarioService:
                 scenario.state = ScenarioState.COMPLETED
                 return "Unfortunately, it was not possible to create a personalized plan. Please try again later or request general recommendations for transitioning from vegan to carnivore diet."
 
+        except (LLMUnavailableError, DeadlineExceededError):
+            raise
         except Exception as e:
             log.error(f"Ошибка при генерации финального плана для {user_id}: {str(e)}")
             scenario.state = ScenarioState.COMPLETED
@@ -357,22 +361,19 @@ class ScenarioService:
             else:
                 return self.prompts.get('error_complete_scenario', '')
     
-    def get_user_scenario_state(self, user_id: str) -> Optional[UserScenario]:
-        return self.active_scenarios.get(user_id)
+    async def get_user_scenario_state(self, user_id: str) -> Optional[UserScenario]:
+        with span("session_lookup"):
+            return await self.sessions.get_scenario(user_id)
     
-    def cancel_scenario(self, user_id: str) -> bool:
-        if user_id in self.active_scenarios:
-            del self.active_scenarios[user_id]
-            return True
-        return False
+    async def cancel_scenario(self, user_id: str) -> bool:
+        return await self.sessions.delete_scenario(user_id)
     
-    def cleanup_completed_scenario(self, user_id: str) -> bool:
-        if user_id in self.active_scenarios:
-            scenario = self.active_scenarios[user_id]
-            if scenario.state == ScenarioState.COMPLETED and scenario.final_summary:
-                del self.active_scenarios[user_id]
-                log.info(f"Завершённый сценарий для пользователя {user_id} удалён из памяти")
-                return True
+    async def cleanup_completed_scenario(self, user_id: str) -> bool:
+        scenario = await self.sessions.get_scenario(user_id)
+        if scenario and scenario.state == ScenarioState.COMPLETED and scenario.final_summary:
+            await self.sessions.delete_scenario(user_id)
+            log.info(f"Завершённый сценарий для пользователя {user_id} удалён из хранилища сессий")
+            return True
         return False
     
     def detect_stop_command(self, message: str) -> bool:
@@ -386,14 +387,27 @@ class ScenarioService:
             "abort survey"
         ]
         
-        message_lower = message.lower().strip()
-        return any(keyword in message_lower for keyword in stop_keywords)
+        with span("stop_detection"):
+            message_lower = message.lower().strip()
+            return any(keyword in message_lower for keyword in stop_keywords)
     
-    def stop_scenario_with_message(self, user_id: str) -> str:
-        if user_id in self.active_scenarios:
-            scenario_name = self.active_scenarios[user_id].scenario_name
-            del self.active_scenarios[user_id]
+    async def stop_scenario_with_message(self, user_id: str) -> str:
+        scenario = await self.sessions.get_scenario(user_id)
+        if scenario:
+            scenario_name = scenario.scenario_name
+            await self.sessions.delete_scenario(user_id)
             log.info(f"Сценарий {scenario_name} остановлен по команде пользователя {user_id}")
             return "Survey stopped. The next time you start, it will begin from the first question."
         else:
-            return "There is currently no active survey to stop."
\ No newline at end of file
+            return "There is currently no active survey to stop."
+
+
+_scenario_service: Optional[ScenarioService] = None
+
+
+def get_scenario_service() -> ScenarioService:
+    """Общий для всех роутеров экземпляр сервиса сценариев"""
+    global _scenario_service
+    if _scenario_service is None:
+        _scenario_service = ScenarioService()
+    return _scenario_service
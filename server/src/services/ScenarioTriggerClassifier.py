@@ -0,0 +1,120 @@
+import asyncio
+import re
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from services.AdmissionController import PRIORITY_INTERACTIVE
+from services.context_var import DeadlineExceededError
+from services.LLMRetryPolicy import LLMUnavailableError
+from services.PromptLibrary import PromptLibrary
+from utils.logger import get_logger
+
+log = get_logger("ScenarioTriggerClassifier")
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+@dataclass
+class TriggerDecision:
+    scenario_name: Optional[str]
+    candidates: List[str] = field(default_factory=list)
+    llm_calls: int = 0
+    prefilter_ms: float = 0.0
+    llm_ms: float = 0.0
+
+    @property
+    def total_ms(self) -> float:
+        return self.prefilter_ms + self.llm_ms
+
+
+class ScenarioTriggerClassifier:
+    """
+    Определяет, запускает ли сообщение пользователя один из сценариев.
+
+    Этап 1 - локальный префильтр по ключевым словам `trigger_keywords_<scenario>` из prompts.yml:
+    сообщения без совпадений не отправляются в LLM.
+    Этап 2 - проверки `trigger_prompt_<scenario>` для оставшихся кандидатов выполняются параллельно,
+    поэтому задержка не растет с числом сценариев.
+    """
+
+    def __init__(self, prompts: PromptLibrary, scenario_names: List[str], llm_service, prefilter_enabled: bool = True):
+        self.prompts = prompts
+        self.llm_service = llm_service
+        self.prefilter_enabled = prefilter_enabled
+        self.scenario_names = sorted(name for name in scenario_names if prompts.get(f'trigger_prompt_{name}'))
+        self.keywords = {name: self._load_keywords(name) for name in self.scenario_names}
+
+        self.total_checks = 0
+        self.prefilter_skipped = 0
+        self.llm_calls = 0
+
+    def _load_keywords(self, scenario_name: str) -> List[str]:
+        keywords = self.prompts.get(f'trigger_keywords_{scenario_name}') or []
+        if not keywords:
+            log.warning(f"Для сценария {scenario_name} не заданы trigger_keywords, префильтр всегда пропускает его в LLM")
+        return [str(k).lower() for k in keywords]
+
+    def _prefilter_scores(self, user_message: str) -> Dict[str, int]:
+        words = _WORD_RE.findall(user_message.lower())
+        scores = {}
+        for name in self.scenario_names:
+            keywords = self.keywords[name]
+            if not keywords or not self.prefilter_enabled:
+                scores[name] = 1
+                continue
+            score = sum(1 for word in words if any(word.startswith(k) for k in keywords))
+            if score:
+                scores[name] = score
+        return scores
+
+    async def _check_scenario(self, scenario_name: str, user_message: str) -> bool:
+        prompt_key = f'trigger_prompt_{scenario_name}'
+        prompt = self.prompts.render(prompt_key, user_message=user_message)
+        try:
+            result = await self.llm_service.fetch_completion(prompt, priority=PRIORITY_INTERACTIVE, prompt_key=prompt_key)
+            return "yes" in result.lower()
+        except (LLMUnavailableError, DeadlineExceededError):
+            # Отказ upstream не означает "не сработал": иначе запрос уйдет в RAG и снова обратится к upstream
+            raise
+        except Exception as e:
+            log.warning(f"Ошибка при определении триггера {scenario_name}: {e}")
+            return False
+
+    async def classify(self, user_message: str) -> TriggerDecision:
+        self.total_checks += 1
+
+        started = time.perf_counter()
+        scores = self._prefilter_scores(user_message)
+        candidates = sorted(scores, key=lambda name: (-scores[name], name))
+        decision = TriggerDecision(scenario_name=None, candidates=candidates)
+        decision.prefilter_ms = (time.perf_counter() - started) * 1000
+
+        if not candidates:
+            self.prefilter_skipped += 1
+            log.info(f"Триггер сценария: префильтр отсеял сообщение за {decision.prefilter_ms:.2f} мс")
+            return decision
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*(self._check_scenario(name, user_message) for name in candidates))
+        decision.llm_ms = (time.perf_counter() - started) * 1000
+        decision.llm_calls = len(candidates)
+        self.llm_calls += len(candidates)
+
+        for name, triggered in zip(candidates, results, strict=True):
+            if triggered:
+                decision.scenario_name = name
+                break
+
+        log.info(
+            f"Триггер сценария: кандидаты={candidates}, результат={decision.scenario_name}, "
+            f"префильтр={decision.prefilter_ms:.2f} мс, llm={decision.llm_ms:.0f} мс ({decision.llm_calls} вызовов)"
+        )
+        return decision
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            "total_checks": self.total_checks,
+            "prefilter_skipped": self.prefilter_skipped,
+            "llm_calls": self.llm_calls,
+        }
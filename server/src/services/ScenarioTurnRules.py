@@ -0,0 +1,106 @@
+import re
+from typing import Dict, Optional
+
+_WORD_RE = re.compile(r"[\w']+", re.UNICODE)
+_LIKERT_RE = re.compile(r"^\s*(\d+)\s*[.!)]?\s*$")
+
+_DONE_PHRASES = {"done", "i'm done", "im done", "i am done", "ok done", "okay done", "finished", "i'm finished", "готово"}
+
+_CONSENT_AGREED = {
+    "yes", "y", "yeah", "yep", "yup", "sure", "ok", "okay", "of course", "let's go", "lets go", "go",
+    "continue", "proceed", "let's continue", "yes please", "да", "давай", "продолжить",
+}
+_CONSENT_DECLINED = {
+    "no", "n", "nope", "nah", "not now", "maybe later", "later", "no thanks", "no thank you",
+    "i'm not ready", "im not ready", "not ready", "нет", "не сейчас", "позже",
+}
+
+# Порядок важен: варианты проверяются по очереди, как в исходной логике сценариев
+_AGENT_MODE_OPTIONS = {
+    "vegans": [
+        ("online", ["online", "support", "groups", "communities", "1"]),
+        ("local", ["local", "region", "2"]),
+        ("skip", ["skip", "no", "private", "3"]),
+    ],
+    "employee": [
+        ("online", ["online", "support", "communities", "1"]),
+        ("local", ["local", "professional", "groups", "2"]),
+        ("skip", ["skip", "no", "confidential", "3"]),
+    ],
+}
+
+
+def _normalize(text: str) -> str:
+    text = text.lower().strip().replace("’", "'")
+    return re.sub(r"[\s.!,]+$", "", re.sub(r"\s+", " ", text))
+
+
+def _keyword_matches(word: str, keyword: str) -> bool:
+    # Короткие ключи ("no", "1") сравниваются целиком, чтобы "no" не совпадало с "now" или "know"
+    if len(keyword) <= 2:
+        return word == keyword
+    return word.startswith(keyword)
+
+
+class ScenarioTurnRules:
+    """
+    Детерминированная классификация ответов в сценарии без обращения к LLM.
+    Каждый метод возвращает None, если ответ неоднозначен и решение нужно отдать LLM.
+    """
+
+    def __init__(self):
+        self.hits: Dict[str, int] = {"likert": 0, "consent": 0, "done": 0, "agent_mode": 0}
+        self.fallbacks: Dict[str, int] = {"likert": 0, "consent": 0, "done": 0, "agent_mode": 0}
+
+    def _count(self, kind: str, result):
+        if result is None:
+            self.fallbacks[kind] += 1
+        else:
+            self.hits[kind] += 1
+        return result
+
+    def classify_likert(self, answer: str, low: int = 1, high: int = 7) -> Optional[bool]:
+        """True - корректная оценка по шкале, False - точно некорректная, None - нужна LLM"""
+        match = _LIKERT_RE.match(answer)
+        if match:
+            return self._count("likert", low <= int(match.group(1)) <= high)
+        if not answer.strip():
+            return self._count("likert", False)
+        return self._count("likert", None)
+
+    def is_done(self, answer: str) -> bool:
+        return self._count("done", _normalize(answer) in _DONE_PHRASES)
+
+    def classify_consent(self, answer: str) -> Optional[str]:
+        """Возвращает "AGREED", "DECLINED" или None"""
+        normalized = _normalize(answer)
+        match = _LIKERT_RE.match(normalized)
+        if match:
+            value = int(match.group(1))
+            if 1 <= value <= 7:
+                return self._count("consent", "AGREED" if value >= 4 else "DECLINED")
+            return self._count("consent", None)
+        if normalized in _CONSENT_AGREED:
+            return self._count("consent", "AGREED")
+        if normalized in _CONSENT_DECLINED:
+            return self._count("consent", "DECLINED")
+        return self._count("consent", None)
+
+    def classify_agent_mode(self, answer: str, scenario_name: str) -> Optional[str]:
+        """Возвращает "online", "local", "skip" или None"""
+        words = _WORD_RE.findall(answer.lower())
+        for option, keywords in _AGENT_MODE_OPTIONS.get(scenario_name, []):
+            if any(_keyword_matches(word, keyword) for word in words for keyword in keywords):
+                return self._count("agent_mode", option)
+        return self._count("agent_mode", None)
+
+    def get_stats(self) -> Dict[str, Dict[str, float]]:
+        stats = {}
+        for kind in self.hits:
+            total = self.hits[kind] + self.fallbacks[kind]
+            stats[kind] = {
+                "hits": self.hits[kind],
+                "fallbacks": self.fallbacks[kind],
+                "hit_rate": self.hits[kind] / total if total else 0.0,
+            }
+        return stats
@@ -0,0 +1,129 @@
+import os
+import time
+from typing import Any, Dict, Optional
+
+from config.Config import CONFIG
+from services.ConscienceIQService import principles_fingerprint
+from services.EmbeddingService import EmbeddingService, get_embedding_service
+from utils.logger import get_logger
+
+log = get_logger("SemanticAnswerCache")
+
+_PROMPTS_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "prompts.yml"))
+
+
+def _sources_fingerprint() -> tuple:
+    try:
+        prompts_mtime = os.stat(_PROMPTS_PATH).st_mtime_ns
+    except OSError:
+        prompts_mtime = None
+    return prompts_mtime, principles_fingerprint()
+
+
+class SemanticAnswerCache:
+    """
+    Кеш RAG ответов по смысловой близости вопросов.
+    Эмбеддинги хранятся в предвыделенной матрице, поиск - скалярное произведение нормированных векторов.
+    Записи вытесняются по TTL и по давности последнего использования,
+    кеш полностью сбрасывается при изменении prompts.yml или PDF с инструкциями Conscience IQ.
+    """
+
+    def __init__(self, embedding_service: EmbeddingService, similarity_threshold: float, max_entries: int, ttl_seconds: float):
+        import numpy as np
+
+        self.np = np
+        self.embedding_service = embedding_service
+        self.similarity_threshold = similarity_threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+
+        self.vectors = np.zeros((max_entries, embedding_service.vector_size), dtype=np.float32)
+        self.expires_at = np.zeros(max_entries, dtype=np.float64)
+        self.last_used = np.zeros(max_entries, dtype=np.float64)
+        self.questions: list = [None] * max_entries
+        self.answers: list = [None] * max_entries
+        self.fingerprint = _sources_fingerprint()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _check_fingerprint(self):
+        fingerprint = _sources_fingerprint()
+        if fingerprint != self.fingerprint:
+            log.info("prompts.yml или инструкции Conscience IQ изменились, семантический кеш сброшен")
+            self.clear()
+            self.fingerprint = fingerprint
+            self.invalidations += 1
+
+    def clear(self):
+        self.expires_at[:] = 0
+        self.last_used[:] = 0
+        self.questions = [None] * self.max_entries
+        self.answers = [None] * self.max_entries
+
+    async def lookup(self, question: str) -> tuple:
+        """Возвращает (ответ или None, эмбеддинг вопроса) - эмбеддинг переиспользуется в store()"""
+        self._check_fingerprint()
+        vector = await self.embedding_service.embed_one(question)
+
+        now = time.time()
+        live = self.expires_at > now
+        if live.any():
+            similarities = self.vectors @ vector
+            similarities[~live] = -1.0
+            best = int(similarities.argmax())
+            if similarities[best] >= self.similarity_threshold:
+                self.last_used[best] = now
+                self.hits += 1
+                log.info(f"Семантический кеш: совпадение {similarities[best]:.3f} с вопросом '{self.questions[best]}'")
+                return self.answers[best], vector
+
+        self.misses += 1
+        return None, vector
+
+    def store(self, question: str, answer: str, vector):
+        now = time.time()
+        free = self.np.flatnonzero(self.expires_at <= now)
+        if free.size:
+            slot = int(free[0])
+        else:
+            slot = int(self.last_used.argmin())
+            self.evictions += 1
+
+        self.vectors[slot] = vector
+        self.expires_at[slot] = now + self.ttl_seconds
+        self.last_used[slot] = now
+        self.questions[slot] = question
+        self.answers[slot] = answer
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": int((self.expires_at > time.time()).sum()),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+_semantic_cache: Optional[SemanticAnswerCache] = None
+
+
+def get_semantic_answer_cache() -> Optional[SemanticAnswerCache]:
+    """Общий для процесса семантический кеш или None, если он выключен в конфиге"""
+    global _semantic_cache
+    config = CONFIG.cache.semantic
+    if not config.enabled:
+        return None
+    if _semantic_cache is None:
+        _semantic_cache = SemanticAnswerCache(
+            get_embedding_service(),
+            float(config.similarity_threshold),
+            int(config.max_entries),
+            float(config.ttl_seconds)
+        )
+    return _semantic_cache
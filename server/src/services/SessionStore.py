@@ -0,0 +1,408 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Optional, Tuple
+
+from config.Config import CONFIG
+from endpoints.models.question_state import QuestionState
+from endpoints.models.scenario_state import ScenarioState
+from endpoints.models.user_scenario import UserScenario
+from utils.logger import get_logger
+
+log = get_logger("SessionStore")
+
+_LOCK_POLL_SECONDS = 0.05
+
+_HISTORY_PREFIX = "history:"
+
+
+def dump_scenario(scenario: UserScenario) -> str:
+    """
+    Компактная сериализация сессии: позиционный JSON без имен полей и пробелов
+    [scenario_name, state, current_question_index, [[question, answer, attempts, is_satisfied], ...], final_summary]
+    """
+    questions = [[q.question, q.answer, q.attempts, int(q.is_satisfied)] for q in scenario.questions]
+    data = [scenario.scenario_name, scenario.state.value, scenario.current_question_index, questions, scenario.final_summary]
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
+def load_scenario(raw: str) -> UserScenario:
+    name, state, index, questions, final_summary = json.loads(raw)
+    return UserScenario(
+        scenario_name=name,
+        state=ScenarioState(state),
+        current_question_index=index,
+        questions=[QuestionState(question, answer, attempts, bool(satisfied)) for question, answer, attempts, satisfied in questions],
+        final_summary=final_summary
+    )
+
+
+class SessionStore:
+    """
+    Хранилище сессий (UserScenario, ожидающие согласия, история диалога RAG), общее для всех воркеров.
+    Наследники реализуют операции со строковыми значениями и межпроцессную блокировку;
+    lock(user_id) сериализует ходы одного пользователя: сначала внутри процесса, затем между процессами.
+    Брошенные сессии вытесняются по простою (idle_ttl_seconds) и по числу записей (max_sessions, LRU):
+    это делает фоновый run_sweeper, а бэкенды с дешевым учетом порядка ограничивают число записей и при записи.
+    История диалога считается и ограничивается отдельно (max_histories), чтобы не вытеснять сессии сценариев.
+    """
+
+    name = "base"
+
+    def __init__(self, lock_ttl_seconds: float, idle_ttl_seconds: float, max_sessions: int, max_histories: int):
+        self.lock_ttl_seconds = lock_ttl_seconds
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self.max_sessions = max_sessions
+        self.max_histories = max_histories
+        self.local_locks: Dict[str, list] = {}
+        self.lock_waits = 0
+
+        self.entries = 0
+        self.history_entries = 0
+        self.sweeps = 0
+        self.evicted_idle = 0
+        self.evicted_lru = 0
+
+    async def _get(self, key: str) -> Optional[str]:
+        raise NotImplementedError
+
+    async def _set(self, key: str, value: str):
+        raise NotImplementedError
+
+    async def _delete(self, key: str) -> bool:
+        raise NotImplementedError
+
+    async def _try_lock(self, user_id: str, token: str) -> bool:
+        return True
+
+    async def _unlock(self, user_id: str, token: str):
+        pass
+
+    async def _sweep(self, now: float) -> Tuple[int, int, int, int]:
+        """
+        Удаляет простаивающие и лишние записи,
+        возвращает (удалено по простою, удалено по LRU, осталось сессий, осталось историй диалога)
+        """
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+    async def get_scenario(self, user_id: str) -> Optional[UserScenario]:
+        raw = await self._get(f"scenario:{user_id}")
+        return load_scenario(raw) if raw is not None else None
+
+    async def put_scenario(self, user_id: str, scenario: UserScenario):
+        await self._set(f"scenario:{user_id}", dump_scenario(scenario))
+
+    async def delete_scenario(self, user_id: str) -> bool:
+        return await self._delete(f"scenario:{user_id}")
+
+    async def get_consent(self, user_id: str) -> Optional[str]:
+        return await self._get(f"consent:{user_id}")
+
+    async def set_consent(self, user_id: str, scenario_name: str):
+        await self._set(f"consent:{user_id}", scenario_name)
+
+    async def delete_consent(self, user_id: str) -> bool:
+        return await self._delete(f"consent:{user_id}")
+
+    async def get_history(self, user_id: str) -> Optional[str]:
+        return await self._get(f"{_HISTORY_PREFIX}{user_id}")
+
+    async def put_history(self, user_id: str, raw: str):
+        await self._set(f"{_HISTORY_PREFIX}{user_id}", raw)
+
+    async def delete_history(self, user_id: str) -> bool:
+        return await self._delete(f"{_HISTORY_PREFIX}{user_id}")
+
+    @asynccontextmanager
+    async def lock(self, user_id: str) -> AsyncIterator[None]:
+        entry = self.local_locks.get(user_id)
+        if entry is None:
+            entry = self.local_locks[user_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                token = uuid.uuid4().hex
+                if not await self._try_lock(user_id, token):
+                    self.lock_waits += 1
+                    while not await self._try_lock(user_id, token):
+                        await asyncio.sleep(_LOCK_POLL_SECONDS)
+                try:
+                    yield
+                finally:
+                    try:
+                        await self._unlock(user_id, token)
+                    except Exception as e:
+                        log.warning(f"Не удалось снять блокировку сессии {user_id}: {e}")
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                self.local_locks.pop(user_id, None)
+
+    async def sweep(self) -> int:
+        evicted_idle, evicted_lru, self.entries, self.history_entries = await self._sweep(time.time())
+        self.sweeps += 1
+        self.evicted_idle += evicted_idle
+        self.evicted_lru += evicted_lru
+        if evicted_idle or evicted_lru:
+            log.info(
+                f"Вытеснено записей: по простою {evicted_idle}, по лимиту {evicted_lru}, "
+                f"осталось сессий: {self.entries}, историй диалога: {self.history_entries}"
+            )
+        return evicted_idle + evicted_lru
+
+    async def run_sweeper(self, interval_seconds: float):
+        """Фоновая очистка сессий, запускается задачей на время жизни приложения"""
+        while True:
+            await asyncio.sleep(interval_seconds)
+            try:
+                await self.sweep()
+            except Exception as e:
+                log.warning(f"Ошибка при очистке сессий: {e}")
+
+    def get_stats(self) -> dict:
+        return {
+            "backend": self.name,
+            "entries": self.entries,
+            "history_entries": self.history_entries,
+            "locked_users": len(self.local_locks),
+            "lock_waits": self.lock_waits,
+            "sweeps": self.sweeps,
+            "evicted_idle": self.evicted_idle,
+            "evicted_lru": self.evicted_lru,
+        }
+
+
+class InMemorySessionStore(SessionStore):
+    """
+    Сессии в памяти процесса: подходит только для одного воркера.
+    Записи упорядочены по последнему обращению, поэтому лимиты max_sessions и max_histories соблюдаются уже при записи.
+    """
+
+    name = "memory"
+
+    def __init__(self, lock_ttl_seconds: float, idle_ttl_seconds: float, max_sessions: int, max_histories: int):
+        super().__init__(lock_ttl_seconds, idle_ttl_seconds, max_sessions, max_histories)
+        self.values: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self.histories: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+
+    def _bucket(self, key: str) -> Tuple["OrderedDict[str, Tuple[str, float]]", int]:
+        if key.startswith(_HISTORY_PREFIX):
+            return self.histories, self.max_histories
+        return self.values, self.max_sessions
+
+    def _count(self):
+        self.entries = len(self.values)
+        self.history_entries = len(self.histories)
+
+    async def _get(self, key: str) -> Optional[str]:
+        values, _ = self._bucket(key)
+        entry = values.get(key)
+        if entry is None:
+            return None
+        values[key] = (entry[0], time.time())
+        values.move_to_end(key)
+        return entry[0]
+
+    async def _set(self, key: str, value: str):
+        values, limit = self._bucket(key)
+        values[key] = (value, time.time())
+        values.move_to_end(key)
+        while len(values) > limit:
+            values.popitem(last=False)
+            self.evicted_lru += 1
+        self._count()
+
+    async def _delete(self, key: str) -> bool:
+        values, _ = self._bucket(key)
+        removed = values.pop(key, None) is not None
+        self._count()
+        return removed
+
+    async def _sweep(self, now: float) -> Tuple[int, int, int, int]:
+        cutoff = now - self.idle_ttl_seconds
+        evicted = 0
+        for values in (self.values, self.histories):
+            expired = []
+            for key, (_, touched_at) in values.items():
+                if touched_at > cutoff:
+                    break
+                # Сессию, ход которой выполняется прямо сейчас, не трогаем
+                if key.split(":", 1)[1] not in self.local_locks:
+                    expired.append(key)
+            for key in expired:
+                del values[key]
+            evicted += len(expired)
+        return evicted, 0, len(self.values), len(self.histories)
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Сессии в SQLite (WAL): файл общий для воркеров на одной машине и переживает перезапуск.
+    Блокировка пользователя - строка в session_locks с временем истечения, чтобы упавший воркер не держал ее вечно.
+    Простой считается от последней записи сессии (каждый ход сценария ее перезаписывает).
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: str, lock_ttl_seconds: float, idle_ttl_seconds: float, max_sessions: int, max_histories: int):
+        super().__init__(lock_ttl_seconds, idle_ttl_seconds, max_sessions, max_histories)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.db_lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA busy_timeout=5000")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS sessions (key TEXT PRIMARY KEY, value TEXT NOT NULL, updated_at REAL NOT NULL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS session_locks (user_id TEXT PRIMARY KEY, token TEXT NOT NULL, expires_at REAL NOT NULL)")
+
+    def _execute(self, sql: str, params: tuple = ()) -> sqlite3.Cursor:
+        with self.db_lock:
+            return self.conn.execute(sql, params)
+
+    def _get_sync(self, key: str) -> Optional[str]:
+        row = self._execute("SELECT value FROM sessions WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _try_lock_sync(self, user_id: str, token: str) -> bool:
+        now = time.time()
+        with self.db_lock:
+            self.conn.execute("DELETE FROM session_locks WHERE user_id = ? AND expires_at <= ?", (user_id, now))
+            cursor = self.conn.execute(
+                "INSERT OR IGNORE INTO session_locks (user_id, token, expires_at) VALUES (?, ?, ?)",
+                (user_id, token, now + self.lock_ttl_seconds)
+            )
+            return cursor.rowcount == 1
+
+    def _sweep_sync(self, now: float) -> Tuple[int, int, int, int]:
+        with self.db_lock:
+            evicted_idle = self.conn.execute("DELETE FROM sessions WHERE updated_at <= ?", (now - self.idle_ttl_seconds,)).rowcount
+            # Сессии сценариев и история диалога вытесняются по LRU каждая в пределах своего лимита
+            evicted_lru = 0
+            for condition, limit in (("NOT LIKE", self.max_sessions), ("LIKE", self.max_histories)):
+                evicted_lru += self.conn.execute(
+                    f"DELETE FROM sessions WHERE key IN (SELECT key FROM sessions WHERE key {condition} ? "
+                    "ORDER BY updated_at DESC LIMIT -1 OFFSET ?)",
+                    (_HISTORY_PREFIX + "%", limit)
+                ).rowcount
+            self.conn.execute("DELETE FROM session_locks WHERE expires_at <= ?", (now,))
+            entries, history_entries = self.conn.execute(
+                "SELECT COUNT(*) - COUNT(CASE WHEN key LIKE ? THEN 1 END), COUNT(CASE WHEN key LIKE ? THEN 1 END) FROM sessions",
+                (_HISTORY_PREFIX + "%", _HISTORY_PREFIX + "%")
+            ).fetchone()
+        return evicted_idle, evicted_lru, entries, history_entries
+
+    async def _get(self, key: str) -> Optional[str]:
+        return await asyncio.to_thread(self._get_sync, key)
+
+    async def _set(self, key: str, value: str):
+        await asyncio.to_thread(
+            self._execute, "INSERT OR REPLACE INTO sessions (key, value, updated_at) VALUES (?, ?, ?)", (key, value, time.time())
+        )
+
+    async def _delete(self, key: str) -> bool:
+        cursor = await asyncio.to_thread(self._execute, "DELETE FROM sessions WHERE key = ?", (key,))
+        return cursor.rowcount > 0
+
+    async def _try_lock(self, user_id: str, token: str) -> bool:
+        return await asyncio.to_thread(self._try_lock_sync, user_id, token)
+
+    async def _unlock(self, user_id: str, token: str):
+        await asyncio.to_thread(self._execute, "DELETE FROM session_locks WHERE user_id = ? AND token = ?", (user_id, token))
+
+    async def _sweep(self, now: float) -> Tuple[int, int, int, int]:
+        return await asyncio.to_thread(self._sweep_sync, now)
+
+    async def close(self):
+        with self.db_lock:
+            self.conn.close()
+
+
+class RedisSessionStore(SessionStore):
+    """
+    Сессии в Redis или совместимом по протоколу сервере (KeyDB, Dragonfly, Valkey), пакет redis.
+    Блокировка - SET NX PX с токеном владельца, снимается скриптом, удаляющим ключ только для своего токена.
+    Простой обеспечивает TTL ключа, продлеваемый при каждой записи; ограничение по числу записей
+    остается за политикой maxmemory сервера (allkeys-lru / volatile-lru), очистка только считает записи.
+    """
+
+    name = "redis"
+
+    _UNLOCK_SCRIPT = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) else return 0 end"
+
+    def __init__(self, url: str, key_prefix: str, lock_ttl_seconds: float, idle_ttl_seconds: float, max_sessions: int, max_histories: int):
+        super().__init__(lock_ttl_seconds, idle_ttl_seconds, max_sessions, max_histories)
+        import redis.asyncio as redis
+
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        self.key_prefix = key_prefix
+
+    async def _get(self, key: str) -> Optional[str]:
+        return await self.client.get(self.key_prefix + key)
+
+    async def _set(self, key: str, value: str):
+        await self.client.set(self.key_prefix + key, value, ex=int(self.idle_ttl_seconds))
+
+    async def _delete(self, key: str) -> bool:
+        return await self.client.delete(self.key_prefix + key) > 0
+
+    async def _try_lock(self, user_id: str, token: str) -> bool:
+        return bool(await self.client.set(
+            f"{self.key_prefix}lock:{user_id}", token, nx=True, px=int(self.lock_ttl_seconds * 1000)
+        ))
+
+    async def _unlock(self, user_id: str, token: str):
+        await self.client.eval(self._UNLOCK_SCRIPT, 1, f"{self.key_prefix}lock:{user_id}", token)
+
+    async def _sweep(self, now: float) -> Tuple[int, int, int, int]:
+        entries = 0
+        for pattern in ("scenario:*", "consent:*"):
+            async for _ in self.client.scan_iter(match=self.key_prefix + pattern, count=1000):
+                entries += 1
+        history_entries = 0
+        async for _ in self.client.scan_iter(match=self.key_prefix + _HISTORY_PREFIX + "*", count=1000):
+            history_entries += 1
+        return 0, 0, entries, history_entries
+
+    async def close(self):
+        await self.client.aclose()
+
+
+_session_store: Optional[SessionStore] = None
+
+
+def _create_session_store() -> SessionStore:
+    config = CONFIG.sessions
+    policy = (float(config.lock_ttl_seconds), float(config.idle_ttl_seconds), int(config.max_sessions), int(config.max_histories))
+    if config.backend == "sqlite":
+        return SQLiteSessionStore(os.path.join(CONFIG.cache.dir, "sessions.sqlite3"), *policy)
+    if config.backend == "redis":
+        try:
+            return RedisSessionStore(config.redis_url, config.key_prefix, *policy)
+        except ImportError:
+            log.warning("Пакет redis не установлен, сессии сценариев хранятся в памяти процесса")
+    return InMemorySessionStore(*policy)
+
+
+def get_session_store() -> SessionStore:
+    """Общее для процесса хранилище сессий, выбранное в sessions.backend: memory, sqlite или redis"""
+    global _session_store
+    if _session_store is None:
+        _session_store = _create_session_store()
+        log.info(f"Хранилище сессий сценариев: {_session_store.name}")
+    return _session_store
+
+
+async def close_session_store():
+    global _session_store
+    if _session_store is not None:
+        await _session_store.close()
+        _session_store = None
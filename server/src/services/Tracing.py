@@ -0,0 +1,260 @@
+import asyncio
+import contextvars
+import json
+import os
+import secrets
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+from config.Config import CONFIG, TracingConfig
+from utils.logger import get_logger
+
+log = get_logger("Tracing")
+
+# Трассировка текущего HTTP запроса и активный в этом контексте span (родитель для вложенных)
+trace_var = contextvars.ContextVar('trace', default=None)
+span_var = contextvars.ContextVar('span', default=None)
+
+SCOPE_NAME = "rag_bot"
+
+
+def new_trace_id() -> str:
+    return secrets.token_hex(16)
+
+
+def _new_span_id() -> str:
+    return secrets.token_hex(8)
+
+
+def _attribute(key: str, value) -> dict:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+class Span:
+    def __init__(self, trace: "Trace", name: str, parent_id: Optional[str], attributes: dict):
+        self.trace = trace
+        self.name = name
+        self.span_id = _new_span_id()
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.error: Optional[str] = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def end(self, error: Optional[BaseException] = None):
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        self.trace.spans.append(self)
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e6
+
+    def to_otlp(self) -> dict:
+        span = {
+            "traceId": self.trace.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 2 if self.parent_id is None else 1,  # SERVER для корневого, INTERNAL для этапов
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns or self.start_ns),
+            "attributes": [_attribute(k, v) for k, v in self.attributes.items() if v is not None],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+class Trace:
+    """Spans одного HTTP запроса; экспортируется целиком после завершения корневого span"""
+
+    def __init__(self, trace_id: str, request_id: str, parent_span_id: Optional[str] = None):
+        self.trace_id = trace_id
+        self.request_id = request_id
+        self.parent_span_id = parent_span_id
+        self.spans: List[Span] = []
+
+
+class _NoopSpan:
+    def set(self, **attributes):
+        pass
+
+    def end(self, error: Optional[BaseException] = None):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def start_span(name: str, **attributes):
+    """
+    Создает span без переключения текущего контекста (для асинхронных генераторов, которые
+    могут быть закрыты из другого контекста); завершается вызовом end(). Вне запроса - пустой span.
+    """
+    trace = trace_var.get()
+    if trace is None:
+        return NOOP_SPAN
+    parent = span_var.get()
+    return Span(trace, name, parent.span_id if parent else trace.parent_span_id, attributes)
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator:
+    """Этап обработки запроса: вложенные span и обращения к LLM становятся его потомками"""
+    current = start_span(name, **attributes)
+    if current is NOOP_SPAN:
+        yield current
+        return
+    token = span_var.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.end(e)
+        raise
+    finally:
+        span_var.reset(token)
+        current.end()
+
+
+class SpanExporter:
+    """
+    Экспорт завершенных трассировок в формате OTLP/JSON (ExportTraceServiceRequest) вне пути запроса:
+    трассировки копятся в ограниченной очереди и отправляются пачками фоновой задачей.
+    exporter: file - строка JSON на пачку в файл, otlp - POST в OTLP/HTTP коллектор, log - в лог.
+    """
+
+    def __init__(self, config: TracingConfig):
+        self.exporter = config.exporter
+        self.file_path = config.file_path
+        self.file_max_bytes = int(config.file_max_bytes)
+        self.file_backups = int(config.file_backups)
+        self.otlp_endpoint = config.otlp_endpoint
+        self.min_duration_ms = float(config.min_duration_ms)
+        self.flush_interval = float(config.flush_interval_seconds)
+        self.queue: deque = deque(maxlen=int(config.max_queue))
+        self.http_client = None
+
+        self.exported = 0
+        self.skipped = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def submit(self, trace: Trace, root: Span):
+        if root.duration_ms < self.min_duration_ms:
+            self.skipped += 1
+            return
+        if len(self.queue) == self.queue.maxlen:
+            self.dropped += 1
+        self.queue.append(trace)
+
+    def _payload(self, traces: List[Trace]) -> dict:
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": [_attribute("service.name", CONFIG.logging.app_name)]},
+                "scopeSpans": [{
+                    "scope": {"name": SCOPE_NAME},
+                    "spans": [s.to_otlp() for trace in traces for s in trace.spans],
+                }],
+            }]
+        }
+
+    def _rotate(self):
+        """Сдвигает spans.jsonl -> .1 -> .2 ...; файл сверх file_backups удаляется"""
+        for index in range(self.file_backups, 0, -1):
+            source = f"{self.file_path}.{index - 1}" if index > 1 else self.file_path
+            if os.path.exists(source):
+                os.replace(source, f"{self.file_path}.{index}")
+        if self.file_backups <= 0 and os.path.exists(self.file_path):
+            os.remove(self.file_path)
+
+    def _write_file(self, line: str):
+        directory = os.path.dirname(self.file_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        try:
+            size = os.path.getsize(self.file_path)
+        except OSError:
+            size = 0
+        if size and size + len(line) + 1 > self.file_max_bytes:
+            self._rotate()
+        with open(self.file_path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+    async def flush(self):
+        if not self.queue:
+            return
+        traces = list(self.queue)
+        self.queue.clear()
+        payload = self._payload(traces)
+        try:
+            if self.exporter == "otlp":
+                if self.http_client is None:
+                    import httpx
+                    self.http_client = httpx.AsyncClient(timeout=5.0)
+                response = await self.http_client.post(self.otlp_endpoint, json=payload)
+                response.raise_for_status()
+            elif self.exporter == "file":
+                await asyncio.to_thread(self._write_file, json.dumps(payload, ensure_ascii=False, separators=(",", ":")))
+            else:
+                log.info(f"Трассировки: {json.dumps(payload, ensure_ascii=False, separators=(',', ':'))}")
+            self.exported += len(traces)
+        except Exception as e:
+            self.failed += len(traces)
+            log.warning(f"Не удалось экспортировать {len(traces)} трассировок ({self.exporter}): {e}")
+
+    async def run(self):
+        try:
+            while True:
+                await asyncio.sleep(self.flush_interval)
+                await self.flush()
+        finally:
+            await self.flush()
+            if self.http_client is not None:
+                await self.http_client.aclose()
+
+    def get_stats(self) -> dict:
+        return {
+            "exporter": self.exporter,
+            "queued": len(self.queue),
+            "exported": self.exported,
+            "skipped": self.skipped,
+            "dropped": self.dropped,
+            "failed": self.failed,
+        }
+
+
+_exporter: Optional[SpanExporter] = None
+
+
+def get_span_exporter() -> Optional[SpanExporter]:
+    """Общий для процесса экспортер трассировок или None, если трассировка выключена в конфиге"""
+    global _exporter
+    if not CONFIG.tracing.enabled:
+        return None
+    if _exporter is None:
+        _exporter = SpanExporter(CONFIG.tracing)
+    return _exporter
+
+
+def stage_timings(trace: Trace) -> Dict[str, float]:
+    """Суммарная длительность (мс) по этапам запроса - для краткой записи в лог"""
+    timings: Dict[str, float] = {}
+    for s in trace.spans:
+        if s.parent_id != trace.parent_span_id:
+            timings[s.name] = timings.get(s.name, 0.0) + s.duration_ms
+    return timings
@@ -0,0 +1,228 @@
+import asyncio
+import json
+import os
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, List
+
+from config.Config import CONFIG
+from utils.logger import get_logger
+
+log = get_logger("VectorStore")
+
+
+@dataclass
+class VectorHit:
+    id: str
+    score: float
+    payload: Dict[str, Any]
+
+
+class NumpyVectorStore:
+    """
+    Векторное хранилище в памяти процесса: точный поиск скалярным произведением по нормированным векторам.
+    Для top-k используется argpartition, поэтому сортируются только лучшие кандидаты.
+    Индекс хранится в каталоге `path` (vectors.npy + meta.json) и загружается при старте.
+    """
+
+    def __init__(self, path: str, vector_size: int):
+        import numpy as np
+
+        self.np = np
+        self.path = path
+        self.vector_size = vector_size
+        self.lock = threading.RLock()
+        self.vectors = np.zeros((0, vector_size), dtype=np.float32)
+        self.ids: List[str] = []
+        self.payloads: List[Dict[str, Any]] = []
+        self.rows: Dict[str, int] = {}
+        self.size = 0
+        self.load()
+
+    def _ensure_capacity(self, required: int):
+        capacity = self.vectors.shape[0]
+        if required <= capacity:
+            return
+        new_capacity = max(required, capacity * 2, 1024)
+        grown = self.np.zeros((new_capacity, self.vector_size), dtype=self.np.float32)
+        grown[:self.size] = self.vectors[:self.size]
+        self.vectors = grown
+
+    def upsert_sync(self, ids: List[str], vectors, payloads: List[Dict[str, Any]]):
+        with self.lock:
+            self._ensure_capacity(self.size + len(ids))
+            for point_id, vector, payload in zip(ids, vectors, payloads, strict=True):
+                row = self.rows.get(point_id)
+                if row is None:
+                    row = self.size
+                    self.size += 1
+                    self.rows[point_id] = row
+                    self.ids.append(point_id)
+                    self.payloads.append(payload)
+                else:
+                    self.payloads[row] = payload
+                self.vectors[row] = vector
+
+    def delete_sync(self, ids: List[str]):
+        with self.lock:
+            for point_id in ids:
+                row = self.rows.pop(point_id, None)
+                if row is None:
+                    continue
+                last = self.size - 1
+                if row != last:
+                    # Переносим последнюю строку на место удаленной, чтобы матрица оставалась плотной
+                    self.vectors[row] = self.vectors[last]
+                    self.ids[row] = self.ids[last]
+                    self.payloads[row] = self.payloads[last]
+                    self.rows[self.ids[row]] = row
+                self.ids.pop()
+                self.payloads.pop()
+                self.size -= 1
+
+    async def get_payloads(self, ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        with self.lock:
+            return {point_id: self.payloads[self.rows[point_id]] for point_id in ids if point_id in self.rows}
+
+    def search_sync(self, vector, top_k: int) -> List[VectorHit]:
+        with self.lock:
+            if self.size == 0:
+                return []
+            scores = self.vectors[:self.size] @ vector
+            k = min(top_k, self.size)
+            top = self.np.argpartition(-scores, k - 1)[:k]
+            top = top[self.np.argsort(-scores[top])]
+            return [VectorHit(self.ids[i], float(scores[i]), self.payloads[i]) for i in top]
+
+    async def search(self, vector, top_k: int) -> List[VectorHit]:
+        return await asyncio.to_thread(self.search_sync, vector, top_k)
+
+    async def upsert(self, ids: List[str], vectors, payloads: List[Dict[str, Any]]):
+        self.upsert_sync(ids, vectors, payloads)
+
+    async def delete(self, ids: List[str]):
+        self.delete_sync(ids)
+
+    async def count(self) -> int:
+        return self.size
+
+    async def flush(self):
+        await asyncio.to_thread(self.save)
+
+    async def close(self):
+        pass
+
+    def load(self):
+        vectors_path = os.path.join(self.path, "vectors.npy")
+        meta_path = os.path.join(self.path, "meta.json")
+        if not os.path.exists(vectors_path) or not os.path.exists(meta_path):
+            return
+        with self.lock:
+            vectors = self.np.load(vectors_path)
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            self.ids = meta["ids"]
+            self.payloads = meta["payloads"]
+            self.rows = {point_id: row for row, point_id in enumerate(self.ids)}
+            self.size = 0
+            self.vectors = self.np.zeros((0, self.vector_size), dtype=self.np.float32)
+            self._ensure_capacity(len(self.ids))
+            self.size = len(self.ids)
+            self.vectors[:self.size] = vectors[:self.size]
+        log.info(f"Загружен векторный индекс {self.path}: {self.size} векторов")
+
+    def save(self):
+        with self.lock:
+            os.makedirs(self.path, exist_ok=True)
+            tmp_vectors = os.path.join(self.path, "vectors.tmp.npy")
+            tmp_meta = os.path.join(self.path, "meta.json.tmp")
+            self.np.save(tmp_vectors, self.vectors[:self.size])
+            with open(tmp_meta, 'w', encoding='utf-8') as f:
+                json.dump({"ids": self.ids, "payloads": self.payloads}, f, ensure_ascii=False)
+            os.replace(tmp_vectors, os.path.join(self.path, "vectors.npy"))
+            os.replace(tmp_meta, os.path.join(self.path, "meta.json"))
+
+
+class QdrantVectorStore:
+    """Хранилище в Qdrant (пакет qdrant_client), коллекция создается при первом обращении"""
+
+    def __init__(self, host: str, port: int, collection_name: str, vector_size: int):
+        from qdrant_client import AsyncQdrantClient, models
+
+        self.models = models
+        self.client = AsyncQdrantClient(host=host, port=port)
+        self.collection_name = collection_name
+        self.vector_size = vector_size
+        self.collection_ready = False
+
+    async def _ensure_collection(self):
+        if self.collection_ready:
+            return
+        if not await self.client.collection_exists(self.collection_name):
+            await self.client.create_collection(
+                self.collection_name,
+                vectors_config=self.models.VectorParams(size=self.vector_size, distance=self.models.Distance.COSINE)
+            )
+            log.info(f"Создана коллекция Qdrant {self.collection_name}")
+        self.collection_ready = True
+
+    async def upsert(self, ids: List[str], vectors, payloads: List[Dict[str, Any]]):
+        await self._ensure_collection()
+        points = [
+            self.models.PointStruct(id=point_id, vector=[float(x) for x in vector], payload=payload)
+            for point_id, vector, payload in zip(ids, vectors, payloads, strict=True)
+        ]
+        await self.client.upsert(self.collection_name, points=points)
+
+    async def delete(self, ids: List[str]):
+        await self._ensure_collection()
+        await self.client.delete(self.collection_name, points_selector=self.models.PointIdsList(points=ids))
+
+    async def search(self, vector, top_k: int) -> List[VectorHit]:
+        await self._ensure_collection()
+        response = await self.client.query_points(
+            self.collection_name, query=[float(x) for x in vector], limit=top_k, with_payload=True
+        )
+        return [VectorHit(str(point.id), float(point.score), point.payload or {}) for point in response.points]
+
+    async def get_payloads(self, ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        await self._ensure_collection()
+        points = await self.client.retrieve(self.collection_name, ids=ids, with_payload=True)
+        return {str(point.id): point.payload or {} for point in points}
+
+    async def count(self) -> int:
+        await self._ensure_collection()
+        return (await self.client.count(self.collection_name)).count
+
+    async def flush(self):
+        pass
+
+    async def close(self):
+        await self.client.close()
+
+
+_vector_store = None
+
+
+def index_path(collection_name: str) -> str:
+    return os.path.abspath(os.path.join(CONFIG.cache.dir, "index", collection_name))
+
+
+def get_vector_store():
+    """Хранилище, выбранное в qdrant.backend: numpy (в процессе) или qdrant"""
+    global _vector_store
+    if _vector_store is None:
+        config = CONFIG.qdrant
+        if config.backend == "qdrant":
+            _vector_store = QdrantVectorStore(config.host, int(config.port), config.collection_name, int(config.vector_size))
+        else:
+            _vector_store = NumpyVectorStore(index_path(config.collection_name), int(config.vector_size))
+        log.info(f"Векторное хранилище: {type(_vector_store).__name__}, коллекция {config.collection_name}")
+    return _vector_store
+
+
+async def close_vector_store():
+    global _vector_store
+    if _vector_store is not None:
+        await _vector_store.close()
+        _vector_store = None
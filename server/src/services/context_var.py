@@ -1,3 +1,25 @@
 import contextvars
+import time
+from typing import Optional
 
-request_id_var = contextvars.ContextVar('request_id', default=0)
\ No newline at end of file
+request_id_var = contextvars.ContextVar('request_id', default=0)
+# Момент (time.monotonic()), к которому должен завершиться текущий HTTP запрос; None - без ограничения
+deadline_var = contextvars.ContextVar('deadline', default=None)
+
+
+class DeadlineExceededError(Exception):
+    """Время, отведенное на обработку запроса, истекло: новые обращения к upstream не выполняются"""
+
+
+def time_left() -> Optional[float]:
+    """Сколько секунд осталось до дедлайна текущего запроса, None если дедлайна нет"""
+    deadline = deadline_var.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def check_deadline():
+    remaining = time_left()
+    if remaining is not None and remaining <= 0:
+        raise DeadlineExceededError("Время обработки запроса истекло")
@@ -1,7 +1,12 @@
+import atexit
+import hashlib
+import queue
+import random
 import sys
 
 import graypy
 import logging
+import logging.handlers
 
 from config.Config import CONFIG
 from services.context_var import request_id_var
@@ -10,10 +15,41 @@ from services.context_var import request_id_var
 class GraylogFormatter(logging.Formatter):
     def format(self, record):
         record.app_name = CONFIG.logging.app_name
-        record.request_id = request_id_var.get()
+        # При записи через очередь request_id сохраняется в потоке запроса, здесь контекст уже другой
+        if not hasattr(record, "request_id"):
+            record.request_id = request_id_var.get()
         return super().format(record)
 
 
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Передает записи в ограниченную очередь без блокировки event loop.
+    Если фоновый поток не успевает и очередь заполнена, запись отбрасывается и учитывается в счетчике.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.enqueued = 0
+        self.dropped = 0
+
+    def prepare(self, record):
+        record.request_id = request_id_var.get()
+        return super().prepare(record)
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+            self.enqueued += 1
+        except queue.Full:
+            self.dropped += 1
+
+
+class DrainingQueueListener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        # Очередь может быть заполнена: ждем, пока фоновый поток освободит место, и дописываем все записи
+        self.queue.put(self._sentinel)
+
+
 if CONFIG.logging.graylog.enabled:
     if CONFIG.logging.graylog.udp:
         graylog_handler = graypy.GELFUDPHandler(CONFIG.logging.graylog.host, CONFIG.logging.graylog.port)
@@ -27,12 +63,24 @@ else:
 
 if CONFIG.logging.console.enabled:
     console_handler = logging.StreamHandler(sys.stdout)
-    console_handler.setFormatter(logging.Formatter(
-        "%(asctime)s [%(name)s] %(levelname)s: %(message)s"
+    console_handler.setFormatter(GraylogFormatter(
+        "%(asctime)s [%(name)s] [%(request_id)s] %(levelname)s: %(message)s"
     ))
 else:
     console_handler = None
 
+output_handlers = [handler for handler in (console_handler, graylog_handler) if handler]
+
+if CONFIG.logging.queue.enabled and output_handlers:
+    queue_handler = DroppingQueueHandler(queue.Queue(maxsize=int(CONFIG.logging.queue.max_size)))
+    queue_listener = DrainingQueueListener(queue_handler.queue, *output_handlers, respect_handler_level=True)
+    queue_listener.start()
+    # При завершении процесса дописываем оставшиеся в очереди записи
+    atexit.register(queue_listener.stop)
+else:
+    queue_handler = None
+    queue_listener = None
+
 logging.getLogger().setLevel(logging.getLevelName(CONFIG.logging.root_level))
 for log, level in CONFIG.logging.levels.items():
     logging.getLogger(log).setLevel(logging.getLevelName(level))
@@ -46,6 +94,10 @@ def get_logger(name) -> logging:
     if len(logger.handlers) != 0:
         return logger
 
+    if queue_handler:
+        logger.addHandler(queue_handler)
+        return logger
+
     if console_handler:
         logger.addHandler(console_handler)
 
@@ -55,6 +107,34 @@ def get_logger(name) -> logging:
     return logger
 
 
+def get_logging_stats() -> dict:
+    return {
+        "queue_enabled": queue_handler is not None,
+        "queued": queue_handler.queue.qsize() if queue_handler else 0,
+        "enqueued": queue_handler.enqueued if queue_handler else 0,
+        "dropped": queue_handler.dropped if queue_handler else 0,
+    }
+
+
+def sample_payload() -> bool:
+    """Логировать ли промпт и ответ текущего вызова целиком (с вероятностью logging.payload.sample_rate)"""
+    return random.random() < float(CONFIG.logging.payload.sample_rate)
+
+
+def format_payload(text, full: bool = False) -> str:
+    """
+    Промпт или ответ для лога: длинный текст сокращается до начала и конца (общая преамбула промптов
+    в начале, вопрос пользователя в конце) с длиной и sha256, по которому совпадающие тексты можно сопоставить.
+    """
+    text = str(text)
+    max_chars = int(CONFIG.logging.payload.max_chars)
+    if full or len(text) <= max_chars:
+        return text
+    digest = hashlib.sha256(text.encode("utf-8", "replace")).hexdigest()[:12]
+    half = max_chars // 2
+    return f"{text[:half]} … {text[-half:]} [{len(text)} симв., sha256:{digest}]"
+
+
 def get_logger_univorn():
     logging_config = {
         "version": 1,
@@ -72,4 +152,4 @@ def get_logger_univorn():
             "handlers": ["console", "graylog"],
         },
     }
-    return logging_config
\ No newline at end of file
+    return logging_config
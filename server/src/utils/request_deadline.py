@@ -0,0 +1,87 @@
+import asyncio
+import contextlib
+import time
+
+from fastapi.responses import JSONResponse
+
+from services.context_var import deadline_var
+from utils.logger import get_logger
+
+log = get_logger("RequestDeadline")
+
+
+class RequestDeadlineMiddleware:
+    """
+    ASGI middleware: задает дедлайн запроса в deadline_var (его учитывают все обращения к LLM и их повторы)
+    и отменяет обработку, когда дедлайн истек или клиент отключился.
+    Тело запроса читается заранее, после чего отдельная задача ждет http.disconnect от сервера.
+    Дедлайн покрывает и потоковые ответы целиком, а не только время до отправки заголовков.
+    """
+
+    def __init__(self, app, timeout: float):
+        self.app = app
+        self.timeout = timeout
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        messages = []
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            messages.append(message)
+            if not message.get("more_body", False):
+                break
+
+        disconnected = asyncio.Event()
+        response_started = False
+
+        async def app_receive():
+            if messages:
+                return messages.pop(0)
+            await disconnected.wait()
+            return {"type": "http.disconnect"}
+
+        async def app_send(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        async def watch_disconnect():
+            while True:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    disconnected.set()
+                    return
+
+        deadline = time.monotonic() + self.timeout
+        token = deadline_var.set(deadline)
+        try:
+            app_task = asyncio.ensure_future(self.app(scope, app_receive, app_send))
+        finally:
+            deadline_var.reset(token)
+        watcher = asyncio.ensure_future(watch_disconnect())
+        try:
+            done, _ = await asyncio.wait({app_task, watcher}, timeout=self.timeout, return_when=asyncio.FIRST_COMPLETED)
+            if app_task in done:
+                app_task.result()
+                return
+
+            app_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await app_task
+
+            if watcher in done:
+                log.info(f"Клиент отключился, обработка {scope['method']} {scope['path']} отменена")
+                return
+
+            log.warning(f"Дедлайн {self.timeout:.0f} с истек, обработка {scope['method']} {scope['path']} отменена")
+            if not response_started:
+                response = JSONResponse(status_code=408, content={"detail": "Request timeout after 3 minutes"})
+                await response(scope, app_receive, send)
+        finally:
+            watcher.cancel()
@@ -0,0 +1,42 @@
+import time
+
+from services.MetricsRegistry import REQUEST_LATENCY, request_labels_var
+
+
+class RequestMetricsMiddleware:
+    """
+    ASGI middleware: длительность HTTP запроса в гистограмму по шаблону пути (endpoint), статусу и source ответа.
+    Время считается до отправки последнего фрагмента тела, поэтому потоковые ответы учитываются целиком.
+    source задают обработчики через set_request_label("source", ...), по умолчанию "none".
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        labels = {"source": "none"}
+        token = request_labels_var.set(labels)
+        status = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            request_labels_var.reset(token)
+            route = scope.get("route")
+            # Несовпавшие пути не используем как метку, чтобы не раздувать число рядов
+            endpoint = getattr(route, "path", None) or "unmatched"
+            REQUEST_LATENCY.observe(
+                time.perf_counter() - started,
+                endpoint=endpoint, method=scope.get("method", ""), status=str(status), source=labels["source"]
+            )
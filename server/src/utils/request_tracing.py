@@ -0,0 +1,82 @@
+import re
+import uuid
+
+from config.Config import CONFIG
+from services.context_var import request_id_var
+from services.Tracing import Span, Trace, get_span_exporter, new_trace_id, span_var, stage_timings, trace_var
+from utils.logger import get_logger
+
+log = get_logger("RequestTracing")
+
+_TRACEPARENT_RE = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+_REQUEST_ID_RE = re.compile(r"^[\w.:-]{1,64}$")
+
+
+def _header(scope, name: bytes) -> str:
+    for key, value in scope.get("headers", []):
+        if key == name:
+            return value.decode("latin-1").strip()
+    return ""
+
+
+class RequestTracingMiddleware:
+    """
+    ASGI middleware: задает request_id (из заголовка X-Request-ID или новый) для логов и ответа,
+    и корневой span запроса; trace id берется из W3C traceparent, если клиент его передал.
+    Этапы обработки записываются как вложенные span (services.Tracing.span) и экспортируются после ответа.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = _header(scope, b"x-request-id")
+        if not _REQUEST_ID_RE.match(request_id):
+            request_id = uuid.uuid4().hex
+        traceparent = _TRACEPARENT_RE.match(_header(scope, b"traceparent"))
+        trace = Trace(traceparent.group(1), request_id, traceparent.group(2)) if traceparent else Trace(new_trace_id(), request_id)
+        root = Span(trace, f"{scope.get('method', '')} {scope.get('path', '')}", trace.parent_span_id, {
+            "http.method": scope.get("method", ""),
+            "http.target": scope.get("path", ""),
+            "request.id": request_id,
+        })
+
+        tokens = (request_id_var.set(request_id), trace_var.set(trace), span_var.set(root))
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(b"x-request-id", request_id.encode("latin-1"))]
+            await send(message)
+
+        error = None
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            route = getattr(scope.get("route"), "path", None)
+            if route:
+                root.name = f"{scope.get('method', '')} {route}"
+                root.set(**{"http.route": route})
+            root.set(**{"http.status_code": status})
+            root.end(error)
+            self._finish(trace, root, status)
+            for var, token in zip((span_var, trace_var, request_id_var), reversed(tokens), strict=True):
+                var.reset(token)
+
+    @staticmethod
+    def _finish(trace: Trace, root: Span, status: int):
+        exporter = get_span_exporter()
+        if exporter:
+            exporter.submit(trace, root)
+        if root.duration_ms >= float(CONFIG.tracing.slow_request_ms):
+            stages = ", ".join(f"{name}={ms:.0f}" for name, ms in stage_timings(trace).items())
+            log.warning(f"Медленный запрос {root.name} ({status}) за {root.duration_ms:.0f} мс, этапы (мс): {stages}")
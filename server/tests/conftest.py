@@ -0,0 +1,7 @@
+import os
+
+
+def pytest_sessionstart(session):
+    # Конфиг читается из ./config.yml при импорте config.Config, поэтому тесты выполняются из src
+    os.chdir(os.path.join(os.path.dirname(__file__), "..", "src"))
+    os.environ.setdefault("LLM_TOKEN", "test")
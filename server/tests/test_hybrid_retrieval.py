@@ -0,0 +1,60 @@
+import pytest
+
+from services.RetrievalService import reciprocal_rank_fusion
+
+
+def test_rrf_prefers_documents_ranked_high_in_both_lists():
+    fused = reciprocal_rank_fusion([["a", "b", "c"], ["b", "c", "d"]], k=60)
+    assert fused[0] == "b"
+    assert fused.index("c") < fused.index("a")
+    assert set(fused) == {"a", "b", "c", "d"}
+
+
+def test_rrf_keeps_single_ranking_order():
+    assert reciprocal_rank_fusion([["x", "y", "z"]], k=60) == ["x", "y", "z"]
+    assert reciprocal_rank_fusion([[], []], k=60) == []
+
+
+@pytest.fixture
+def index(tmp_path):
+    pytest.importorskip("numpy")
+    from services.LexicalIndex import BM25Index
+
+    index = BM25Index(str(tmp_path))
+    index.upsert(
+        ["fair", "vegan", "both", "long"],
+        [
+            "fairness and honesty at work",
+            "a vegan diet plan",
+            "fairness in a vegan diet",
+            "diet " * 50 + "fairness",
+        ],
+    )
+    return index
+
+
+def test_bm25_ranks_by_term_rarity_and_document_length(index):
+    results = index.search("fairness vegan", top_k=10)
+    ids = [doc_id for doc_id, _ in results]
+    assert ids[0] == "both"
+    # Короткий документ с термином выше длинного с тем же термином
+    assert ids.index("fair") < ids.index("long")
+    assert all(score > 0 for _, score in results)
+
+
+def test_bm25_top_k_and_no_match(index):
+    assert len(index.search("diet", top_k=2)) == 2
+    assert index.search("carnivore", top_k=5) == []
+
+
+def test_bm25_delete_upsert_and_reload(index, tmp_path):
+    from services.LexicalIndex import BM25Index
+
+    index.delete(["both"])
+    index.upsert(["vegan"], ["carnivore diet"])
+    assert "both" not in [doc_id for doc_id, _ in index.search("fairness", top_k=10)]
+    assert [doc_id for doc_id, _ in index.search("vegan", top_k=10)] == []
+
+    index.save()
+    reloaded = BM25Index(str(tmp_path))
+    assert reloaded.search("carnivore", top_k=5) == index.search("carnivore", top_k=5)
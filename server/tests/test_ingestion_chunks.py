@@ -0,0 +1,47 @@
+from services import IngestionService
+from services.IngestionService import iter_chunks
+
+
+def _words(chunks):
+    return [text.split() for _, text in chunks]
+
+
+def test_chunks_split_on_word_boundaries_with_overlap():
+    words = [f"w{i:02d}" for i in range(40)]
+    chunks = list(iter_chunks(iter([(1, " ".join(words))]), chunk_size=40, chunk_overlap=12))
+    assert len(chunks) > 1
+    for text in _words(chunks):
+        assert all(word in words for word in text)
+    for previous, current in zip(_words(chunks), _words(chunks)[1:], strict=False):
+        # Начало следующего фрагмента повторяет хвост предыдущего, не длиннее chunk_overlap
+        shared = max(k for k in range(len(current) + 1) if previous[len(previous) - k:] == current[:k])
+        assert shared > 0
+        assert sum(len(word) + 1 for word in current[:shared]) <= 12
+    # Все слова попали хотя бы в один фрагмент, последний фрагмент заканчивается последним словом
+    assert set(words) == {word for text in _words(chunks) for word in text}
+    assert _words(chunks)[-1][-1] == words[-1]
+
+
+def test_chunk_reports_page_where_it_starts():
+    pages = iter([(1, "alpha beta gamma"), (2, "delta epsilon zeta"), (3, "eta theta iota")])
+    chunks = list(iter_chunks(pages, chunk_size=20, chunk_overlap=0))
+    assert [page for page, _ in chunks] == [1, 2, 3]
+    assert chunks[0][1] == "alpha beta gamma delta"
+
+
+def test_no_trailing_chunk_when_only_overlap_remains():
+    chunks = list(iter_chunks(iter([(1, "aaaa bbbb cccc dddd")]), chunk_size=10, chunk_overlap=5))
+    assert chunks[-1][1].split()[-1] == "dddd"
+    assert len({text for _, text in chunks}) == len(chunks)
+
+
+def test_text_blocks_do_not_split_words(tmp_path, monkeypatch):
+    monkeypatch.setattr(IngestionService, "_TEXT_BLOCK_SIZE", 8)
+    path = tmp_path / "doc.txt"
+    words = ["fairness", "honesty", "values", "at", "work", "every", "day"]
+    path.write_text(" ".join(words), encoding="utf-8")
+
+    pages = list(IngestionService.iter_pages(str(path)))
+    assert len(pages) > 1
+    assert "".join(text for _, text in pages) == " ".join(words)
+    assert [word for _, text in pages for word in text.split()] == words
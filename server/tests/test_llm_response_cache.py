@@ -0,0 +1,58 @@
+import asyncio
+
+from services.LLMResponseCache import LLMResponseCache, SQLiteCacheBackend, make_cache_key
+
+MESSAGES = [{"role": "user", "content": "What is fairness?"}]
+
+
+def test_cache_key_ignores_dict_order_but_not_request_params():
+    key = make_cache_key("model", MESSAGES, None, {"max_tokens": 10, "temperature": 0})
+    assert key == make_cache_key("model", MESSAGES, None, {"temperature": 0, "max_tokens": 10})
+    assert key != make_cache_key("model", MESSAGES, None, {"temperature": 0, "max_tokens": 20})
+    assert key != make_cache_key("other", MESSAGES, None, {"temperature": 0, "max_tokens": 10})
+    assert make_cache_key("model", MESSAGES) == make_cache_key("model", MESSAGES, None, {})
+
+
+def test_lru_eviction_by_entries_and_bytes():
+    async def scenario():
+        cache = LLMResponseCache(max_entries=2, max_bytes=10, ttl_seconds=60)
+        await cache.set("a", "1111")
+        await cache.set("b", "2222")
+        assert await cache.get("a") == "1111"
+        await cache.set("c", "3333")
+        # "b" дольше всех не использовался
+        assert await cache.get("b") is None
+        await cache.set("d", "44444444")
+        assert cache.total_bytes <= 10
+        # Значение больше max_bytes не кешируется
+        await cache.set("e", "x" * 11)
+        assert await cache.get("e") is None
+        assert await cache.get("d") == "44444444"
+
+    asyncio.run(scenario())
+
+
+def test_expired_entries_are_not_returned():
+    async def scenario():
+        cache = LLMResponseCache(max_entries=10, max_bytes=1000, ttl_seconds=-1)
+        await cache.set("a", "value")
+        assert await cache.get("a") is None
+        assert cache.expirations == 1
+
+    asyncio.run(scenario())
+
+
+def test_persistent_backend_survives_restart(tmp_path):
+    path = str(tmp_path / "llm_cache.sqlite3")
+
+    async def scenario():
+        cache = LLMResponseCache(max_entries=10, max_bytes=1000, ttl_seconds=60, backend=SQLiteCacheBackend(path))
+        await cache.set("a", "value")
+        cache.backend.close()
+
+        restarted = LLMResponseCache(max_entries=10, max_bytes=1000, ttl_seconds=60, backend=SQLiteCacheBackend(path))
+        assert await restarted.get("a") == "value"
+        assert restarted.hits == 1
+        restarted.backend.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,118 @@
+import httpx
+import openai
+import pytest
+
+from services.LLMRetryPolicy import CircuitBreaker, CircuitOpenError, RetryPolicy, classify_error
+
+
+def _status_error(status: int, headers: dict = None) -> openai.APIStatusError:
+    request = httpx.Request("POST", "http://llm/v1/chat/completions")
+    response = httpx.Response(status, headers=headers or {}, request=request)
+    return openai.APIStatusError("error", response=response, body=None)
+
+
+def _elapse(breaker: CircuitBreaker):
+    """Сдвигает момент размыкания так, будто reset_seconds уже прошли"""
+    breaker.opened_at -= breaker.reset_seconds
+
+
+@pytest.fixture
+def breaker():
+    return CircuitBreaker("http://llm", failure_threshold=3, reset_seconds=30)
+
+
+def test_breaker_opens_after_threshold_consecutive_failures(breaker):
+    for _ in range(2):
+        breaker.before_call()
+        breaker.record_failure()
+    assert breaker.state == "closed"
+
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert breaker.opened == 1
+
+    with pytest.raises(CircuitOpenError) as error:
+        breaker.before_call()
+    assert error.value.retry_after > 1
+    assert breaker.rejected == 1
+
+
+def test_breaker_success_resets_failure_count(breaker):
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    assert breaker.failures == 1
+
+
+def test_half_open_lets_exactly_one_probe_through(breaker):
+    for _ in range(3):
+        breaker.record_failure()
+    _elapse(breaker)
+
+    breaker.before_call()
+    assert breaker.state == "half_open"
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.failures == 0
+    breaker.before_call()
+
+
+def test_failed_probe_reopens_for_a_full_period(breaker):
+    for _ in range(3):
+        breaker.record_failure()
+    _elapse(breaker)
+    breaker.before_call()
+
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert breaker.opened == 2
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_cancelled_probe_frees_the_probe_slot(breaker):
+    for _ in range(3):
+        breaker.record_failure()
+    _elapse(breaker)
+    breaker.before_call()
+
+    breaker.record_cancelled()
+    assert breaker.state == "half_open"
+    breaker.before_call()
+    assert breaker.probe_in_flight
+
+
+@pytest.mark.parametrize("status, kind", [(429, "rate_limit"), (500, "server_error"), (503, "server_error"), (401, "client_error")])
+def test_classify_status_errors(status, kind):
+    assert classify_error(_status_error(status)) == kind
+
+
+def test_retry_policy_stops_on_client_errors_and_max_attempts():
+    policy = RetryPolicy(max_attempts=3, base_delay=0.5, max_delay=10)
+    assert policy.should_retry("server_error", 1)
+    assert policy.should_retry("timeout", 2)
+    assert not policy.should_retry("server_error", 3)
+    assert not policy.should_retry("client_error", 1)
+    assert not policy.should_retry("unavailable", 1)
+
+
+def test_retry_after_takes_precedence_but_is_capped():
+    policy = RetryPolicy(max_attempts=3, base_delay=0.5, max_delay=10)
+    assert policy.delay(1, "rate_limit", _status_error(429, {"retry-after": "2"})) == 2
+    assert policy.delay(1, "rate_limit", _status_error(429, {"retry-after": "120"})) == 10
+    assert policy.retries == {"rate_limit": 2}
+
+
+def test_backoff_jitter_stays_within_the_exponential_bound():
+    policy = RetryPolicy(max_attempts=5, base_delay=0.5, max_delay=10)
+    error = _status_error(500)
+    for attempt, bound in ((1, 0.5), (2, 1.0), (3, 2.0), (6, 10)):
+        assert all(0 <= policy.delay(attempt, "server_error", error) <= bound for _ in range(50))
+    # 429 без Retry-After ждет в 4 раза дольше
+    assert all(policy.delay(1, "rate_limit", _status_error(429)) <= 2.0 for _ in range(50))
@@ -0,0 +1,77 @@
+import pytest
+
+from services.ScenarioTurnRules import ScenarioTurnRules
+
+
+@pytest.fixture
+def rules():
+    return ScenarioTurnRules()
+
+
+@pytest.mark.parametrize("answer, expected", [
+    ("5", True),
+    (" 7 ", True),
+    ("3.", True),
+    ("1)", True),
+    ("0", False),
+    ("8", False),
+    ("", False),
+    ("   ", False),
+    ("five", None),
+    ("5 or 6", None),
+    ("I think 4", None),
+])
+def test_classify_likert(rules, answer, expected):
+    assert rules.classify_likert(answer) is expected
+
+
+@pytest.mark.parametrize("answer, expected", [
+    ("Yes", "AGREED"),
+    ("ok!", "AGREED"),
+    ("Let’s go", "AGREED"),
+    ("да", "AGREED"),
+    ("No thanks.", "DECLINED"),
+    ("not now", "DECLINED"),
+    ("7", "AGREED"),
+    ("4", "AGREED"),
+    ("3", "DECLINED"),
+    ("9", None),
+    ("yes, but tell me more first", None),
+    ("I don't know", None),
+])
+def test_classify_consent(rules, answer, expected):
+    assert rules.classify_consent(answer) == expected
+
+
+@pytest.mark.parametrize("answer, expected", [
+    ("Done", True),
+    ("  i’m done. ", True),
+    ("готово", True),
+    ("not done yet", False),
+    ("", False),
+])
+def test_is_done(rules, answer, expected):
+    assert rules.is_done(answer) is expected
+
+
+@pytest.mark.parametrize("answer, scenario_name, expected", [
+    ("1", "vegans", "online"),
+    ("local groups please", "vegans", "online"),
+    ("somewhere in my region", "vegans", "local"),
+    ("no", "vegans", "skip"),
+    ("I know what I want now", "vegans", None),
+    ("professional groups", "employee", "local"),
+    ("keep it confidential", "employee", "skip"),
+    ("1", "unknown", None),
+])
+def test_classify_agent_mode(rules, answer, scenario_name, expected):
+    assert rules.classify_agent_mode(answer, scenario_name) == expected
+
+
+def test_stats_count_hits_and_fallbacks(rules):
+    rules.classify_likert("5")
+    rules.classify_likert("maybe")
+    stats = rules.get_stats()["likert"]
+    assert stats["hits"] == 1
+    assert stats["fallbacks"] == 1
+    assert stats["hit_rate"] == 0.5
@@ -0,0 +1,102 @@
+import asyncio
+import json
+
+import pytest
+
+from endpoints.models.question_state import QuestionState
+from endpoints.models.scenario_state import ScenarioState
+from endpoints.models.user_scenario import UserScenario
+from services.SessionStore import InMemorySessionStore, SQLiteSessionStore, dump_scenario, load_scenario
+
+
+def _scenario() -> UserScenario:
+    return UserScenario(
+        scenario_name="vegans",
+        state=ScenarioState.AWAITING_ANSWER,
+        current_question_index=1,
+        questions=[QuestionState("Question one?", "5", 1, True), QuestionState("Вопрос два?")],
+        final_summary=None,
+    )
+
+
+def test_scenario_round_trip_is_compact():
+    scenario = _scenario()
+    raw = dump_scenario(scenario)
+    assert load_scenario(raw) == scenario
+    assert " " not in raw.replace("Question one?", "").replace("Вопрос два?", "")
+    assert "Вопрос" in raw
+    assert json.loads(raw)[1] == "awaiting_answer"
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "sqlite":
+        store = SQLiteSessionStore(str(tmp_path / "sessions.sqlite3"), 5, 3600, 3, 3)
+    else:
+        store = InMemorySessionStore(5, 3600, 3, 3)
+    yield store
+    asyncio.run(store.close())
+
+
+def test_store_put_get_delete(store):
+    async def scenario():
+        await store.put_scenario("u1", _scenario())
+        await store.set_consent("u2", "employee")
+        assert await store.get_scenario("u1") == _scenario()
+        assert await store.get_consent("u2") == "employee"
+        assert await store.delete_scenario("u1")
+        assert not await store.delete_scenario("u1")
+        assert await store.get_scenario("u1") is None
+
+    asyncio.run(scenario())
+
+
+def test_store_evicts_least_recently_used_sessions(store):
+    async def scenario():
+        for user in ("u1", "u2", "u3"):
+            await store.set_consent(user, "vegans")
+        await store.get_consent("u1")
+        await store.set_consent("u4", "vegans")
+        await store.sweep()
+        assert store.get_stats()["entries"] == 3
+        assert await store.get_consent("u4") == "vegans"
+
+    asyncio.run(scenario())
+
+
+def test_lock_serializes_turns_of_one_user():
+    store = InMemorySessionStore(5, 3600, 10, 10)
+    order = []
+
+    async def turn(name: str):
+        async with store.lock("u1"):
+            order.append(f"{name}:start")
+            await asyncio.sleep(0.01)
+            order.append(f"{name}:end")
+
+    async def scenario():
+        await asyncio.gather(turn("a"), turn("b"))
+        assert store.get_stats()["locked_users"] == 0
+
+    asyncio.run(scenario())
+    assert order == ["a:start", "a:end", "b:start", "b:end"]
+
+
+def test_histories_are_counted_and_capped_apart_from_sessions(store):
+    async def scenario():
+        for user in ("u1", "u2", "u3"):
+            await store.set_consent(user, "vegans")
+        for user in ("u1", "u2", "u3", "u4", "u5"):
+            await store.put_history(user, "[]")
+        await store.sweep()
+
+        stats = store.get_stats()
+        assert stats["entries"] == 3
+        assert stats["history_entries"] == 3
+        # Истории не вытесняют сессии сценариев
+        for user in ("u1", "u2", "u3"):
+            assert await store.get_consent(user) == "vegans"
+        assert await store.get_history("u5") == "[]"
+        assert await store.get_history("u1") is None
+
+    asyncio.run(scenario())
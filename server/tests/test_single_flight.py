@@ -0,0 +1,124 @@
+import asyncio
+import time
+
+import pytest
+
+from services.context_var import DeadlineExceededError, deadline_var, time_left
+from services.LLMService import _InFlightTable
+
+
+class _Upstream:
+    """Управляемый общий вызов: считает запуски, отмены и дедлайн, с которым он выполнялся"""
+
+    def __init__(self):
+        self.started = 0
+        self.cancelled = 0
+        self.time_left = []
+        self.release = asyncio.Event()
+
+    async def call(self) -> str:
+        self.started += 1
+        self.time_left.append(time_left())
+        try:
+            await self.release.wait()
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return "answer"
+
+
+async def _wait(table: _InFlightTable, upstream: _Upstream, timeout: float = None) -> str:
+    if timeout is not None:
+        deadline_var.set(time.monotonic() + timeout)
+    return await table.run("key", upstream.call)
+
+
+def test_identical_calls_share_one_upstream_request():
+    async def scenario():
+        table, upstream = _InFlightTable(), _Upstream()
+        waiters = [asyncio.create_task(_wait(table, upstream)) for _ in range(3)]
+        await asyncio.sleep(0)
+        upstream.release.set()
+        assert await asyncio.gather(*waiters) == ["answer"] * 3
+        assert upstream.started == 1
+        assert table.get_stats() == {"in_flight": 0, "leaders": 1, "coalesced": 2, "cancelled": 0}
+
+    asyncio.run(scenario())
+
+
+def test_upstream_is_cancelled_only_when_the_last_waiter_leaves():
+    async def scenario():
+        table, upstream = _InFlightTable(), _Upstream()
+        first = asyncio.create_task(_wait(table, upstream))
+        second = asyncio.create_task(_wait(table, upstream))
+        await asyncio.sleep(0)
+
+        first.cancel()
+        await asyncio.gather(first, return_exceptions=True)
+        await asyncio.sleep(0)
+        assert upstream.cancelled == 0
+
+        second.cancel()
+        await asyncio.gather(second, return_exceptions=True)
+        await asyncio.sleep(0)
+        assert upstream.cancelled == 1
+        assert table.get_stats()["cancelled"] == 1
+        assert table.get_stats()["in_flight"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_shared_call_does_not_inherit_the_leader_deadline():
+    async def scenario():
+        table, upstream = _InFlightTable(), _Upstream()
+        leader = asyncio.create_task(_wait(table, upstream, timeout=0.05))
+        follower = asyncio.create_task(_wait(table, upstream, timeout=5))
+        await asyncio.sleep(0)
+
+        with pytest.raises(DeadlineExceededError):
+            await leader
+        assert upstream.cancelled == 0
+
+        upstream.release.set()
+        assert await follower == "answer"
+        assert upstream.time_left == [None]
+
+    asyncio.run(scenario())
+
+
+def test_all_waiters_timing_out_cancels_the_upstream_call():
+    async def scenario():
+        table, upstream = _InFlightTable(), _Upstream()
+        results = await asyncio.gather(
+            _wait(table, upstream, timeout=0.02), _wait(table, upstream, timeout=0.04), return_exceptions=True
+        )
+        await asyncio.sleep(0)
+        assert all(isinstance(result, DeadlineExceededError) for result in results)
+        assert upstream.cancelled == 1
+
+    asyncio.run(scenario())
+
+
+def test_new_call_after_completion_starts_a_new_request():
+    async def scenario():
+        table, upstream = _InFlightTable(), _Upstream()
+        upstream.release.set()
+        await _wait(table, upstream)
+        await _wait(table, upstream)
+        assert upstream.started == 2
+
+    asyncio.run(scenario())
+
+
+def test_upstream_error_reaches_every_waiter():
+    async def failing() -> str:
+        await asyncio.sleep(0.01)
+        raise RuntimeError("upstream failed")
+
+    async def scenario():
+        table = _InFlightTable()
+        results = await asyncio.gather(table.run("key", failing), table.run("key", failing), return_exceptions=True)
+        assert [str(result) for result in results] == ["upstream failed"] * 2
+        assert table.get_stats()["coalesced"] == 1
+
+    asyncio.run(scenario())